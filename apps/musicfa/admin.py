@@ -1,21 +1,26 @@
 import re
 
 from django.contrib import admin, messages
-from django.db.models import Count
+from django.db.models import Max
 from django.urls import reverse_lazy
+from django.utils import timezone
+from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
 from django_better_admin_arrayfield.admin.mixins import DynamicArrayMixin
-from import_export.admin import ExportActionMixin
 
 from .crawler import Crawler
-from .models import CMusic, Album, Artist
-from .export_admin import AlbumResource, CMusicResource, ArtistResource
-from .tasks import create_single_music_post_task, create_album_post_task, create_artist_wordpress_task
+from .models import CMusic, Album, Artist, PublishOutbox
+from .export_admin import AlbumResource, CMusicResource, ArtistResource, BackgroundExportActionMixin
+from .tasks import (
+    create_single_music_post_task, create_album_post_task, create_artist_wordpress_task, publish_to_wordpress,
+    dispatch_outbox_task
+)
 from .views import start_new_crawl
-from .utils import checking_task_status, PersianNameHandler
+from .utils import checking_task_status, PersianNameHandler, PublishProgress
 from .forms import CMusicForm
+from .admin_changelist import KeysetPaginationMixin, LightChangeListMixin, related_count
 from .admin_filters import (
     AlbumFilter, ArtistFilter, AutoFilter, WebsiteCrawledFilter, WPIDNullFilterSpec,
     MusicAlbumWPIDArtistNullFilterSpec, AlbumNameFaNullFilterSpec, SongNameFaNullFilterSpec,
@@ -36,17 +41,38 @@ class CMusicInline(admin.TabularInline):
     def has_add_permission(self, request, obj):
         return False
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('lyrics', 'title_tag')
+
     def get_download_link(self, obj):
         return mark_safe(f'<a href="{obj.link_mp3_320}">320 link</a>    <a href="{obj.link_mp3_128}">128 link</a>')
 
     get_download_link.short_description = _('download link')
 
 
+class PublishProgressMixin:
+    """
+    Showing the progress of the WordPress publishes of user in the changelist.
+    """
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method == 'GET':
+            for summary in PublishProgress.pop_user_summaries(request.user.id):
+                level = messages.SUCCESS if summary['finished'] else messages.INFO
+                messages.add_message(request, level, _(
+                    f"Publishing {summary['total']} {summary['name']} on wordpress "
+                    f"{'is finished' if summary['finished'] else 'is running'}: "
+                    f"{summary['published']} published, {summary['failed']} failed"
+                ))
+        return super().changelist_view(request, extra_context)
+
+
 class ModelAdminDisplayTaskStatus(admin.ModelAdmin, AutoFilter):
 
     def changelist_view(self, request, extra_context=None):
         response = super().changelist_view(request, extra_context)
-        if request.method == 'GET':
+        # invalid lookup parameters are redirected
+        if request.method == 'GET' and hasattr(response, 'context_data'):
             response.context_data['crawl_status_nic'] = checking_task_status('collect_musics_nic')
             response.context_data['crawl_status_ganja'] = checking_task_status('collect_musics_ganja')
         return response
@@ -61,24 +87,30 @@ class ModelAdminDisplayTaskStatus(admin.ModelAdmin, AutoFilter):
 
 
 @admin.register(CMusic)
-class CMusicAdmin(ExportActionMixin, ModelAdminDisplayTaskStatus):
+class CMusicAdmin(
+        KeysetPaginationMixin, LightChangeListMixin, PublishProgressMixin, BackgroundExportActionMixin,
+        ModelAdminDisplayTaskStatus
+):
     form = CMusicForm
     resource_class = CMusicResource
     change_form_template = 'changes.html'
     change_list_template = 'change_list.html'
     raw_id_fields = ['artist']
-    actions = (*ExportActionMixin.actions, 'send_to_WordPress', 'translate', 'update_artist')
+    actions = (*BackgroundExportActionMixin.actions, 'send_to_WordPress', 'translate', 'update_artist')
     list_display = (
         "name", 'artist', "title", "post_type", 'status', 'is_downloaded', 'album', 'created_time', 'website_name'
     )
+    list_select_related = ['artist', 'album']
+    changelist_defer = ('lyrics', 'title_tag')
     list_filter = [
         ArtistFilter, AlbumFilter, WebsiteCrawledFilter, WPIDNullFilterSpec, MusicAlbumWPIDArtistNullFilterSpec,
         'created_time', 'published_date', 'is_downloaded',
         'post_type', 'status', SongNameFaNullFilterSpec
     ]
-    search_fields = ['song_name_fa', 'song_name_en']
+    search_fields = ['song_name_fa__ilike_contains', 'song_name_en__ilike_contains']
     readonly_fields = [
-        'album', 'get_thumbnail', 'site_id', 'is_downloaded', 'wp_post_id', 'published_date', 'album', 'post_type'
+        'album', 'get_thumbnail', 'site_id', 'is_downloaded', 'wp_post_id', 'published_date', 'album', 'post_type',
+        'website'
     ]
     ordering = ['-id']
     fieldsets = (
@@ -86,7 +118,7 @@ class CMusicAdmin(ExportActionMixin, ModelAdminDisplayTaskStatus):
         (
             'Extra Data', {
                 'classes': ('collapse',), 'fields': (
-                    'page_url', 'site_id', 'post_type', 'wp_category_id', 'wp_post_id', 'is_downloaded',
+                    'page_url', 'website', 'site_id', 'post_type', 'wp_category_id', 'wp_post_id', 'is_downloaded',
                     'published_date'
                 )
             }
@@ -123,60 +155,61 @@ class CMusicAdmin(ExportActionMixin, ModelAdminDisplayTaskStatus):
 
         queryset = queryset.exclude(artist__wp_id='')
         # creating the album post from tracks of it
-        create_album_post_task.apply_async(
-            args=tuple(
-                [
-                    q.album_id
-                    for q in queryset.filter(
-                        post_type=CMusic.ALBUM_MUSIC_TYPE
-                    ).order_by('album_id').distinct('album_id')
-                ]
-            )
-        )
+        album_ids = queryset.filter(
+            post_type=CMusic.ALBUM_MUSIC_TYPE
+        ).order_by('album_id').distinct('album_id').values_list('album_id', flat=True)
+        if album_ids:
+            publish_to_wordpress(create_album_post_task, 'album', album_ids, request.user.id)
         # creating single music post
-        create_single_music_post_task.apply_async(
-            args=tuple(
-                [q.id for q in queryset.filter(post_type=CMusic.SINGLE_TYPE)]
-            )
-        )
+        music_ids = queryset.filter(post_type=CMusic.SINGLE_TYPE).values_list('id', flat=True)
+        if music_ids:
+            publish_to_wordpress(create_single_music_post_task, 'music', music_ids, request.user.id)
         messages.info(request, _('selected musics created at wordpress!'))
 
     def translate(self, request, queryset):
         messages.info(request, _('wait...'))
-        number = PersianNameHandler.update_single_musics(queryset.filter(page_url__contains='ganja2music'))
+        number = PersianNameHandler.update_single_musics(queryset.filter(website=CMusic.GANJA2MUSIC_WEBSITE))
         messages.info(request, _(f'{number} Music updated. Translate is complete!'))
 
     def update_artist(self, request, queryset):
+        crawler = Crawler()
         for music in queryset:
             name = re.compile(r'(?<=By )[a-zA-Z ]+').findall(music.title)
             if name:
-                artist = Crawler().create_artist(name_en=name[0])
+                artist = crawler.create_artist(name_en=name[0])
                 music.artist = artist
                 music.save()
         messages.info(request, _(f'Artists updated'))
 
 
 @admin.register(Album)
-class AlbumAdmin(ExportActionMixin, ModelAdminDisplayTaskStatus):
+class AlbumAdmin(
+        KeysetPaginationMixin, LightChangeListMixin, PublishProgressMixin, BackgroundExportActionMixin,
+        ModelAdminDisplayTaskStatus
+):
     resource_class = AlbumResource
     change_form_template = 'changes.html'
     change_list_template = 'change_list.html'
     inlines = [CMusicInline]
     raw_id_fields = ['artist']
     list_display = ("name", 'artist', 'status', 'created_time', 'get_track_number', 'website_name')
-    search_fields = ['album_name_en', 'album_name_fa', 'title']
+    list_select_related = ['artist']
+    changelist_defer = ('title_tag',)
+    search_fields = ['album_name_en__ilike_contains', 'album_name_fa__ilike_contains', 'title__ilike_contains']
     list_filter = [
         ArtistFilter, WebsiteCrawledFilter, 'created_time', 'published_date', 'is_downloaded', 'status',
         AlbumNameFaNullFilterSpec, WPIDNullFilterSpec, MusicAlbumWPIDArtistNullFilterSpec
     ]
     ordering = ['-id']
-    readonly_fields = ['get_thumbnail', 'site_id', 'wp_post_id']
-    actions = (*ExportActionMixin.actions, 'send_to_WordPress', 'translate')
+    readonly_fields = ['get_thumbnail', 'site_id', 'wp_post_id', 'website']
+    actions = (*BackgroundExportActionMixin.actions, 'send_to_WordPress', 'translate')
     fieldsets = (
         ('Album', {'fields': ('title', 'title_tag', 'album_name_en', 'album_name_fa', 'artist', 'status')}),
         (
             'Extra Data', {
-                'classes': ('collapse',), 'fields': ('page_url', 'site_id', 'wp_category_id', 'wp_post_id')
+                'classes': ('collapse',), 'fields': (
+                    'page_url', 'website', 'site_id', 'wp_category_id', 'wp_post_id'
+                )
             }
         ),
         ('Links', {'classes': ('collapse',), 'fields': (
@@ -195,6 +228,9 @@ class AlbumAdmin(ExportActionMixin, ModelAdminDisplayTaskStatus):
 
         return super().change_view(request, object_id, **kwargs)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_tracks=related_count(CMusic, 'album'))
+
     # custom fields
     def get_thumbnail(self, obj):
         from django.utils.html import escape
@@ -204,9 +240,10 @@ class AlbumAdmin(ExportActionMixin, ModelAdminDisplayTaskStatus):
     get_thumbnail.short_description = _('current thumbnail')
 
     def get_track_number(self, obj):
-        return CMusic.objects.filter(album=obj).count()
+        return obj._tracks
 
-    get_track_number.short_description = _('current thumbnail')
+    get_track_number.short_description = _('tracks number')
+    get_track_number.admin_order_field = '_tracks'
 
     # actions
     def send_to_WordPress(self, request, queryset):
@@ -214,7 +251,7 @@ class AlbumAdmin(ExportActionMixin, ModelAdminDisplayTaskStatus):
         for q in not_approved_artists:
             messages.error(request, _(f'please approve artist of this album {q}'))
 
-        create_album_post_task.apply_async(args=([q.id for q in queryset]))
+        publish_to_wordpress(create_album_post_task, 'album', queryset.values_list('id', flat=True), request.user.id)
         messages.info(request, _('selected albums created at wordpress!'))
 
     def translate(self, request, queryset):
@@ -224,21 +261,28 @@ class AlbumAdmin(ExportActionMixin, ModelAdminDisplayTaskStatus):
 
 
 @admin.register(Artist)
-class ArtistAdmin(ExportActionMixin, admin.ModelAdmin, DynamicArrayMixin):
+class ArtistAdmin(
+        LightChangeListMixin, PublishProgressMixin, BackgroundExportActionMixin, admin.ModelAdmin, DynamicArrayMixin
+):
     resource_class = ArtistResource
     change_form_template = 'changes.html'
     list_display = [
         'name', 'name_en', 'name_fa', 'note', 'wp_id', 'created_time', 'updated_time', 'albums', 'single_musics',
         'is_approved'
     ]
-    search_fields = ['name_en', 'name_fa', 'note', 'wp_id']
+    search_fields = [
+        'name_en__ilike_contains', 'name_fa__ilike_contains', 'note__ilike_contains', 'wp_id__ilike_contains'
+    ]
     list_filter = [
         ArtistNameFaNullFilterSpec, WPIDArtistNullFilterSpec, BIOArtistNullFilterSpec, ImageArtistNullFilterSpec,
         'is_approved'
     ]
     readonly_fields = ('id', 'updated_time', 'created_time', 'songs_of_artist', 'albums_of_artist')
     ordering = ['-id']
-    actions = [*ExportActionMixin.actions, 'send_to_WordPress', 'translate', 'approve_artists']
+    changelist_defer = ('description',)
+    # number of the songs and albums that are listed in the change form of artist
+    related_objects_limit = 50
+    actions = [*BackgroundExportActionMixin.actions, 'send_to_WordPress', 'translate', 'approve_artists']
 
     def change_view(self, request, object_id, **kwargs):
         if '_send_to_wp' in request.POST:
@@ -255,8 +299,8 @@ class ArtistAdmin(ExportActionMixin, admin.ModelAdmin, DynamicArrayMixin):
     def get_queryset(self, request):
         queryset = super().get_queryset(request)
         queryset = queryset.annotate(
-            _albums=Count('album', distinct=True),
-            _single_music=Count('cmusic', distinct=True)
+            _albums=related_count(Album, 'artist'),
+            _single_music=related_count(CMusic, 'artist')
         )
         return queryset
 
@@ -268,8 +312,9 @@ class ArtistAdmin(ExportActionMixin, admin.ModelAdmin, DynamicArrayMixin):
                 messages.error(request, _(f'ID: {q.id} this artist is not approved!'))
 
         # sending the approved artists
-        create_artist_wordpress_task.apply_async(
-            args=(list(queryset.filter(is_approved=True).values_list('id', flat=True)))
+        publish_to_wordpress(
+            create_artist_wordpress_task, 'artist', queryset.filter(is_approved=True).values_list('id', flat=True),
+            request.user.id
         )
         messages.info(request, _('selected artist created at wordpress!'))
 
@@ -309,17 +354,55 @@ class ArtistAdmin(ExportActionMixin, admin.ModelAdmin, DynamicArrayMixin):
     albums.admin_order_field = '_albums'
 
     # custom fields
-    def get_a_tags(self, obj, field_rel, admin_name):
-        return ''.join([
-            f'{i}- <a href={reverse_lazy(f"admin:musicfa_{admin_name}_change", args=(m.id,))}>{m.name}</a></br>'
-            for i, m in enumerate(getattr(obj, field_rel).all(), 1)
+    def get_a_tags(self, obj, field_rel, admin_name, total):
+        objects = getattr(obj, field_rel).order_by('-id')[:self.related_objects_limit]
+        tags = ''.join([
+            f'{i}- <a href={reverse_lazy(f"admin:musicfa_{admin_name}_change", args=(m.id,))}>{escape(m.name)}</a></br>'
+            for i, m in enumerate(objects, 1)
         ])
+        if total > self.related_objects_limit:
+            url = f'{reverse_lazy(f"admin:musicfa_{admin_name}_changelist")}?artist__id__exact={obj.id}'
+            tags += f'<a href="{url}">{_("all")} {total}</a>'
+        return tags
 
     def songs_of_artist(self, obj):
-        return mark_safe(self.get_a_tags(obj, 'cmusic_set', 'cmusic'))
+        return mark_safe(self.get_a_tags(obj, 'cmusic_set', 'cmusic', obj._single_music))
 
     def albums_of_artist(self, obj):
-        return mark_safe(self.get_a_tags(obj, 'album_set', 'album'))
+        return mark_safe(self.get_a_tags(obj, 'album_set', 'album', obj._albums))
+
+
+@admin.register(PublishOutbox)
+class PublishOutboxAdmin(admin.ModelAdmin):
+    list_display = (
+        'idempotency_key', 'operation', 'object_type', 'object_id', 'status', 'attempts', 'available_time',
+        'updated_time'
+    )
+    list_filter = ('status', 'operation', 'object_type')
+    search_fields = ('idempotency_key',)
+    readonly_fields = (
+        'object_type', 'object_id', 'operation', 'idempotency_key', 'status', 'attempts', 'available_time',
+        'batch_id', 'error', 'created_time', 'updated_time'
+    )
+    ordering = ['-id']
+    actions = ['retry_operations']
+
+    def has_add_permission(self, request):
+        return False
+
+    def retry_operations(self, request, queryset):
+        pending_keys = PublishOutbox.objects.filter(status=PublishOutbox.PENDING_STATUS).values('idempotency_key')
+        # an operation that is retried and failed again has several failed rows, just its latest one is queued
+        latest_ids = queryset.filter(status=PublishOutbox.FAILED_STATUS).exclude(
+            idempotency_key__in=pending_keys
+        ).values('idempotency_key').annotate(latest_id=Max('id')).values('latest_id')
+        number = PublishOutbox.objects.filter(id__in=latest_ids).update(
+            status=PublishOutbox.PENDING_STATUS, attempts=0, available_time=timezone.now()
+        )
+        dispatch_outbox_task.delay()
+        messages.info(request, _(f'{number} failed operations will be retried.'))
+
+    retry_operations.short_description = _('retry failed operations')
 
 
 admin.site.empty_value_display = "Empty"
@@ -0,0 +1,163 @@
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+
+# cursor parameters of the changelist pages, id of the last row of current page for the next page and
+# id of the first row for the previous page.
+BEFORE_VAR = 'before_id'
+AFTER_VAR = 'after_id'
+
+
+def related_count(model, field_name):
+    """
+    Count of `model` objects that their `field_name` is the outer object, as a correlated subquery. Unlike
+    `Count` with join it's computed only for the rows of the page.
+    :param model: related model, etc. CMusic
+    :param field_name: foreign key of related model to the annotated model, etc. album
+    :return: expression to annotate.
+    """
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field_name: OuterRef('pk')}
+        ).order_by().values(field_name).annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+class DeferredChangeList(ChangeList):
+    """
+    `ChangeList` that doesn't load the `changelist_defer` fields of model admin, they are not displayed in the list.
+    """
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer(*self.model_admin.changelist_defer)
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Paginator that doesn't count the big tables exactly. An unfiltered queryset is counted by the estimate of postgres
+    (`pg_class.reltuples`) and a filtered one is counted up to `count_limit`.
+    """
+    count_limit = 10000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.is_approximate = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.has_filters():
+            estimate = self.get_estimate(queryset.model)
+            if estimate > self.count_limit:
+                self.is_approximate = True
+                return estimate
+
+        count = queryset.order_by()[:self.count_limit].count()
+        self.is_approximate = count >= self.count_limit
+        return count
+
+    @staticmethod
+    def get_estimate(model):
+        """
+        :return: number of rows of model table that postgres estimated by the last analyze, -1 if it's unknown.
+        """
+        if connection.vendor != 'postgresql':
+            return -1
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row else -1
+
+
+class KeysetChangeList(DeferredChangeList):
+    """
+    The pages that are ordered by `-id` (the default ordering) are paginated by cursor (`before_id` and `after_id`)
+    instead of OFFSET. The pages that are ordered by other columns or requested by page number are paginated by
+    the default pagination.
+    """
+    keyset_pagination = False
+    previous_url = None
+    next_url = None
+    first_url = None
+
+    def get_queryset(self, request):
+        # cursors are removed from params like the page number, so the links of filters and ordering don't keep them
+        self.before_id = self.get_cursor(self.params.pop(BEFORE_VAR, None))
+        self.after_id = self.get_cursor(self.params.pop(AFTER_VAR, None))
+        return super().get_queryset(request)
+
+    @staticmethod
+    def get_cursor(value):
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise IncorrectLookupParameters(f'invalid cursor: {value}')
+
+    def get_results(self, request):
+        if ORDER_VAR in self.params or PAGE_VAR in request.GET or self.show_all:
+            return super().get_results(request)
+
+        before, after = self.before_id, self.after_id
+        per_page = self.list_per_page
+        if after is not None:
+            # previous page, rows after the cursor by ascending order
+            result_list = list(self.queryset.filter(pk__gt=after).order_by('pk')[:per_page + 1])
+            has_previous = len(result_list) > per_page
+            result_list = result_list[:per_page][::-1]
+            has_next = True
+            if not has_previous:
+                # the first page is shown instead of a short previous page
+                before = after = None
+
+        if after is None:
+            queryset = self.queryset if before is None else self.queryset.filter(pk__lt=before)
+            result_list = list(queryset[:per_page + 1])
+            has_next = len(result_list) > per_page
+            result_list = result_list[:per_page]
+            has_previous = before is not None
+
+        paginator = self.model_admin.get_paginator(request, self.queryset, per_page)
+        self.result_count = paginator.count
+        self.show_full_result_count = self.model_admin.show_full_result_count
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = result_list
+        self.can_show_all = False
+        self.multi_page = has_previous or has_next
+        self.paginator = paginator
+
+        self.keyset_pagination = True
+        if result_list and has_previous:
+            self.first_url = self.get_query_string()
+            self.previous_url = self.get_query_string({AFTER_VAR: result_list[0].pk})
+        if result_list and has_next:
+            self.next_url = self.get_query_string({BEFORE_VAR: result_list[-1].pk})
+
+
+class LightChangeListMixin:
+    """
+    `admin.ModelAdmin` mixin that defers the heavy columns of the changelist. The queries of the changelist pages
+    are kept constant by the tests (`ChangeListQueryTests`).
+    """
+    changelist_defer = ()
+
+    def get_changelist(self, request, **kwargs):
+        return DeferredChangeList
+
+
+class KeysetPaginationMixin:
+    """
+    `admin.ModelAdmin` mixin for the big tables, the changelist is paginated by `KeysetChangeList` and counted by
+    `ApproximateCountPaginator`.
+    """
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
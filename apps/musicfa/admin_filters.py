@@ -81,13 +81,11 @@ class WebsiteCrawledFilter(SimpleListFilter):
     parameter_name = 'website'
 
     def lookups(self, request, model_admin):
-        return (1, _('nic music')), (0, _('ganja2'))
+        return model_admin.model.WEBSITE_CHOICES
 
     def queryset(self, request, queryset):
-        if self.value() == "0":
-            return queryset.filter(page_url__contains='ganja2music')
-        if self.value() == "1":
-            return queryset.filter(page_url__contains='nicmusic')
+        if self.value():
+            return queryset.filter(website=self.value())
 
         return queryset
 
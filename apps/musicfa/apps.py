@@ -1,7 +1,49 @@
 from django.apps import AppConfig
+from django.core.checks import Warning, register
+from django.db.models.signals import pre_migrate
+
+# cache backends that each process has its own cache
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def create_extensions(using, **kwargs):
+    """
+    Creating the postgres extensions that the indexes of models need (`gin_trgm_ops` of pg_trgm),
+    it runs before the migrations so the indexes could be created by them.
+    """
+    from django.db import connections
+
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+def check_shared_cache(app_configs, **kwargs):
+    """
+    The publish progress, the publish slots and the WordPress token are kept in cache, the web and worker
+    processes should share it. It's a warning since the other commands (etc. migrate) and the crawl don't need it.
+    """
+    from django.conf import settings
+
+    backend = settings.CACHES['default']['BACKEND']
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        f'{backend} is not shared between the web and worker processes.',
+        hint="Set CACHE_BACKEND to a shared cache, etc. 'django.core.cache.backends.db.DatabaseCache' or memcached.",
+        id='musicfa.W001',
+    )]
 
 
 class MusicfaConfig(AppConfig):
     name = 'apps.musicfa'
     verbose_name = 'delnava'
 
+    def ready(self):
+        pre_migrate.connect(create_extensions, sender=self)
+        register(check_shared_cache)
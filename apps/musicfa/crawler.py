@@ -1,18 +1,31 @@
+import os
 import re
+import json
+import time
 import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import closing
 from datetime import datetime
+from itertools import islice
 from urllib.parse import unquote, urlparse
 
+from django.conf import settings
 from django.core.validators import URLValidator
 from django.core.files import File
 from django.core.files.temp import NamedTemporaryFile
+from django.db import DEFAULT_DB_ALIAS, connections, transaction, IntegrityError
+from django.utils import timezone
 
 import requests
 from bs4 import BeautifulSoup
 from django.db.models import Q
 from khayyam import JalaliDate
 
-from .models import CMusic, Album, Artist
+from .models import CMusic, Album, Artist, MediaBlob, MediaReference
+from .sessions import get_session
+from .utils import get_sha256
 
 months = ["ژانویه", "فوریه", "مارس", "آوریل", "می", "ژوئن", "جولای", "آگوست", "سپتامبر", "اکتبر", "نوامبر", "دسامبر"]
 jalali_months = ["فروردین", "اردیبهشت", "خرداد", "تیر", "مرداد", "شهریور", "مهر", "آبان", "آذر", "دی", "بهمن", "اسفند"]
@@ -20,12 +33,187 @@ alpha = "A aB bC cD dE eF fG gH hI iJ jK kL lM mN nO oP pQ qR rS sT tU uV vW wX
 logger = logging.getLogger(__name__)
 
 
+class BulkWriter:
+    """
+    Buffering the crawled CMusic and Album rows to insert them by `bulk_create` in batches, the rows that their
+    site id is already exist are ignored (same as `get_or_create` by site id).
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.CRAWLER_WRITE_BATCH_SIZE
+        self.musics = []
+        self.albums = []  # (album, tracks of album)
+
+    def add_music(self, site_id, defaults):
+        self.musics.append(CMusic(**{**defaults, 'site_id': site_id}))
+        if len(self.musics) >= self.batch_size:
+            self.flush()
+
+    def add_album(self, site_id, defaults, tracks):
+        """
+        :param site_id: site id of album.
+        :param defaults: fields of album.
+        :param tracks: list of (site_id, defaults) of the album-musics, album and artist of them are set by the
+         inserted album.
+        """
+        album = Album(**{**defaults, 'site_id': site_id})
+        self.albums.append((album, [CMusic(**{**d, 'site_id': track_site_id}) for track_site_id, d in tracks]))
+        if len(self.albums) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.albums:
+            self.insert(Album, [album for album, tracks in self.albums])
+            album_ids = {
+                site_id: (album_id, artist_id)
+                for site_id, album_id, artist_id in Album.objects.filter(
+                    site_id__in=[album.site_id for album, tracks in self.albums]
+                ).values_list('site_id', 'id', 'artist_id')
+            }
+            for album, tracks in self.albums:
+                if album.site_id not in album_ids:  # inserting the album failed
+                    continue
+                for track in tracks:
+                    track.album_id, track.artist_id = album_ids[album.site_id]
+                    self.musics.append(track)
+            self.albums = []
+
+        if self.musics:
+            self.insert(CMusic, self.musics)
+            self.musics = []
+
+    def insert(self, cls, objs):
+        """
+        :param cls: CMusic or Album.
+        :param objs: objects of cls, if the batch insert failed they are inserted one by one.
+        :return: None
+        """
+        try:
+            cls.objects.bulk_create(objs, ignore_conflicts=True)
+            logger.debug(f'[{len(objs)} {cls.__name__} inserted]')
+        except Exception as e:
+            logger.warning(f'[bulk insert failed, inserting one by one]-[exc: {e}]-[model: {cls.__name__}]')
+            for obj in objs:
+                try:
+                    cls.objects.bulk_create([obj], ignore_conflicts=True)
+                except Exception as e:
+                    logger.warning(f'[creating {cls.__name__} failed]-[exc: {e}]-[site_id: {obj.site_id}]')
+
+
+class ArtistResolver:
+    """
+    In memory index of artists by their normalized names (name_en, name_fa and correct_names). The index is
+    loaded once by `warm` and the new artists are added to it, database is queried just for the missed names.
+    """
+    # when a name belongs to several artists, name_fa wins over correct_names and correct_names over name_en
+    NAME_FA_PRIORITY = 0
+    CORRECT_NAMES_PRIORITY = 1
+    NAME_EN_PRIORITY = 2
+    # the index of a worker process is shared by its pipeline tasks, it's loaded again after the timeout so the
+    # merged or deleted artists are dropped
+    shared = None
+    shared_timeout = 60 * 60
+
+    def __init__(self):
+        self.index = {}  # normalized name: (priority, artist id)
+        self.artists = {}  # artist id: artist
+        self.warmed_time = None
+
+    @classmethod
+    def get_shared(cls):
+        """
+        :return: the warmed index of current process.
+        """
+        if cls.shared is None or time.monotonic() - cls.shared.warmed_time > cls.shared_timeout:
+            cls.shared = cls()
+            cls.shared.warm()
+        return cls.shared
+
+    @staticmethod
+    def normalize(name):
+        return ' '.join(name.split()).casefold()
+
+    def warm(self):
+        for artist in Artist.objects.only('id', 'name_en', 'name_fa', 'correct_names').order_by('id').iterator():
+            self.add(artist)
+        self.warmed_time = time.monotonic()
+        logger.info(f'[artist index loaded]-[artists: {len(self.artists)}]-[names: {len(self.index)}]')
+
+    def add(self, artist):
+        self.artists[artist.id] = artist
+        names = [(artist.name_fa, self.NAME_FA_PRIORITY), (artist.name_en, self.NAME_EN_PRIORITY)] + [
+            (name, self.CORRECT_NAMES_PRIORITY) for name in artist.correct_names or []
+        ]
+        for name, priority in names:
+            key = self.normalize(name or '')
+            if key and (key not in self.index or priority < self.index[key][0]):
+                self.index[key] = (priority, artist.id)
+
+    def get(self, name):
+        """
+        :param name: name of artist.
+        :return: Artist or None.
+        """
+        key = self.normalize(name)
+        if not key:
+            return None
+        if key in self.index:
+            return self.artists[self.index[key][1]]
+
+        artist = Artist.objects.only('id', 'name_en', 'name_fa', 'correct_names').filter(
+            Q(correct_names__contains=[name]) | Q(name_fa=name) | Q(name_en__ilike=name)
+        ).first()
+        if artist is not None:
+            self.add(artist)
+        return artist
+
+
 class Crawler:
+    # post type of the albums, the single musics are `CMusic.SINGLE_TYPE`
+    ALBUM_POST = 'album'
+
     category_id = 0
     website_name = ''
+    pool_maxsize = settings.CRAWLER_POOL_MAXSIZE
+    host_pool_sizes = settings.CRAWLER_HOST_POOL_SIZES
+    discovery_concurrency = settings.CRAWLER_DISCOVERY_CONCURRENCY
+    discovery_lookahead = settings.CRAWLER_DISCOVERY_LOOKAHEAD
+    download_chunk_size = settings.CRAWLER_DOWNLOAD_CHUNK_SIZE
+    download_max_size = settings.CRAWLER_DOWNLOAD_MAX_SIZE
+    partial_root = settings.CRAWLER_PARTIAL_ROOT
+    download_workers = settings.CRAWLER_DOWNLOAD_WORKERS
+    download_host_workers = settings.CRAWLER_DOWNLOAD_HOST_WORKERS
+    download_batch_size = settings.CRAWLER_DOWNLOAD_BATCH_SIZE
+    # the same file (etc. cover of album) could be downloaded by two workers, each partial file has one writer
+    partial_locks = [threading.Lock() for _ in range(64)]
+    # a source URL is stored by one worker at a time, the others use its stored file
+    url_locks = [threading.Lock() for _ in range(256)]
 
     def __init__(self):
         logger.info(f'[starting... crawler for {self.website_name}]')
+        self.host_semaphores = {}
+        self.host_semaphores_lock = threading.Lock()
+        # database connections of the download threads, they are closed after the pool is finished
+        self.worker_connections = set()
+        self.worker_connections_lock = threading.Lock()
+        self.writer = BulkWriter()
+        self.artists = ArtistResolver()
+
+    @classmethod
+    def get_session(cls):
+        """
+        Each crawler has its own pooled session that is shared between all instances of it.
+        :return: `requests.Session` object.
+        """
+        return get_session(
+            cls.website_name or 'crawler',
+            pool_maxsize=cls.pool_maxsize,
+            host_pool_sizes=cls.host_pool_sizes
+        )
+
+    @property
+    def session(self):
+        return self.get_session()
 
     def collect_links(self):
         """
@@ -39,16 +227,113 @@ class Crawler:
         Collecting the detail of music.
         """
         logger.info(f'[collect musics starting...]-[website: {self.website_name}]')
+        self.artists.warm()
 
-    def collect_files(self):
+    def collect_files(self, created_before=None):
         """
         Downloading the data of crawled musics that is_downloaded field is False.
+        :param created_before: just the objects that are created before it, etc. the backlog of crawl pipeline.
+        """
+        logger.info(f'[collecting the files]-[website: {self.website_name}]-[created before: {created_before}]')
+
+    def discover_posts(self):
+        """
+        Discovering the links of new posts, the first stage of crawl pipeline.
+        :return: (post type, post URL) of each new post.
+        """
+        return iter(())
+
+    def get_file_names(self, obj):
+        """
+        :param obj: CMusic or Album object.
+        :return: name of the files of obj to download, etc. ['mp3_320', 'thumbnail'].
         """
-        logger.info(f'[collecting the files]-[website: {self.website_name}]')
+        raise NotImplementedError
+
+    @staticmethod
+    def make_post(post_type, site_id, artist, defaults, tracks=None):
+        """
+        A parsed post, it's sent between the stages of crawl pipeline so its values are serializable.
+        :param post_type: `CMusic.SINGLE_TYPE` or `ALBUM_POST`.
+        :param site_id: site id of the music or album.
+        :param artist: names of the artist, the arguments of `create_artist`.
+        :param defaults: fields of the music or album except the artist.
+        :param tracks: list of (site_id, defaults) of the album-musics.
+        """
+        def serializable(fields):
+            # the JSON serializer of celery sends a date as datetime that DateField doesn't accept
+            return {**fields, 'published_date': fields['published_date'].isoformat()}
+
+        return dict(
+            type=post_type,
+            site_id=site_id,
+            artist=artist,
+            defaults=serializable(defaults),
+            tracks=[(track_site_id, serializable(fields)) for track_site_id, fields in tracks or []],
+        )
+
+    def save_post(self, post):
+        """
+        Getting or creating the artist of a parsed post and adding its rows to `writer`.
+        """
+        artist = self.create_artist(**post['artist'])
+        if post['type'] == self.ALBUM_POST:
+            self.create_album(post['site_id'], {**post['defaults'], 'artist': artist}, post['tracks'])
+        else:
+            self.create_music(post['site_id'], {**post['defaults'], 'artist': artist})
+
+    def parse_posts(self, post_type, post_urls):
+        """
+        Fetching and parsing the detail of posts, the parse stage of crawl pipeline.
+        :return: list of the parsed posts.
+        """
+        parse = self.parse_album if post_type == self.ALBUM_POST else self.parse_music
+        posts = []
+        for post_url in post_urls:
+            try:
+                post = parse(post_url)
+            except Exception as e:
+                logger.error(f'[parsing post failed]-[exc: {e}]-[URL: {post_url}]-[website: {self.website_name}]')
+                continue
+            if post:
+                posts.append(post)
+        return posts
+
+    def persist_posts(self, posts):
+        """
+        Saving the parsed posts, the persistence stage of crawl pipeline.
+        :return: dict of model name (cmusic or album) and ids of the saved objects that their files are not
+         downloaded.
+        """
+        self.artists = ArtistResolver.get_shared()
+        for post in posts:
+            self.save_post(post)
+        self.writer.flush()
+
+        album_site_ids = [post['site_id'] for post in posts if post['type'] == self.ALBUM_POST]
+        music_site_ids = [post['site_id'] for post in posts if post['type'] != self.ALBUM_POST] + [
+            track_site_id for post in posts for track_site_id, defaults in post['tracks']
+        ]
+        return {
+            model._meta.model_name: list(model.objects.filter(
+                site_id__in=site_ids, is_downloaded=False
+            ).values_list('id', flat=True))
+            for model, site_ids in ((CMusic, music_site_ids), (Album, album_site_ids)) if site_ids
+        }
+
+    def download_new_files(self, model_name, object_ids):
+        """
+        Downloading the files of the saved objects, the download stage of crawl pipeline.
+        :param model_name: cmusic or album.
+        :param object_ids: ids of the objects.
+        """
+        model = Album if model_name == Album._meta.model_name else CMusic
+        objects = model.objects.filter(id__in=object_ids, is_downloaded=False).order_by('-id')
+        self.download_objects(objects, self.get_file_names)
 
     def make_request(self, url, method='get', **kwargs):
         try:
-            req = requests.request(method, url, **kwargs, )
+            req = self.session.request(method, url, **kwargs)
             req.raise_for_status()
         except requests.exceptions.HTTPError as e:
             logger.critical(f'[make request failed! HTTP ERROR]-[response: {e.response.text}]-[status code: {e.response.status_code}]-[URL: {url}]')
@@ -59,53 +344,375 @@ class Crawler:
 
         return req
 
-    def get_crawled_musics(self):
+    def fetch_pages(self, page_urls):
+        """
+        Fetching the listing pages concurrently while they are yielded in the same order of `page_urls`.
+        `discovery_lookahead` pages are requested ahead of the page that is being parsed and
+        `discovery_concurrency` of them are downloading at the same time.
+        Closing this generator (etc. at the first duplicate post) cancels the pages that are not started yet.
+        :param page_urls: iterable of the listing pages URL.
+        :return: (page URL, response) of each page, response is None if the request failed.
+        """
+        page_urls = iter(page_urls)
+        with ThreadPoolExecutor(max_workers=self.discovery_concurrency) as executor:
+            window = deque(
+                (url, executor.submit(self.make_request, url))
+                for url in islice(page_urls, self.discovery_lookahead)
+            )
+            try:
+                while window:
+                    page_url, future = window.popleft()
+                    for next_url in islice(page_urls, 1):  # keeping the window full
+                        window.append((next_url, executor.submit(self.make_request, next_url)))
+                    try:
+                        page = future.result()
+                    except Exception as e:
+                        logger.error(f'[fetching page failed]-[exc: {e}]-[URL: {page_url}]')
+                        page = None
+                    yield page_url, page
+            finally:
+                for _, future in window:
+                    future.cancel()
+
+    def get_crawled_musics(self, created_before=None):
         """
         Getting the CMusic that file of them is not downloaded.
         :return: A queryset of CMusic.
         """
         logger.debug(f'[getting the crawled music to download the files...]')
-        for c in CMusic.objects.filter(
-                is_downloaded=False,
-                page_url__icontains=self.website_name
-        ).order_by('-id'):
+        musics = CMusic.objects.filter(is_downloaded=False, website=self.website_name)
+        if created_before:
+            musics = musics.filter(created_time__lt=created_before)
+        for c in musics.order_by('-id'):
             yield c
 
-    def get_crawler_album(self):
+    def get_crawler_album(self, created_before=None):
         logger.debug(f'[getting the crawled album to download the files...]')
-        for c in Album.objects.filter(
-                is_downloaded=False,
-                page_url__icontains=self.website_name
-        ).order_by('-id'):
+        albums = Album.objects.filter(is_downloaded=False, website=self.website_name)
+        if created_before:
+            albums = albums.filter(created_time__lt=created_before)
+        for c in albums.order_by('-id'):
             yield c
 
-    @staticmethod
-    def download_content(url):
+    @classmethod
+    def download_content(cls, url):
         """
         :param url: URL of file to download the it.
         :return: File to save in CMusic object.
         """
+        logger.debug(f'[downloading content]-[URL: {url}]')
+        img_temp = NamedTemporaryFile(delete=True)
         try:
-            logger.debug(f'[downloading content]-[URL: {url}]')
-            r = requests.get(url, allow_redirects=False)
+            cls.stream_content(url, img_temp)
         except Exception as e:
-            logger.error(f'[downloading file failed]-[exc: {e}]')
+            logger.error(f'[downloading file failed]-[exc: {e}]-[URL: {url}]')
+            img_temp.close()
             return None
-        img_temp = NamedTemporaryFile(delete=True)
-        img_temp.write(r.content)
-        img_temp.flush()  # deleting the file from RAM
         return File(img_temp, name=unquote(url).split('/')[-1])
 
-    def download_all_files(self, c):
+    @classmethod
+    def stream_content(cls, url, file):
+        """
+        Writing the content of `url` chunk by chunk to `file`, so the whole file is never kept in memory.
+        :param url: URL of file to download the it.
+        :param file: an opened file to write the content to it.
+        :return: size of downloaded content in bytes.
+        """
+        with cls.get_session().get(url, allow_redirects=False, stream=True) as r:
+            r.raise_for_status()
+            return cls.write_response(r, file, url)
+
+    @classmethod
+    def write_response(cls, r, file, url, offset=0):
+        """
+        :param r: a streamed response.
+        :param file: an opened file to write the content to it.
+        :param url: URL of file, just for logging.
+        :param offset: size of the content that is already in `file` (resumed downloads).
+        :return: size of the written content in bytes.
+        """
+        start_time = time.monotonic()
+        size = 0
+        content_length = int(r.headers.get('Content-Length') or 0)
+        if offset + content_length > cls.download_max_size:
+            raise ValueError(f'file is too large ({offset + content_length} bytes)')
+
+        for chunk in r.iter_content(chunk_size=cls.download_chunk_size):
+            size += len(chunk)
+            if offset + size > cls.download_max_size:
+                raise ValueError(f'file is too large (more than {cls.download_max_size} bytes)')
+            file.write(chunk)
+        file.flush()
+
+        elapsed = time.monotonic() - start_time
+        logger.debug(
+            f'[content downloaded]-[size: {size} bytes]-[offset: {offset}]'
+            f'-[speed: {size / elapsed if elapsed else size:.0f} bytes/s]-[URL: {url}]'
+        )
+        return size
+
+    @classmethod
+    def download_file(cls, instance, field_name):
+        """
+        Resumable version of `download_content` for a file field of CMusic or Album, the partial file is kept
+        in `partial_root` by the path that `UploadTo` creates for this field and the next try continues it.
+        :param instance: CMusic or Album object.
+        :param field_name: name of the file without prefix, etc. mp3_128, mp3_320 or thumbnail.
+        :return: File to save in `file_{field_name}` field of instance.
+        """
+        url = getattr(instance, f'link_{field_name}')
+        file_name = unquote(url).split('/')[-1]
+        target_path = instance._meta.get_field(f'file_{field_name}').upload_to(instance, file_name)
+        if not target_path:
+            return cls.download_content(url)
+
+        part_path = os.path.join(cls.partial_root, f'{target_path}.part')
+        with cls.partial_locks[hash(part_path) % len(cls.partial_locks)]:
+            try:
+                cls.resume_content(url, part_path)
+            except Exception as e:
+                logger.error(f'[downloading file failed]-[exc: {e}]-[URL: {url}]-[partial file: {part_path}]')
+                return None
+
+            # the opened file is still readable after removing the partial file
+            part_file = open(part_path, 'rb')
+            os.remove(part_path)
+            os.remove(f'{part_path}.json')
+        return File(part_file, name=file_name)
+
+    @classmethod
+    def delete_expired_partials(cls):
+        """
+        Deleting the partial files (and their `.json`) that are not changed for `CRAWLER_PARTIAL_EXPIRE` seconds,
+        etc. their object is deleted or the download is not tried again. The empty directories are deleted too.
+        :return: number of the deleted partial files.
+        """
+        expired_time = time.time() - settings.CRAWLER_PARTIAL_EXPIRE
+        deleted = 0
+        for directory, _dirs, file_names in os.walk(cls.partial_root, topdown=False):
+            part_paths = {
+                os.path.join(directory, file_name[:-len('.json')] if file_name.endswith('.json') else file_name)
+                for file_name in file_names
+            }
+            for part_path in part_paths:
+                paths = [path for path in (part_path, f'{part_path}.json') if os.path.exists(path)]
+                try:
+                    if all(os.path.getmtime(path) < expired_time for path in paths):
+                        for path in paths:
+                            os.remove(path)
+                        deleted += 1
+                except FileNotFoundError:  # the download is finished meanwhile
+                    continue
+            if directory != cls.partial_root and not os.listdir(directory):
+                try:
+                    os.rmdir(directory)
+                except OSError:  # a download is started meanwhile
+                    pass
+        logger.info(f'[expired partial files deleted]-[count: {deleted}]')
+        return deleted
+
+    @classmethod
+    def resume_content(cls, url, part_path):
+        """
+        Downloading `url` to `part_path`, if a partial file of the same URL exists only the rest of the file is
+        requested by a `Range` header. `ETag` (or `Last-Modified`) and the length of the file are saved next to it
+        (`{part_path}.json`) and the partial content is dropped when the file is changed on the server.
+        :param url: URL of file to download the it.
+        :param part_path: path of the partial file.
+        :return: None, raises an exception if the file is not downloaded completely.
+        """
+        meta_path = f'{part_path}.json'
+        meta = {}
+        if os.path.exists(part_path) and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        if meta.get('url') != url:
+            meta = {}
+
+        offset = os.path.getsize(part_path) if meta else 0
+        validator = meta.get('etag') or meta.get('last_modified')
+        headers = {}
+        if offset and validator:
+            headers = {'Range': f'bytes={offset}-', 'If-Range': validator}
+            logger.debug(f'[resuming download]-[offset: {offset}]-[URL: {url}]')
+
+        with cls.get_session().get(url, headers=headers, allow_redirects=False, stream=True) as r:
+            if r.status_code == 416 and offset == meta.get('length'):  # already downloaded completely
+                return
+            r.raise_for_status()
+
+            if r.status_code == 206:
+                if not r.headers.get('Content-Range', '').endswith(f"/{meta['length']}"):
+                    os.remove(meta_path)  # the file is changed, it will be downloaded from zero at the next try
+                    raise ValueError(f"length of file is changed ({r.headers.get('Content-Range')})")
+                mode = 'ab'
+            else:  # the server sent the whole file
+                offset = 0
+                mode = 'wb'
+                meta = dict(
+                    url=url,
+                    etag=r.headers.get('ETag'),
+                    last_modified=r.headers.get('Last-Modified'),
+                    length=int(r.headers['Content-Length']) if 'Content-Length' in r.headers else None,
+                )
+                os.makedirs(os.path.dirname(part_path), exist_ok=True)
+                with open(meta_path, 'w') as f:
+                    json.dump(meta, f)
+
+            with open(part_path, mode) as part_file:
+                cls.write_response(r, part_file, url, offset)
+
+        size = os.path.getsize(part_path)
+        if meta['length'] is not None and size != meta['length']:
+            raise ValueError(f'incomplete file ({size} of {meta["length"]} bytes)')
+
+    def get_host_semaphore(self, url):
+        """
+        :param url: URL of file.
+        :return: the semaphore that limits the downloads of this URL's host.
+        """
+        host = urlparse(url).netloc
+        with self.host_semaphores_lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.download_host_workers)
+            return self.host_semaphores[host]
+
+    def download_object_files(self, obj, field_names):
+        """
+        Downloading the files of an object and storing them in its file fields, the object is not saved.
+        :param obj: CMusic or Album object.
+        :param field_names: name of the files without prefix, etc. ['mp3_128', 'thumbnail'].
+        :return: the object.
+        """
+        self.add_worker_connection()
+        for field_name in field_names:
+            if self.store_file(obj, field_name):
+                obj.is_downloaded = True
+        return obj
+
+    def add_worker_connection(self):
+        """
+        Each download thread has its own database connection, it's kept for the next objects of the thread and
+        closed by `close_worker_connections`.
+        """
+        worker_connection = connections[DEFAULT_DB_ALIAS]
+        with self.worker_connections_lock:
+            if worker_connection not in self.worker_connections:
+                worker_connection.inc_thread_sharing()  # so it could be closed by the thread of pool owner
+                self.worker_connections.add(worker_connection)
+
+    def close_worker_connections(self):
+        with self.worker_connections_lock:
+            worker_connections, self.worker_connections = self.worker_connections, set()
+        for worker_connection in worker_connections:
+            worker_connection.close()
+            worker_connection.dec_thread_sharing()
+
+    def store_file(self, obj, field_name):
+        """
+        Storing the file of `link_{field_name}` in `file_{field_name}` field of obj. Files are stored by their
+        content (`MediaBlob`), so the same content is stored once and a known URL is not downloaded again.
+        :param obj: CMusic or Album object, it is not saved.
+        :param field_name: name of the file without prefix, etc. mp3_128, mp3_320 or thumbnail.
+        :return: True if the file is stored.
+        """
+        url = getattr(obj, f'link_{field_name}')
+        field_file = getattr(obj, f'file_{field_name}')
+        with self.url_locks[hash(url) % len(self.url_locks)]:
+            reference = MediaReference.objects.select_related('blob').filter(url=url).first()
+            if reference:
+                logger.debug(f'[file found by URL]-[URL: {url}]-[file: {reference.blob}]')
+                blob = reference.blob
+            else:
+                with self.get_host_semaphore(url):
+                    file = self.download_file(obj, field_name)
+                if not file:
+                    return False
+                blob = self.get_or_create_blob(field_file, file)
+                file.close()
+                MediaReference.objects.get_or_create(url=url, defaults=dict(blob=blob))
+
+        setattr(obj, f'file_{field_name}', blob.file.name)
+        return True
+
+    @staticmethod
+    def get_or_create_blob(field_file, file):
+        """
+        :param field_file: the file field that the new content is saved by it (`upload_to` of it is used).
+        :param file: downloaded File.
+        :return: MediaBlob of the file content.
+        """
+        sha256 = get_sha256(file)
+
+        blob = MediaBlob.objects.filter(sha256=sha256).first()
+        if blob:
+            logger.debug(f'[file found by content]-[sha256: {sha256}]-[file: {blob}]')
+            return blob
+
+        field_file.save(file.name, file, save=False)
+        try:
+            return MediaBlob.objects.create(sha256=sha256, file=field_file.name, size=file.size)
+        except IntegrityError:  # stored by another worker at the same time
+            field_file.storage.delete(field_file.name)
+            return MediaBlob.objects.get(sha256=sha256)
+
+    def download_objects(self, objects, get_field_names):
+        """
+        Downloading the files of objects by a pool of `download_workers` threads, the downloads of each host are
+        limited to `download_host_workers` at the same time. The downloaded objects are saved in batches.
+        :param objects: iterable of CMusic or Album objects, etc. `get_crawled_musics()`.
+        :param get_field_names: a function that returns the name of files of an object, etc. ['mp3_320'].
+        :return: None
+        """
+        objects = iter(objects)
+        batch = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.download_workers) as executor:
+                running = set()
+                while True:
+                    # keeping a bounded number of objects in the queue of pool
+                    for obj in islice(objects, self.download_workers * 2 - len(running)):
+                        running.add(executor.submit(self.download_object_files, obj, get_field_names(obj)))
+                    if not running:
+                        break
+
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            batch.append(future.result())
+                        except Exception as e:
+                            logger.error(f'[downloading files failed]-[exc: {e}]-[website: {self.website_name}]')
+
+                    if len(batch) >= self.download_batch_size:
+                        self.save_downloaded_objects(batch)
+                        batch = []
+        finally:
+            self.close_worker_connections()
+        self.save_downloaded_objects(batch)
+
+    def save_downloaded_objects(self, objects):
         """
-        :param c: CMusic object to download file of it
+        :param objects: CMusic or Album objects (same type) that their files are downloaded.
         :return: None
         """
-        c.file_mp3_128 = self.download_content(c.link_mp3_128)
-        c.file_mp3_320 = self.download_content(c.link_mp3_320)
-        c.file_thumbnail = self.download_content(c.link_thumbnail)
-        if c.file_mp3_128 or c.file_mp3_320 or c.file_thumbnail:
-            c.is_downloaded = True
+        if not objects:
+            return
+        model = type(objects[0])
+        fields = ['is_downloaded', 'updated_time'] + [
+            f.name for f in model._meta.get_fields() if f.name.startswith('file_')
+        ]
+        now = timezone.now()
+        for obj in objects:
+            obj.updated_time = now
+        try:
+            model.objects.bulk_update(objects, fields)
+        except Exception as e:
+            logger.error(
+                f'[saving downloaded files failed]-[exc: {e}]-[ids: {[obj.id for obj in objects]}]'
+                f'-[website: {self.website_name}]'
+            )
+        else:
+            logger.info(f'[{len(objects)} {model.__name__} downloaded]-[website: {self.website_name}]')
 
     def fix_jdate(self, date_str, correct_month):
         for i, t in enumerate(correct_month):
@@ -113,34 +720,21 @@ class Crawler:
                 month_text = date_str[date_str.find(t[0]):date_str.find(t[-2]) + 2]
                 return date_str.replace(month_text, f'{i + 1}')
 
-    def create_music(self, **kwargs):
-        try:
-            c_music, created = CMusic.objects.get_or_create(
-                **kwargs
-            )
-            if created:
-                logger.debug(f'[new {c_music.post_type} created]-[id:{c_music.id}]-[album id: {c_music.album_id}]')
-            else:
-                logger.debug(
-                    f'[duplicate {c_music.post_type} found]-[id:{c_music.id}]-[album id: {c_music.album_id}]')
-        except Exception as e:
-            logger.warning(f"[creating music failed]-[exc: {e}]")
+    def create_music(self, site_id, defaults):
+        """
+        The music is inserted by the next flush of `writer`.
+        """
+        self.writer.add_music(site_id, {**defaults, 'website': self.website_name})
 
-    def create_album(self, site_id, defaults):
-        try:
-            album, created = Album.objects.get_or_create(
-                site_id=site_id,
-                defaults=defaults
-            )
-        except Exception as e:
-            logger.warning(f"[Creating album failed]-[exc: {e}]-[site_id: {site_id}]")
-            logger.debug(f"[defaults: {defaults}]")
-            return
-        if created:
-            logger.debug(f'[new album created]-[id: {album.id}]')
-        else:
-            logger.debug(f'[duplicate album found]-[id: {album.id}]')
-        return album
+    def create_album(self, site_id, defaults, tracks):
+        """
+        The album and its tracks are inserted by the next flush of `writer`.
+        """
+        self.writer.add_album(
+            site_id,
+            {**defaults, 'website': self.website_name},
+            [(track_site_id, {**d, 'website': self.website_name}) for track_site_id, d in tracks]
+        )
 
     def create_artist(self, **kwargs):
         artist = None
@@ -150,19 +744,19 @@ class Crawler:
 
         try:
             for name in correct_names:
-                q1 = Artist.objects.filter(Q(correct_names__contains=[name]) | Q(name_fa=name))
-                q2 = Artist.objects.filter(Q(correct_names__iregex=fr'^\b{{name}}\b') | Q(name_fa=name))
-                artist = q1.intersection(q2).first()
-
-                if q1.count() == 0 or q2.count() == 0:
-                    artist = q1.difference(q2).first() or q2.difference(q1).first()
-
+                artist = self.artists.get(name)
                 if artist is not None:
                     break
 
             if artist is None:
-                artist = Artist.objects.create(**kwargs)
-                created = True
+                try:
+                    with transaction.atomic():
+                        artist = Artist.objects.create(**kwargs)
+                    created = True
+                except IntegrityError:
+                    # created by another worker of crawl pipeline at the same time
+                    artist = Artist.objects.get(name_en=kwargs['name_en'])
+                self.artists.add(artist)
 
         except Exception as e:
             logger.error(f"[creating artist failed]-[exc: {e}]-[kwargs: {kwargs}]")
@@ -173,22 +767,23 @@ class Crawler:
             logger.debug(f'[duplicate artist found]-[id: {artist.id}]')
         return artist
 
-    def is_duplicate(self, cls, site_id):
-        return cls.objects.filter(site_id=site_id).exists()
-        
-    def is_new_post_album(self, site_id):
+    def get_known_site_ids(self, cls, site_ids):
         """
-        :param site_id: site id of Album
-        :return: if the CMusic is not exist it's mean new post (True) otherwise (False) will return.
+        Checking the posts of a listing page by one query.
+        :param cls: CMusic or Album.
+        :param site_ids: site id of the posts.
+        :return: set of the site ids that are already crawled.
         """
-        return self.is_duplicate(Album, site_id)
+        return set(cls.objects.filter(site_id__in=site_ids).values_list('site_id', flat=True))
 
-    def is_new_post_single(self, site_id):
+    def get_known_page_urls(self, page_urls):
         """
-        :param site_id: site id of CMusic
-        :return: if the CMusic is not exist it's mean new post (True) otherwise (False) will return.
+        :param page_urls: URL of the posts of a listing page.
+        :return: set of the URLs that are already crawled.
         """
-        return self.is_duplicate(CMusic, site_id)
+        return set(CMusic.objects.filter(
+            website=self.website_name, page_url__in=page_urls
+        ).values_list('page_url', flat=True))
 
     def is_valid_url(self, url):
         val = URLValidator()
@@ -214,14 +809,12 @@ class NicMusicCrawler(Crawler):
     website_name = 'nicmusic'
     base_url = 'https://nicmusic.net/'
 
-    def collect_files(self):
-        super().collect_files()
-        for c in self.get_crawled_musics():
-            self.download_all_files(c)
-            try:
-                c.save()
-            except Exception as e:
-                logger.error(f'[saving downloaded files failed]-[exc: {e}]-[id: {c.id}]-[obj: {c}]')
+    def collect_files(self, created_before=None):
+        super().collect_files(created_before)
+        self.download_objects(self.get_crawled_musics(created_before), self.get_file_names)
+
+    def get_file_names(self, obj):
+        return ['mp3_128', 'mp3_320', 'thumbnail']
 
     def collect_links(self):
         super().collect_links()
@@ -232,116 +825,135 @@ class NicMusicCrawler(Crawler):
             total_pages = int(nav_links[-2].get_text())
 
             logger.info(f'[{total_pages} page found to crawl]-[website: {self.website_name}]')
-            for i in range(1, total_pages + 1):
-                page_url = f"{self.base_url}page/{i}/"
-                page = requests.get(page_url)
-                soup = BeautifulSoup(page.text, "html.parser")
-                logger.info(f'[crawling... ]-[URL: {page_url}]')
-                for post in soup.find_all("a", class_="show-more"):
-                    yield post.attrs["href"]
+            page_urls = (f"{self.base_url}page/{i}/" for i in range(1, total_pages + 1))
+            with closing(self.fetch_pages(page_urls)) as pages:
+                for page_url, page in pages:
+                    if page is None:
+                        continue
+                    soup = BeautifulSoup(page.text, "html.parser")
+                    logger.info(f'[crawling... ]-[URL: {page_url}]')
+                    post_urls = [post.attrs["href"] for post in soup.find_all("a", class_="show-more")]
+                    # the detail page of known posts is not requested
+                    known_post_urls = self.get_known_page_urls(post_urls)
+                    for post_url in post_urls:
+                        if post_url in known_post_urls:
+                            logger.info(f'[duplicate post found]-[URL: {post_url}]-[Page: {page_url}]')
+                            return
+                        yield post_url
         except Exception as e:
             logger.error(f"[collecting links failed]-[exc: {e}]-[website: {self.website_name}]")
 
     def collect_musics(self):
         super().collect_musics()
+        try:
+            self.collect_posts()
+        finally:
+            self.writer.flush()
+
+    def collect_posts(self):
         for post_url in self.collect_links():
-            page = self.make_request(post_url)
-            try:
-                soup = BeautifulSoup(page.text, "html.parser")
-
-                artist_name_fa = ""
-                title = soup.find("h1", class_="title").find("a").getText().strip()
-                title = title.encode().decode('utf-8-sig')
-                names = soup.find("div", class_="post-content").find_all("strong")
-
-                raw_name_en = urlparse(soup.find("a", class_="dl-320").attrs["href"].encode().decode('utf-8-sig')).path
-                raw_name_en = unquote(raw_name_en).split('/')[-1].replace('.mp3', '').split('-')
-                artist_name_en = raw_name_en[0]
-                song_name_en = raw_name_en[1]
-
-                categories = soup.find("div", class_="categories").find("a").get_text()
-                if len(names) > 0:
-                    if categories not in ["آهنگ های گوناگون", "تک آهنگ های جدید"] and categories.startswith(
-                            "آهنگ های "):
-                        artist_name_fa = categories[9:]
-                    elif categories not in ["آهنگ های گوناگون", "تک آهنگ های جدید"] and categories.startswith(
-                            "دانلود آهنگ "):
-                        artist_name_fa = categories[12:].encode().decode('utf-8-sig')
-                    else:
-                        artist_name_fa = names[0].get_text().encode().decode('utf-8-sig')
-
-                song_name_fa_start_index = title.index("به نام")
-                song_name_fa = title[song_name_fa_start_index + 6:].strip().encode().decode('utf-8-sig')
-
-                if len(artist_name_fa) == 0 or artist_name_fa[0] in alpha:
-                    names2 = names[2].get_text()
-                    if names2[0] not in alpha:
-                        artist_name_fa = names[2].get_text()
-                lyrics_all = soup.find("div", class_="post-content").find_all("p")[7:]
-                lyrics = ""
-                if lyrics_all:
-                    for ly in lyrics_all:
-                        lyrics += f"{ly.get_text().strip()}\n"
-
-                lyrics = lyrics.replace("\"", "")
-                lyrics = lyrics.strip().encode().decode('utf-8-sig')
-                if "دانلود در ادامه مطلب" in lyrics:
-                    start_index = lyrics.index("دانلود در ادامه مطلب")
-                    lyrics = lyrics[start_index + 21:]
-                    lyrics = lyrics.strip()
-
-                # Getting Songs URLs 128, 320
-                quality_128 = soup.find("a", class_="dl-128").attrs["href"].encode().decode('utf-8-sig')
-                quality_320 = soup.find("a", class_="dl-320").attrs["href"].encode().decode('utf-8-sig')
-                # Validating the files URL
-                if not self.is_valid_url(quality_128):
-                    self.invalid_url_found_log(quality_128, post_url, 'music 128')
-                    continue
-                if not self.is_valid_url(quality_320):
-                    self.invalid_url_found_log(quality_320, post_url, 'music 320')
-                    continue
+            post = self.parse_music(post_url)
+            if post:
+                self.save_post(post)
 
-                # thumbnail link
-                thumbnail = soup.find("img", class_=["size-full", "size-medium"]).attrs[
-                    "data-src"].encode().decode(
-                    'utf-8-sig')
-                # validating thumbnail
-                if not self.is_valid_url(thumbnail):
-                    self.invalid_url_found_log(thumbnail, post_url, 'thumbnail')
-                    continue
+    def discover_posts(self):
+        for post_url in self.collect_links():
+            yield CMusic.SINGLE_TYPE, post_url
 
-                publish_date = self.fix_jdate(soup.find("div", class_="times").get_text().strip(), months)
-                publish_date = datetime.strptime(publish_date, '%m %d, %Y')
-
-                artist = self.create_artist(name_en=artist_name_en, name_fa=artist_name_fa)
-                site_id = self.get_site_id(soup)
-
-                if not self.is_new_post_single(site_id):
-                    if len(artist_name_en) > 0:
-                        kwargs = dict(
-                            site_id=site_id,
-                            defaults={
-                                "title": title,
-                                "song_name_fa": song_name_fa,
-                                "song_name_en": song_name_en,
-                                "post_type": CMusic.SINGLE_TYPE,
-                                "lyrics": lyrics,
-                                "artist": artist,
-                                "link_mp3_128": quality_128,
-                                "link_mp3_320": quality_320,
-                                "link_thumbnail": thumbnail,
-                                "published_date": publish_date,
-                                'page_url': post_url,
-                                'wp_category_id': self.category_id
-                            }
-                        )
-                        self.create_music(**kwargs)
+    def parse_music(self, post_url):
+        """
+        :param post_url: URL of the single music post.
+        :return: the parsed post (see `Crawler.save_post`) or None if the post is not valid.
+        """
+        page = self.make_request(post_url)
+        try:
+            soup = BeautifulSoup(page.text, "html.parser")
+
+            artist_name_fa = ""
+            title = soup.find("h1", class_="title").find("a").getText().strip()
+            title = title.encode().decode('utf-8-sig')
+            names = soup.find("div", class_="post-content").find_all("strong")
+
+            raw_name_en = urlparse(soup.find("a", class_="dl-320").attrs["href"].encode().decode('utf-8-sig')).path
+            raw_name_en = unquote(raw_name_en).split('/')[-1].replace('.mp3', '').split('-')
+            artist_name_en = raw_name_en[0]
+            song_name_en = raw_name_en[1]
+
+            categories = soup.find("div", class_="categories").find("a").get_text()
+            if len(names) > 0:
+                if categories not in ["آهنگ های گوناگون", "تک آهنگ های جدید"] and categories.startswith(
+                        "آهنگ های "):
+                    artist_name_fa = categories[9:]
+                elif categories not in ["آهنگ های گوناگون", "تک آهنگ های جدید"] and categories.startswith(
+                        "دانلود آهنگ "):
+                    artist_name_fa = categories[12:].encode().decode('utf-8-sig')
                 else:
-                    logger.info(f'[duplicate post found]-[URL: {post_url}]')
-                    return
-            except Exception as e:
-                logger.warning(f'[failed to collect music]-[exc: {e}]-[website: {self.website_name}]')
-                continue
+                    artist_name_fa = names[0].get_text().encode().decode('utf-8-sig')
+
+            song_name_fa_start_index = title.index("به نام")
+            song_name_fa = title[song_name_fa_start_index + 6:].strip().encode().decode('utf-8-sig')
+
+            if len(artist_name_fa) == 0 or artist_name_fa[0] in alpha:
+                names2 = names[2].get_text()
+                if names2[0] not in alpha:
+                    artist_name_fa = names[2].get_text()
+            lyrics_all = soup.find("div", class_="post-content").find_all("p")[7:]
+            lyrics = ""
+            if lyrics_all:
+                for ly in lyrics_all:
+                    lyrics += f"{ly.get_text().strip()}\n"
+
+            lyrics = lyrics.replace("\"", "")
+            lyrics = lyrics.strip().encode().decode('utf-8-sig')
+            if "دانلود در ادامه مطلب" in lyrics:
+                start_index = lyrics.index("دانلود در ادامه مطلب")
+                lyrics = lyrics[start_index + 21:]
+                lyrics = lyrics.strip()
+
+            # Getting Songs URLs 128, 320
+            quality_128 = soup.find("a", class_="dl-128").attrs["href"].encode().decode('utf-8-sig')
+            quality_320 = soup.find("a", class_="dl-320").attrs["href"].encode().decode('utf-8-sig')
+            # Validating the files URL
+            if not self.is_valid_url(quality_128):
+                self.invalid_url_found_log(quality_128, post_url, 'music 128')
+                return None
+            if not self.is_valid_url(quality_320):
+                self.invalid_url_found_log(quality_320, post_url, 'music 320')
+                return None
+
+            # thumbnail link
+            thumbnail = soup.find("img", class_=["size-full", "size-medium"]).attrs[
+                "data-src"].encode().decode(
+                'utf-8-sig')
+            # validating thumbnail
+            if not self.is_valid_url(thumbnail):
+                self.invalid_url_found_log(thumbnail, post_url, 'thumbnail')
+                return None
+
+            publish_date = self.fix_jdate(soup.find("div", class_="times").get_text().strip(), months)
+            publish_date = datetime.strptime(publish_date, '%m %d, %Y')
+
+            if len(artist_name_en) > 0:
+                return self.make_post(
+                    CMusic.SINGLE_TYPE,
+                    self.get_site_id(soup),
+                    dict(name_en=artist_name_en, name_fa=artist_name_fa),
+                    {
+                        "title": title,
+                        "song_name_fa": song_name_fa,
+                        "song_name_en": song_name_en,
+                        "post_type": CMusic.SINGLE_TYPE,
+                        "lyrics": lyrics,
+                        "link_mp3_128": quality_128,
+                        "link_mp3_320": quality_320,
+                        "link_thumbnail": thumbnail,
+                        "published_date": publish_date.date(),
+                        'page_url': post_url,
+                        'wp_category_id': self.category_id
+                    }
+                )
+        except Exception as e:
+            logger.warning(f'[failed to collect music]-[exc: {e}]-[website: {self.website_name}]')
 
     def get_site_id(self, soup):
         site_id = urlparse(soup.find('link', attrs={'rel': 'shortlink'}).attrs['href']).query  # etc. p=83628
@@ -355,8 +967,11 @@ class Ganja2MusicCrawler(Crawler):
 
     def collect_musics(self):
         super().collect_musics()
-        self.collect_album_musics()
-        self.collect_single_musics()
+        try:
+            self.collect_album_musics()
+            self.collect_single_musics()
+        finally:
+            self.writer.flush()
 
     def get_download_link(self, soup):
         # Download link
@@ -409,119 +1024,137 @@ class Ganja2MusicCrawler(Crawler):
         :return: None
         """
         for post_page_url in self.collect_link_singles():
-            try:
-                soup = BeautifulSoup(self.make_request(post_page_url).text, "html.parser")
+            post = self.parse_music(post_page_url)
+            if post:
+                self.save_post(post)
 
-                # Getting links of this post
-                link_128, link_320 = self.get_download_link(soup)
+    def parse_music(self, post_page_url):
+        """
+        :param post_page_url: URL of the single music post.
+        :return: the parsed post (see `Crawler.save_post`) or None if the post is not valid.
+        """
+        try:
+            soup = BeautifulSoup(self.make_request(post_page_url).text, "html.parser")
+
+            # Getting links of this post
+            link_128, link_320 = self.get_download_link(soup)
+
+            if not self.is_valid_url(link_128):
+                self.invalid_url_found_log(link_128, post_page_url, 'music 128')
+                return None
+            if not self.is_valid_url(link_320):
+                self.invalid_url_found_log(link_320, post_page_url, 'music 320')
+                return None
+
+            link_thumbnail = self.get_thumbnail(soup)
+            if not self.is_valid_url(link_thumbnail):
+                self.invalid_url_found_log(link_thumbnail, post_page_url, 'thumbnail')
+                return None
+
+            song_name_en, artist_name_en, publish_date = self.get_content_section_info(soup)
+            title = self.get_title(soup)
+
+            # Lyric
+            lyric = soup.find('div', class_='tab-pane fade in active').find('p')
+
+            # Title tag
+            title_tag = self.get_title_tag(soup)
+
+            return self.make_post(
+                CMusic.SINGLE_TYPE,
+                self.get_obj_site_id(post_page_url),
+                dict(name_en=artist_name_en),
+                dict(
+                    song_name_en=song_name_en,
+                    link_mp3_128=link_128,
+                    link_mp3_320=link_320,
+                    link_thumbnail=link_thumbnail,
+                    lyrics=lyric.decode_contents() if lyric else '',
+                    title=title,
+                    title_tag=title_tag,
+                    published_date=publish_date,
+                    post_type=CMusic.SINGLE_TYPE,
+                    page_url=post_page_url,
+                    wp_category_id=self.category_id
+                )
+            )
+        except Exception as e:
+            logger.error(f'[collect single music failed]-[exc: {e}]-[website: {self.website_name}]')
 
-                if not self.is_valid_url(link_128):
-                    self.invalid_url_found_log(link_128, post_page_url, 'music 128')
-                    continue
-                if not self.is_valid_url(link_320):
-                    self.invalid_url_found_log(link_320, post_page_url, 'music 320')
-                    continue
+    def collect_link_albums(self):
+        for link in self.collect_post_links('archive/album/', 'album'):
+            yield link
 
+    def collect_album_musics(self):
+        for post_page_url in self.collect_link_albums():
+            post = self.parse_album(post_page_url)
+            if post:
+                self.save_post(post)
+
+    def parse_album(self, post_page_url):
+        """
+        :param post_page_url: URL of the album post.
+        :return: the parsed post (see `Crawler.save_post`) or None if the post is not valid.
+        """
+        try:
+            soup = BeautifulSoup(self.make_request(post_page_url).text, "html.parser")
+
+            link_128, link_320 = self.get_download_link(soup)  # zip files
+            link_thumbnail = soup.find('div', class_='insidercover').find('a').attrs['href']
+            if not link_thumbnail.startswith('http'):
                 link_thumbnail = self.get_thumbnail(soup)
-                if not self.is_valid_url(link_thumbnail):
-                    self.invalid_url_found_log(link_thumbnail, post_page_url, 'thumbnail')
-                    continue
+            album_name_en, artist_name_en, publish_date = self.get_content_section_info(soup)
+            title = self.get_title(soup)
+            site_id = self.get_obj_site_id(post_page_url)
+
+            # Title tag
+            title_tag = self.get_title_tag(soup)
+
+            defaults = dict(
+                page_url=post_page_url,
+                link_mp3_128=link_128,
+                link_mp3_320=link_320,
+                link_thumbnail=link_thumbnail,
+                title=title,
+                title_tag=title_tag,
+                album_name_en=album_name_en,
+                published_date=publish_date,
+                site_id=site_id,
+                wp_category_id=self.category_id
+            )
 
-                song_name_en, artist_name_en, publish_date = self.get_content_section_info(soup)
-                title = self.get_title(soup)
-
-                # Lyric
-                lyric = soup.find('div', class_='tab-pane fade in active').find('p')
-
-                # Title tag
-                title_tag = self.get_title_tag(soup)
-
-                artist = self.create_artist(name_en=artist_name_en)  # get or create Artist
-                kwargs = dict(
-                    site_id=self.get_obj_site_id(post_page_url),
-                    defaults=dict(
-                        artist=artist,
-                        song_name_en=song_name_en,
-                        link_mp3_128=link_128,
-                        link_mp3_320=link_320,
-                        link_thumbnail=link_thumbnail,
-                        lyrics=lyric.decode_contents() if lyric else '',
-                        title=title,
-                        title_tag=title_tag,
+            # getting and creating all musics
+            album_musics = soup.find_all('div', class_='trklines')
+            if not album_musics:
+                logger.warning("[finding tracks of album failed]-[exc: track list is empty]")
+                return None
+
+            tracks = []
+            for index, m in enumerate(album_musics):
+                link_mp3_320 = m.find('div', class_='rightf3').find('a').attrs['href']
+                link_mp3_128 = m.find('div', class_='rightf3 plyiter').find('a').attrs['href']
+                tracks.append((
+                    # creating custom site id for `album-musics` type from album site id
+                    f"{int(site_id) + 1001 + index}",
+                    dict(
+                        link_mp3_128=link_mp3_128,
+                        link_mp3_320=link_mp3_320,
                         published_date=publish_date,
-                        post_type=CMusic.SINGLE_TYPE,
                         page_url=post_page_url,
+                        post_type=CMusic.ALBUM_MUSIC_TYPE,
+                        song_name_en=m.find('div', class_='rightf2').get_text(),
                         wp_category_id=self.category_id
                     )
-                )
-                self.create_music(**kwargs)  # get or create CMusic
-            except Exception as e:
-                logger.error(f'[collect single music failed]-[exc: {e}]-[website: {self.website_name}]')
-                continue
-
-    def collect_link_albums(self):
-        for link in self.collect_post_links('archive/album/', 'album'):
-            yield link
+                ))
+            return self.make_post(self.ALBUM_POST, site_id, dict(name_en=artist_name_en), defaults, tracks)
+        except Exception as e:
+            logger.error(f"[creating album failed]-[exc: {e}]-[URL: {post_page_url}]")
 
-    def collect_album_musics(self):
+    def discover_posts(self):
         for post_page_url in self.collect_link_albums():
-            try:
-                soup = BeautifulSoup(self.make_request(post_page_url).text, "html.parser")
-
-                link_128, link_320 = self.get_download_link(soup)  # zip files
-                link_thumbnail = soup.find('div', class_='insidercover').find('a').attrs['href']
-                if not link_thumbnail.startswith('http'):
-                    link_thumbnail = self.get_thumbnail(soup)
-                album_name_en, artist_name_en, publish_date = self.get_content_section_info(soup)
-                title = self.get_title(soup)
-                site_id = self.get_obj_site_id(post_page_url)
-                artist = self.create_artist(name_en=artist_name_en)
-
-                # Title tag
-                title_tag = self.get_title_tag(soup)
-
-                defaults = dict(
-                    artist=artist,
-                    page_url=post_page_url,
-                    link_mp3_128=link_128,
-                    link_mp3_320=link_320,
-                    link_thumbnail=link_thumbnail,
-                    title=title,
-                    title_tag=title_tag,
-                    album_name_en=album_name_en,
-                    published_date=publish_date,
-                    site_id=site_id,
-                    wp_category_id=self.category_id
-                )
-
-                # getting and creating all musics
-                album_musics = soup.find_all('div', class_='trklines')
-                if album_musics:
-                    album = self.create_album(site_id, defaults)
-                    for index, m in enumerate(album_musics):
-                        link_mp3_320 = m.find('div', class_='rightf3').find('a').attrs['href']
-                        link_mp3_128 = m.find('div', class_='rightf3 plyiter').find('a').attrs['href']
-                        kwargs = dict(
-                            # creating custom site id for `album-musics` type from album site id
-                            site_id=f"{int(site_id) + 1001 + index}",
-                            defaults=dict(
-                                link_mp3_128=link_mp3_128,
-                                link_mp3_320=link_mp3_320,
-                                album=album,
-                                artist_id=album.artist_id,
-                                published_date=publish_date,
-                                page_url=post_page_url,
-                                post_type=CMusic.ALBUM_MUSIC_TYPE,
-                                song_name_en=m.find('div', class_='rightf2').get_text(),
-                                wp_category_id=self.category_id
-                            )
-                        )
-                        self.create_music(**kwargs)
-                else:
-                    logger.warning("[finding tracks of album failed]-[exc: track list is empty]")
-            except Exception as e:
-                logger.error(f"[creating album failed]-[exc: {e}]-[URL: {post_page_url}]")
-                continue
+            yield self.ALBUM_POST, post_page_url
+        for post_page_url in self.collect_link_singles():
+            yield CMusic.SINGLE_TYPE, post_page_url
 
     def collect_post_links(self, main_page_url, post_type):
         main_url = f"{self.base_url}{main_page_url}"
@@ -539,47 +1172,47 @@ class Ganja2MusicCrawler(Crawler):
         else:
             logger.info(f'[{last_page} page found to crawl]-[website: {self.website_name}]')
             # Crawling the next pages
-            for i in range(1, last_page + 1):
-                current_page_url = f"{main_url}page/{i}"
-                page = self.make_request(current_page_url)
-                soup = BeautifulSoup(page.text, "html.parser")
-                logger.info(f'[crawling page...]-[URL: {current_page_url}]')
-                for post_detail in soup.find_all('div', class_='postbox'):
-                    link = post_detail.find('a', class_='iaebox').attrs['href']
-                    site_id = link.split('/')[3]
-                    if not getattr(self, f'is_new_post_{post_type}')(site_id):  # post_type could be album or single
+            page_urls = (f"{main_url}page/{i}" for i in range(1, last_page + 1))
+            with closing(self.fetch_pages(page_urls)) as pages:
+                for current_page_url, page in pages:
+                    if page is None:
+                        continue
+                    soup = BeautifulSoup(page.text, "html.parser")
+                    logger.info(f'[crawling page...]-[URL: {current_page_url}]')
+                    links = [
+                        post_detail.find('a', class_='iaebox').attrs['href']
+                        for post_detail in soup.find_all('div', class_='postbox')
+                    ]
+                    known_site_ids = self.get_known_site_ids(
+                        Album if post_type == 'album' else CMusic,  # post_type could be album or single
+                        [self.get_obj_site_id(link) for link in links]
+                    )
+                    for link in links:
+                        if self.get_obj_site_id(link) in known_site_ids:
+                            logger.info(f'[duplicate post found]-[URL: {link}]-[Page: {current_page_url}]')
+                            return
                         yield link
-                    else:
-                        logger.info(f'[duplicate post found]-[URL: {link}]-[Page: {current_page_url}]')
-                        return
-
-    def collect_files(self):
-        super().collect_files()
-        self.collect_album_files()
-        self.collect_music_files()
-
-    def collect_music_files(self):
-        for c in self.get_crawled_musics():
-            if c.album or CMusic.ALBUM_MUSIC_TYPE:  # downloading just the 320 file from album-music
-                c.file_mp3_320 = self.download_content(c.link_mp3_320)
-                if c.file_mp3_320:
-                    c.is_downloaded = True
-            else:
-                self.download_all_files(c)
-            try:
-                c.save()
-            except Exception as e:
-                logger.error(f'[collect files failed]-[exc: {e}]-[cmusic: {c}]')
 
-    def collect_album_files(self):
-        for c in self.get_crawler_album():
-            c.file_thumbnail = self.download_content(c.link_thumbnail)
-            if c.file_thumbnail:
-                c.is_downloaded = True
-            try:
-                c.save()
-            except Exception as e:
-                logger.error(f'[collect files failed]-[exc: {e}]-[album: {c}]')
+    def collect_files(self, created_before=None):
+        super().collect_files(created_before)
+        self.collect_album_files(created_before)
+        self.collect_music_files(created_before)
+
+    def collect_music_files(self, created_before=None):
+        self.download_objects(self.get_crawled_musics(created_before), self.get_music_file_names)
+
+    def get_music_file_names(self, c):
+        if c.album or CMusic.ALBUM_MUSIC_TYPE:  # downloading just the 320 file from album-music
+            return ['mp3_320']
+        return ['mp3_128', 'mp3_320', 'thumbnail']
+
+    def collect_album_files(self, created_before=None):
+        self.download_objects(self.get_crawler_album(created_before), self.get_file_names)
+
+    def get_file_names(self, obj):
+        if isinstance(obj, Album):
+            return ['thumbnail']
+        return self.get_music_file_names(obj)
 
     def clean_url(self, url):
         if url.startswith('dl.ganja2music.com'):
@@ -589,3 +1222,11 @@ class Ganja2MusicCrawler(Crawler):
     def get_title_tag(self, soup):
         return soup.find('title').get_text()
 
+
+def get_crawler(website_name):
+    """
+    :param website_name: nicmusic or ganja2music.
+    :return: a new crawler of the website.
+    """
+    crawlers = {crawler.website_name: crawler for crawler in (NicMusicCrawler, Ganja2MusicCrawler)}
+    return crawlers[website_name]()
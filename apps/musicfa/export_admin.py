@@ -1,9 +1,38 @@
+import os
+import logging
+from datetime import timedelta
+from uuid import uuid4
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.contrib.auth import get_user_model
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404
+from django.test import RequestFactory
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html
+from django.utils.module_loading import import_string
+from django.utils.translation import ugettext_lazy as _
+
+import tablib
 from import_export import resources
+from import_export.admin import ExportActionMixin
+from import_export.formats import base_formats
+
+from .models import CMusic, Album, Artist, AdminExport
+
+logger = logging.getLogger(__name__)
 
-from .models import CMusic, Album, Artist
+# rows of these formats are written to the file chunk by chunk, other formats need the whole dataset
+STREAMABLE_FORMATS = (base_formats.CSV, base_formats.TSV)
 
 
 class CMusicResource(resources.ModelResource):
+    select_related = ['artist']
+
     class Meta:
         model = CMusic
         fields = (
@@ -13,6 +42,8 @@ class CMusicResource(resources.ModelResource):
 
 
 class AlbumResource(resources.ModelResource):
+    select_related = ['artist']
+
     class Meta:
         model = Album
         fields = (
@@ -22,9 +53,191 @@ class AlbumResource(resources.ModelResource):
 
 
 class ArtistResource(resources.ModelResource):
+    select_related = []
+
     class Meta:
         model = Artist
         fields = (
             'id', 'name_fa', 'name_en', 'wp_id', 'created_time'
         )
 
+
+def iterate_by_chunks(queryset, chunk_size):
+    """
+    Iterating over the queryset by keyset pagination on primary key, each chunk is a query.
+    :param queryset: queryset of objects.
+    :param chunk_size: number of objects of each query.
+    :return: generator of lists of objects.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def get_export_queryset(model, user, object_ids=None, params=None):
+    """
+    Rebuilding the queryset that is selected in admin.
+    :param model: model of the changelist.
+    :param user: user who requested the export, the changelist is filtered like his own page.
+    :param object_ids: ids of the selected objects.
+    :param params: query params of the changelist when all of its objects are selected.
+    :return: queryset of the objects.
+    """
+    if object_ids is not None:
+        return model.objects.filter(pk__in=object_ids)
+
+    request = RequestFactory().get('/', params or {})
+    request.user = user
+    model_admin = admin.site._registry[model]
+    return model_admin.get_changelist_instance(request).get_queryset(request)
+
+
+def export_queryset(model_label, resource_path, format_path, user_id, object_ids=None, params=None):
+    """
+    Writing the export file of the queryset that is selected in admin, the user is notified by `AdminExport`.
+    :param model_label: etc. musicfa.CMusic
+    :param resource_path: dotted path of resource class.
+    :param format_path: dotted path of the file format class.
+    :param user_id: id of user who requested the export.
+    :param object_ids: ids of the selected objects.
+    :param params: query params of the changelist when all of its objects are selected.
+    :return: path of the export file.
+    """
+    model = apps.get_model(model_label)
+    resource = import_string(resource_path)()
+    file_format = import_string(format_path)()
+    user = get_user_model().objects.get(pk=user_id)
+
+    queryset = get_export_queryset(model, user, object_ids, params).select_related(*resource.select_related)
+
+    directory = os.path.join(settings.EXPORT_ROOT, str(user_id))
+    os.makedirs(directory, exist_ok=True)
+    file_name = f'{uuid4().hex[:8]}-{model.__name__}-{timezone.now():%Y-%m-%d}.{file_format.get_extension()}'
+    file_path = os.path.join(directory, file_name)
+
+    rows = 0
+    dataset = tablib.Dataset(headers=resource.get_export_headers())
+    with open(file_path, 'wb') as f:
+        for chunk in iterate_by_chunks(queryset, settings.EXPORT_CHUNK_SIZE):
+            for obj in chunk:
+                dataset.append(resource.export_resource(obj))
+            rows += len(chunk)
+            if isinstance(file_format, STREAMABLE_FORMATS):
+                f.write(file_format.export_data(dataset).encode('utf-8'))
+                dataset = tablib.Dataset()
+
+        if not isinstance(file_format, STREAMABLE_FORMATS):
+            data = file_format.export_data(dataset)
+            f.write(data if file_format.is_binary() else data.encode('utf-8'))
+        elif rows == 0:
+            f.write(file_format.export_data(dataset).encode('utf-8'))
+
+    logger.info(f'[export file is written]-[model: {model_label}]-[rows: {rows}]-[file: {file_path}]')
+    AdminExport.objects.create(user=user, model_label=model_label, file_name=file_name, rows=rows)
+    return file_path
+
+
+def delete_expired_exports():
+    """
+    Deleting the export files and their `AdminExport` objects that are older than `EXPORT_EXPIRE` seconds.
+    """
+    expired_time = timezone.now().timestamp() - settings.EXPORT_EXPIRE
+    AdminExport.objects.filter(created_time__lt=timezone.now() - timedelta(seconds=settings.EXPORT_EXPIRE)).delete()
+    for directory, _dirs, file_names in os.walk(settings.EXPORT_ROOT):
+        for file_name in file_names:
+            file_path = os.path.join(directory, file_name)
+            if os.path.getmtime(file_path) < expired_time:
+                os.remove(file_path)
+                logger.debug(f'[expired export file deleted]-[file: {file_path}]')
+
+
+class BackgroundExportActionMixin(ExportActionMixin):
+    """
+    The export action of `ExportActionMixin` that runs by celery instead of the request. The selected queryset is
+    read by chunks and written to a file, its download link is shown in the changelist when it's ready.
+    """
+    # the export action is added by `get_actions`
+    actions = []
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.update(
+            export_admin_action=(
+                BackgroundExportActionMixin.export_admin_action,
+                'export_admin_action',
+                _('Export selected %(verbose_name_plural)s'),
+            )
+        )
+        return actions
+
+    def export_admin_action(self, request, queryset):
+        from .tasks import export_queryset_task
+
+        export_format = request.POST.get('file_format')
+        if not export_format:
+            messages.warning(request, _('You must select an export format.'))
+            return
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+
+        file_format = self.get_export_formats()[int(export_format)]
+        resource_class = self.get_export_resource_class()
+        if request.POST.get('select_across') == '1':
+            # the queryset is rebuilt by the filters of changelist in the worker
+            selection = dict(params=request.GET.dict())
+        else:
+            selection = dict(object_ids=request.POST.getlist(ACTION_CHECKBOX_NAME))
+        export_queryset_task.apply_async(args=(
+            self.opts.label,
+            f'{resource_class.__module__}.{resource_class.__name__}',
+            f'{file_format.__module__}.{file_format.__name__}',
+            request.user.id,
+        ), kwargs=selection)
+        messages.info(request, _('Exporting... the download link will be shown here when the file is ready.'))
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method == 'GET':
+            self.notify_exports(request)
+        return super().changelist_view(request, extra_context)
+
+    def notify_exports(self, request):
+        """
+        Showing the download links of the exports of user that are ready.
+        """
+        exports = list(AdminExport.objects.filter(user=request.user, is_notified=False).order_by('id'))
+        if not exports:
+            return
+        AdminExport.objects.filter(id__in=[export.id for export in exports]).update(is_notified=True)
+        for export in exports:
+            url = reverse(
+                f'admin:{self.opts.app_label}_{self.opts.model_name}_download_export', args=(export.file_name,)
+            )
+            messages.success(request, format_html(
+                'Export of {} ({} rows) is ready: <a href="{}">{}</a>',
+                export.model_label, export.rows, url, export.file_name
+            ))
+
+    def download_export(self, request, file_name):
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+        file_path = os.path.join(settings.EXPORT_ROOT, str(request.user.id), os.path.basename(file_name))
+        if not os.path.isfile(file_path):
+            raise Http404
+        return FileResponse(open(file_path, 'rb'), as_attachment=True, filename=file_name)
+
+    def get_urls(self):
+        url_patterns = [
+            path(
+                'exports/<str:file_name>/',
+                self.admin_site.admin_view(self.download_export),
+                name=f'{self.opts.app_label}_{self.opts.model_name}_download_export'
+            )
+        ]
+        url_patterns += super().get_urls()
+        return url_patterns
@@ -0,0 +1,214 @@
+import re
+import json
+import time
+import random
+import logging
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+
+logger = logging.getLogger(__name__)
+
+
+class FakeWordPressHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the REST routes of WordPress that `WordPressClient` uses, the state is kept by `server.wordpress`.
+    """
+    protocol_version = 'HTTP/1.1'  # keep-alive connections like a real WordPress
+    # headers and body are written separately, with Nagle each response of a kept-alive connection waits for the
+    # delayed ACK of client (~40ms)
+    disable_nagle_algorithm = True
+    routes = (
+        ('POST', re.compile(r'^/jwt-auth/v1/token$'), 'token'),
+        ('POST', re.compile(r'^/jwt-auth/v1/token/validate$'), 'validate_token'),
+        ('POST', re.compile(r'^/batch/v1$'), 'batch'),
+        ('POST', re.compile(r'^/wp/v2/(?P<type>music|album|artist|media)$'), 'create'),
+        ('GET', re.compile(r'^/wp/v2/(?P<type>music|album|artist)$'), 'list'),
+        ('GET', re.compile(r'^/wp/v2/(?P<type>music|album|artist|media)/(?P<id>\d+)$'), 'get'),
+        ('PUT', re.compile(r'^/acf/v3/(?P<type>music|album|artist)/(?P<id>\d+)$'), 'update_acf'),
+        ('POST', re.compile(r'^/acf/v3/(?P<type>music|album|artist)/(?P<id>\d+)$'), 'update_acf'),
+    )
+
+    def log_message(self, format, *args):
+        logger.debug(f'[fake wordpress]-[{format % args}]')
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        self.handle_request()
+
+    def do_PUT(self):
+        self.handle_request()
+
+    def handle_request(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        url = urlparse(self.path)
+        status, content = self.server.wordpress.dispatch(
+            self.command, url.path, self.headers, body, dict(parse_qsl(url.query))
+        )
+        data = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeWordPress:
+    """
+    A local stand-in of the WordPress REST API (JWT auth, `wp/v2`, `acf/v3` and `batch/v1`) to test and benchmark
+    `WordPressClient` without the production WordPress. The objects are kept in memory.
+
+    >>> with FakeWordPress(latency=0.05, error_rate=0.01) as wordpress:
+    ...     client = WordPressClient()
+    ...     client.base_url = wordpress.url
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, error_rate=0, error_status=500, batch_supported=True):
+        """
+        :param port: port of the server, 0 picks a free port.
+        :param latency: seconds that each request waits before its response.
+        :param error_rate: ratio of the requests (except the token) that fail by `error_status`.
+        :param error_status: status code of the injected errors, etc. 500 or 429.
+        :param batch_supported: False to behave like a WordPress older than 5.6 that has no `batch/v1`.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.batch_supported = batch_supported
+
+        self.lock = threading.Lock()
+        self.ids = iter(range(1, 2 ** 31))
+        self.tokens = set()
+        self.objects = {}  # id: (type, fields)
+        self.requests = Counter()  # (method, route name and type): count
+
+        self.server = ThreadingHTTPServer((host, port), FakeWordPressHandler)
+        self.server.daemon_threads = True
+        self.server.wordpress = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f'[fake wordpress started]-[URL: {self.url}]')
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def request_count(self):
+        return sum(self.requests.values())
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests.clear()
+
+    def next_id(self):
+        with self.lock:
+            return next(self.ids)
+
+    def dispatch(self, method, path, headers, body, params=None):
+        """
+        :return: (status code, content of response)
+        """
+        path = f"/{path.strip('/')}"
+        if self.latency:
+            time.sleep(self.latency)
+
+        for route_method, pattern, name in FakeWordPressHandler.routes:
+            match = pattern.match(path)
+            if match and route_method == method:
+                break
+        else:
+            return 404, dict(code='rest_no_route', message='No route was found matching the URL and request method.')
+
+        route = f"{name} {match['type']}" if 'type' in match.groupdict() else name
+        with self.lock:
+            self.requests[(method, route)] += 1
+
+        if name == 'batch' and not self.batch_supported:
+            return 404, dict(code='rest_no_route', message='No route was found matching the URL and request method.')
+        if name != 'token':
+            if headers.get('Authorization', '').replace('Bearer ', '', 1) not in self.tokens:
+                return 403, dict(code='jwt_auth_invalid_token', message='Wrong number of segments')
+            if self.error_rate and random.random() < self.error_rate:
+                return self.error_status, dict(code='injected_error', message='Error injected by fake wordpress')
+
+        if name == 'list':
+            return self.list(params=params or {}, **match.groupdict())
+        return getattr(self, name)(body=body, **match.groupdict())
+
+    def token(self, body):
+        token = f'fake-token-{self.next_id()}'
+        with self.lock:
+            self.tokens.add(token)
+        return 200, dict(success=True, data=dict(token=token))
+
+    def validate_token(self, body):
+        return 200, dict(code='jwt_auth_valid_token', data=dict(status=200))
+
+    def create(self, type, body):
+        if type == 'media':
+            # multipart body of the uploaded file, only the existence of media is kept
+            fields = dict(size=len(body))
+        else:
+            fields = json.loads(body or '{}')
+        object_id = self.next_id()
+        with self.lock:
+            self.objects[object_id] = (type, fields)
+        return 201, dict(id=object_id, type=type, **{k: v for k, v in fields.items() if k != 'id'})
+
+    def list(self, type, params):
+        search = params.get('search', '')
+        with self.lock:
+            objects = [
+                dict(id=object_id, meta=fields.get('meta', {}))
+                for object_id, (object_type, fields) in self.objects.items()
+                if object_type == type
+                and ('slug' not in params or fields.get('slug') == params['slug'])
+                and search in (fields.get('title') or fields.get('name') or '')
+            ]
+        return 200, objects
+
+    def get(self, type, id, body):
+        obj = self.objects.get(int(id))
+        if not obj or obj[0] != type:
+            return 404, dict(code='rest_post_invalid_id', message='Invalid post ID.')
+        return 200, dict(id=int(id), type=type)
+
+    def update_acf(self, type, id, body):
+        obj = self.objects.get(int(id))
+        if not obj or obj[0] != type:
+            return 404, dict(code='rest_post_invalid_id', message='Invalid post ID.')
+        obj[1].update(json.loads(body or '{}'))
+        return 200, dict(id=int(id))
+
+    def batch(self, body):
+        responses = []
+        for request in json.loads(body)['requests']:
+            status, content = self.create_in_batch(request)
+            responses.append(dict(status=status, body=content, headers={}))
+        return 207, dict(responses=responses)
+
+    def create_in_batch(self, request):
+        path = f"/{request['path'].strip('/')}"
+        match = re.match(r'^/wp/v2/(?P<type>music|album|artist)$', path)
+        if not match or request.get('method', 'POST') != 'POST':
+            return 400, dict(code='rest_batch_not_allowed', message='The requested route does not support batch.')
+        return self.create(match['type'], json.dumps(request.get('body', {})))
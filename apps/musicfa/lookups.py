@@ -0,0 +1,27 @@
+from django.db.models import CharField, TextField
+from django.db.models.lookups import PatternLookup
+
+
+class ILike(PatternLookup):
+    """
+    Case insensitive match by `ILIKE` on the column itself. Django's `iexact` and `icontains` compare
+    `UPPER(column)` that can not use the `gin_trgm_ops` index of the column, `ILIKE` can.
+    """
+    lookup_name = 'ilike'
+    param_pattern = '%s'
+
+    def get_rhs_op(self, connection, rhs):
+        return f'ILIKE {rhs}'
+
+
+class ILikeContains(ILike):
+    """
+    `icontains` that uses the `gin_trgm_ops` index of the column.
+    """
+    lookup_name = 'ilike_contains'
+    param_pattern = '%%%s%%'
+
+
+for field in (CharField, TextField):
+    field.register_lookup(ILike)
+    field.register_lookup(ILikeContains)
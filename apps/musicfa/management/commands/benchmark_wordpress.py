@@ -0,0 +1,172 @@
+import os
+import time
+import tempfile
+from datetime import date
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from apps.musicfa.fake_wordpress import FakeWordPress
+from apps.musicfa.models import Artist, Album, CMusic
+from apps.musicfa.utils import WordPressClient
+
+
+class Command(BaseCommand):
+    help = (
+        'Publishing synthetic musics or albums to a local fake WordPress and reporting the publish throughput. '
+        'The synthetic rows are rolled back and their files are removed at the end.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50, help='number of published musics or albums')
+        parser.add_argument('--type', choices=['music', 'album'], default='music')
+        parser.add_argument('--tracks', type=int, default=10, help='number of tracks of each album')
+        parser.add_argument(
+            '--mode', choices=[WordPressClient.SEPARATE_MODE, WordPressClient.INLINE_MODE, WordPressClient.BATCH_MODE],
+            default=settings.WP_PUBLISH_MODE, help='publish mode, see WP_PUBLISH_MODE setting'
+        )
+        parser.add_argument('--latency', type=float, default=0, help='seconds that each request of WordPress takes')
+        parser.add_argument('--error-rate', type=float, default=0, help='ratio of the failed requests, etc. 0.01')
+        parser.add_argument('--error-status', type=int, default=500, help='status code of the failed requests')
+        parser.add_argument('--no-batch', action='store_true', help='WordPress has no batch/v1 endpoint')
+        parser.add_argument(
+            '--shared-thumbnail', action='store_true', help='all the objects have the same thumbnail content'
+        )
+
+    def handle(self, *args, **options):
+        wordpress = FakeWordPress(
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            error_status=options['error_status'],
+            batch_supported=not options['no_batch'],
+        )
+        method_name = 'create_single_music' if options['type'] == 'music' else 'create_album'
+
+        with tempfile.TemporaryDirectory() as media_root, wordpress, override_settings(
+            MEDIA_ROOT=media_root, WP_PUBLISH_MODE=options['mode']
+        ):
+            with transaction.atomic():
+                objects = self.create_objects(media_root, options)
+                client = self.get_client(wordpress)
+
+                start = time.monotonic()
+                published = self.publish(client, objects, method_name, options['mode'])
+                elapsed = time.monotonic() - start
+
+                transaction.set_rollback(True)
+
+        self.report(options, len(objects), published, elapsed, wordpress)
+
+    @staticmethod
+    def get_client(wordpress):
+        """
+        :return: `WordPressClient` of the fake WordPress, its token and batch support are not shared with the
+        real client by the cache.
+        """
+        client = WordPressClient()
+        client.base_url = wordpress.url
+        client.token_cache_key = 'wordpress_benchmark_auth_token'
+        client.batch_unsupported_cache_key = 'wordpress_benchmark_batch_unsupported'
+        cache.delete_many([client.token_cache_key, client.batch_unsupported_cache_key])
+        return client
+
+    @staticmethod
+    def publish(client, objects, method_name, mode):
+        """
+        Publishing the objects like `tasks.publish_objects` does for a chunk.
+        :return: number of published objects.
+        """
+        if mode == WordPressClient.BATCH_MODE:
+            return client.create_batch(objects, method_name)
+
+        published = 0
+        for obj in objects:
+            try:
+                getattr(client.set_instance(obj), method_name)()
+                published += 1
+            except Exception:
+                pass  # logged by `WordPressClient`
+        return published
+
+    def create_objects(self, media_root, options):
+        """
+        Creating the synthetic musics or albums, their thumbnails are written in `media_root` and their mp3
+        files are considered as downloaded.
+        :return: list of CMusic or Album objects.
+        """
+        run_id = uuid4().hex[:8]
+        os.makedirs(os.path.join(media_root, 'benchmark'))
+        thumbnail_content = os.urandom(4096)
+
+        def thumbnail(i):
+            name = f'benchmark/{run_id}-{i}.jpg'
+            with open(os.path.join(media_root, name), 'wb') as f:
+                f.write(thumbnail_content if options['shared_thumbnail'] else os.urandom(4096))
+            return name
+
+        artist = Artist.objects.create(
+            name_en=f'benchmark {run_id}', name_fa=f'بنچمارک {run_id}', wp_id='1', description='benchmark'
+        )
+        common = dict(
+            artist=artist,
+            published_date=date.today(),
+            page_url='http://localhost/benchmark',
+            website=CMusic.NICMUSIC_WEBSITE,
+            wp_category_id=1,
+        )
+
+        if options['type'] == 'music':
+            return CMusic.objects.bulk_create([
+                CMusic(
+                    site_id=f'benchmark-{run_id}-{i}',
+                    song_name_en=f'benchmark {i}',
+                    song_name_fa=f'بنچمارک {i}',
+                    post_type=CMusic.SINGLE_TYPE,
+                    file_thumbnail=thumbnail(i),
+                    file_mp3_128=f'benchmark/{run_id}-{i}-128.mp3',
+                    file_mp3_320=f'benchmark/{run_id}-{i}-320.mp3',
+                    **common
+                ) for i in range(options['count'])
+            ])
+
+        albums = Album.objects.bulk_create([
+            Album(
+                site_id=f'benchmark-{run_id}-{i}',
+                album_name_en=f'benchmark {i}',
+                album_name_fa=f'بنچمارک {i}',
+                file_thumbnail=thumbnail(i),
+                **common
+            ) for i in range(options['count'])
+        ])
+        CMusic.objects.bulk_create([
+            CMusic(
+                site_id=f'benchmark-{run_id}-{album.id}-{i}',
+                song_name_en=f'benchmark {i}',
+                album=album,
+                post_type=CMusic.ALBUM_MUSIC_TYPE,
+                file_mp3_320=f'benchmark/{run_id}-{album.id}-{i}-320.mp3',
+                **common
+            ) for album in albums for i in range(options['tracks'])
+        ])
+        return albums
+
+    def report(self, options, total, published, elapsed, wordpress):
+        requests = wordpress.request_count
+        self.stdout.write(
+            f"type: {options['type']}, mode: {options['mode']}, latency: {options['latency']}s, "
+            f"error rate: {options['error_rate']}"
+        )
+        self.stdout.write(f'published: {published} of {total}, failed: {total - published}')
+        self.stdout.write(f'elapsed: {elapsed:.2f}s')
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'items/s: {published / elapsed if elapsed else 0:.2f}, '
+                f'requests/item: {requests / total if total else 0:.2f} ({requests} requests)'
+            )
+        )
+        for (method, name), count in sorted(wordpress.requests.items(), key=lambda item: -item[1]):
+            self.stdout.write(f'  {method} {name}: {count}')
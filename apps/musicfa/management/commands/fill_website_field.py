@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.musicfa.utils import fill_website_field
+
+
+class Command(BaseCommand):
+    help = (
+        'Setting the website field of the musics and albums that were crawled before the field is added, '
+        'it runs once after the migration that adds the field.'
+    )
+
+    def handle(self, *args, **options):
+        musics, albums = fill_website_field()
+        self.stdout.write(self.style.SUCCESS(f'website field is filled, musics: {musics}, albums: {albums}'))
@@ -2,14 +2,22 @@ from urllib.parse import urlparse
 
 from django.conf import settings
 from django.db import models
+from django.db.models import Q
+from django.contrib.postgres.indexes import GinIndex
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from django_better_admin_arrayfield.models.fields import ArrayField
 
+from . import lookups  # noqa: F401, registering `ilike` lookups
 from .utils import UploadTo, url_join
 
 
+def trigram_index(field_name, model_name):
+    return GinIndex(fields=[field_name], name=f'{model_name}_{field_name}_trgm', opclasses=['gin_trgm_ops'])
+
+
 class Artist(models.Model):
     created_time = models.DateTimeField(_('created time'), auto_now_add=True)
     updated_time = models.DateTimeField(_('updated time'), auto_now=True)
@@ -29,6 +37,16 @@ class Artist(models.Model):
         _("file thumbnail photo"), upload_to=UploadTo('thumbnail'), null=True, blank=True
     )
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['correct_names'], name='artist_correct_names_gin'),
+            models.Index(fields=['name_fa'], name='artist_name_fa_idx'),
+            trigram_index('name_en', 'artist'),
+            trigram_index('name_fa', 'artist'),
+            trigram_index('note', 'artist'),
+            trigram_index('wp_id', 'artist'),
+        ]
+
     def clean(self):
         if self.name_fa == '' and self.is_approved:
             raise ValidationError({'is_approved': 'full name fa is empty!'})
@@ -53,6 +71,13 @@ class Album(models.Model):
         (APPROVED_STATUS, _('approved')),
     )
 
+    NICMUSIC_WEBSITE = 'nicmusic'
+    GANJA2MUSIC_WEBSITE = 'ganja2music'
+    WEBSITE_CHOICES = (
+        (NICMUSIC_WEBSITE, _('nic music')),
+        (GANJA2MUSIC_WEBSITE, _('ganja2')),
+    )
+
     created_time = models.DateTimeField(_('created time'), auto_now_add=True)
     updated_time = models.DateTimeField(_('updated time'), auto_now=True)
     published_date = models.DateField(_("published date"), max_length=20)
@@ -66,6 +91,7 @@ class Album(models.Model):
     artist = models.ForeignKey('Artist', on_delete=models.CASCADE, verbose_name=_('artist'), blank=True)
 
     page_url = models.TextField(_('page url'))
+    website = models.CharField(_('website'), max_length=20, choices=WEBSITE_CHOICES, blank=True, db_index=True)
     site_id = models.CharField(_('album site id'), max_length=50, unique=True, blank=True)
 
     link_thumbnail = models.TextField(_("link thumbnail"))
@@ -81,12 +107,24 @@ class Album(models.Model):
     wp_category_id = models.PositiveSmallIntegerField(_('category'), blank=True)
     wp_post_id = models.PositiveIntegerField(_('wordpress post id'), blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            trigram_index('album_name_en', 'album'),
+            trigram_index('album_name_fa', 'album'),
+            trigram_index('title', 'album'),
+            # albums of a website that their files are not downloaded yet
+            models.Index(
+                fields=['website', '-id'], name='album_not_downloaded_idx', condition=Q(is_downloaded=False)
+            ),
+        ]
+
     @property
     def name(self):
         return self.album_name_fa or self.album_name_en or str(self.id)
 
     @property
     def website_name(self):
+        # host of the post (etc. nicmusic.net) that is shown in the admin and the exports
         return urlparse(self.page_url).netloc
 
     def __str__(self):
@@ -115,6 +153,13 @@ class CMusic(models.Model):
         (APPROVED_STATUS, _('approved')),
     )
 
+    NICMUSIC_WEBSITE = 'nicmusic'
+    GANJA2MUSIC_WEBSITE = 'ganja2music'
+    WEBSITE_CHOICES = (
+        (NICMUSIC_WEBSITE, _('nic music')),
+        (GANJA2MUSIC_WEBSITE, _('ganja2')),
+    )
+
     created_time = models.DateTimeField(_('created time'), auto_now_add=True)
     updated_time = models.DateTimeField(_('updated time'), auto_now=True)
     published_date = models.DateField(_("published date"), max_length=20)
@@ -129,6 +174,7 @@ class CMusic(models.Model):
     artist = models.ForeignKey('Artist', on_delete=models.CASCADE, verbose_name=_('artist'))
 
     page_url = models.TextField(_("post url"), blank=True)
+    website = models.CharField(_('website'), max_length=20, choices=WEBSITE_CHOICES, blank=True, db_index=True)
     post_type = models.CharField(_("post type"), max_length=20, choices=POST_TYPE_CHOICE)
     site_id = models.CharField(_('album site id'), max_length=60, unique=True)
 
@@ -151,12 +197,25 @@ class CMusic(models.Model):
     wp_category_id = models.PositiveSmallIntegerField(_('category'), blank=True)
     wp_post_id = models.PositiveIntegerField(_('wordpress post id'), blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            trigram_index('song_name_en', 'cmusic'),
+            trigram_index('song_name_fa', 'cmusic'),
+            # musics of a website that their files are not downloaded yet
+            models.Index(
+                fields=['website', '-id'], name='cmusic_not_downloaded_idx', condition=Q(is_downloaded=False)
+            ),
+            # known posts of a listing page
+            models.Index(fields=['website', 'page_url'], name='cmusic_website_page_url_idx'),
+        ]
+
     @property
     def name(self):
         return self.song_name_fa or self.song_name_en or str(self.id)
 
     @property
     def website_name(self):
+        # host of the post (etc. nicmusic.net) that is shown in the admin and the exports
         return urlparse(self.page_url).netloc
 
     def __str__(self):
@@ -172,3 +231,130 @@ class CMusic(models.Model):
     def get_absolute_wp_url_320(self):
         if self.file_mp3_320:
             return url_join(settings.FTP_MEDIA_URL, self.file_mp3_320.url[14:])
+
+
+class MediaBlob(models.Model):
+    """
+    A downloaded file that is stored once by its content, file fields of CMusic, Album and Artist point to it.
+    """
+    created_time = models.DateTimeField(_('created time'), auto_now_add=True)
+
+    sha256 = models.CharField(_('sha256'), max_length=64, unique=True)
+    file = models.FileField(_('file'), max_length=150)
+    size = models.PositiveIntegerField(_('size'))
+
+    def __str__(self):
+        return self.file.name
+
+
+class MediaReference(models.Model):
+    """
+    Source URL of a downloaded file, a known URL is not downloaded again.
+    """
+    created_time = models.DateTimeField(_('created time'), auto_now_add=True)
+
+    url = models.TextField(_('source url'), unique=True)
+    blob = models.ForeignKey('MediaBlob', on_delete=models.CASCADE, verbose_name=_('blob'))
+
+    def __str__(self):
+        return self.url
+
+
+class WordPressMedia(models.Model):
+    """
+    Media of WordPress that an image is uploaded as it, the same image content is not uploaded again.
+    """
+    created_time = models.DateTimeField(_('created time'), auto_now_add=True)
+
+    sha256 = models.CharField(_('sha256'), max_length=64, unique=True)
+    media_id = models.PositiveIntegerField(_('wordpress media id'))
+
+    def __str__(self):
+        return f'{self.media_id}'
+
+
+class PublishOutbox(models.Model):
+    """
+    A pending WordPress operation of an object, the operations are run by `outbox.dispatch_outbox` in batches. Each
+    object has at most one pending operation of each kind (`idempotency_key`), the duplicate ones are dropped.
+    """
+    UPLOAD_MEDIA_OPERATION = 'media'
+    CREATE_POST_OPERATION = 'post'
+    UPDATE_ACF_OPERATION = 'acf'
+    OPERATION_CHOICES = (
+        (UPLOAD_MEDIA_OPERATION, _('upload media')),
+        (CREATE_POST_OPERATION, _('create post')),
+        (UPDATE_ACF_OPERATION, _('update acf fields')),
+    )
+
+    ARTIST_OBJECT = 'artist'
+    MUSIC_OBJECT = 'music'
+    ALBUM_OBJECT = 'album'
+    OBJECT_TYPE_CHOICES = (
+        (ARTIST_OBJECT, _('artist')),
+        (MUSIC_OBJECT, _('music')),
+        (ALBUM_OBJECT, _('album')),
+    )
+
+    PENDING_STATUS = 'pending'
+    DONE_STATUS = 'done'
+    FAILED_STATUS = 'failed'
+    STATUS_CHOICES = (
+        (PENDING_STATUS, _('pending')),
+        (DONE_STATUS, _('done')),
+        (FAILED_STATUS, _('failed')),
+    )
+
+    created_time = models.DateTimeField(_('created time'), auto_now_add=True)
+    updated_time = models.DateTimeField(_('updated time'), auto_now=True)
+
+    object_type = models.CharField(_('object type'), max_length=10, choices=OBJECT_TYPE_CHOICES)
+    object_id = models.PositiveIntegerField(_('object id'))
+    operation = models.CharField(_('operation'), max_length=10, choices=OPERATION_CHOICES)
+    idempotency_key = models.CharField(_('idempotency key'), max_length=50)
+    status = models.CharField(_('status'), max_length=8, choices=STATUS_CHOICES, default=PENDING_STATUS)
+    attempts = models.PositiveSmallIntegerField(_('attempts'), default=0)
+    # the operation is not run before this time, it's the backoff of a failed one or the lease of a running one
+    available_time = models.DateTimeField(_('available time'), default=timezone.now)
+    batch_id = models.CharField(_('publish batch id'), max_length=12, blank=True)
+    error = models.TextField(_('last error'), blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['idempotency_key'], name='publish_outbox_pending_key', condition=Q(status='pending')
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['available_time'], name='publish_outbox_pending_idx', condition=Q(status='pending')),
+            models.Index(fields=['object_type', 'object_id'], name='publish_outbox_object_idx'),
+        ]
+
+    def __str__(self):
+        return self.idempotency_key
+
+    @staticmethod
+    def get_idempotency_key(operation, object_type, object_id):
+        return f'{operation}:{object_type}:{object_id}'
+
+
+class AdminExport(models.Model):
+    """
+    Export file of an admin export action that is written by a worker, the user is notified of it by the next
+    changelist page.
+    """
+    created_time = models.DateTimeField(_('created time'), auto_now_add=True)
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name=_('user'))
+    model_label = models.CharField(_('model'), max_length=50)
+    file_name = models.CharField(_('file name'), max_length=150)
+    rows = models.PositiveIntegerField(_('rows'))
+    is_notified = models.BooleanField(_('is notified'), default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user'], name='admin_export_not_notified_idx', condition=Q(is_notified=False)),
+        ]
+
+    def __str__(self):
+        return self.file_name
@@ -0,0 +1,300 @@
+import logging
+from datetime import timedelta
+from math import ceil
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .models import Artist, Album, CMusic, PublishOutbox
+from .utils import WordPressClient, PublishProgress, acquire_slot, release_slot
+
+logger = logging.getLogger(__name__)
+
+# model, related fields and `WordPressClient` method of each object type
+OBJECT_TYPES = {
+    PublishOutbox.ARTIST_OBJECT: (Artist, (), 'create_artist'),
+    PublishOutbox.MUSIC_OBJECT: (CMusic, ('artist',), 'create_single_music'),
+    PublishOutbox.ALBUM_OBJECT: (Album, ('artist',), 'create_album'),
+}
+
+
+def get_wp_id(obj):
+    """
+    :return: id of the WordPress post of CMusic or Album, or id of the WordPress artist of Artist.
+    """
+    return obj.wp_post_id if hasattr(obj, 'wp_post_id') else obj.wp_id
+
+
+def enqueue_publish(object_type, object_ids, user_id=None):
+    """
+    Queuing the media upload and post creation of objects in the outbox, an object that its publish is already
+    pending is not queued again. The operations are dispatched after the commit of current transaction.
+    :param object_type: music, album or artist.
+    :param object_ids: ids of the objects.
+    :param user_id: user who started the publish.
+    :return: `PublishProgress` of the publish.
+    """
+    from .tasks import dispatch_outbox_task
+
+    batch_id = uuid4().hex[:12]
+    operations = []
+    for object_id in object_ids:
+        for operation in (PublishOutbox.UPLOAD_MEDIA_OPERATION, PublishOutbox.CREATE_POST_OPERATION):
+            operations.append(PublishOutbox(
+                object_type=object_type,
+                object_id=object_id,
+                operation=operation,
+                idempotency_key=PublishOutbox.get_idempotency_key(operation, object_type, object_id),
+                # the progress is counted by the post and the ACF fields
+                batch_id=batch_id if operation == PublishOutbox.CREATE_POST_OPERATION else '',
+            ))
+
+    with transaction.atomic():
+        PublishOutbox.objects.bulk_create(operations, ignore_conflicts=True)
+        total = PublishOutbox.objects.filter(batch_id=batch_id).count()
+        progress = PublishProgress.start(
+            object_type, total, ceil(total / settings.WP_OUTBOX_BATCH_SIZE), user_id, batch_id
+        )
+        transaction.on_commit(dispatch_outbox_task.delay)
+    logger.info(f'[publish queued]-[{object_type}: {total}]-[duplicates: {len(operations) // 2 - total}]')
+    return progress
+
+
+def claim_operations(batch_size):
+    """
+    Taking the available operations, they are leased for `WP_OUTBOX_LEASE` seconds and become available again if
+    the dispatcher dies. The post of an object waits for its pending media upload.
+    :return: list of `PublishOutbox` objects.
+    """
+    now = timezone.now()
+    pending_media = PublishOutbox.objects.filter(
+        status=PublishOutbox.PENDING_STATUS,
+        operation=PublishOutbox.UPLOAD_MEDIA_OPERATION,
+        object_type=OuterRef('object_type'),
+        object_id=OuterRef('object_id'),
+    )
+    with transaction.atomic():
+        operations = list(
+            PublishOutbox.objects.select_for_update(skip_locked=True).annotate(
+                waiting=Exists(pending_media)
+            ).filter(
+                Q(operation=PublishOutbox.UPLOAD_MEDIA_OPERATION) | Q(waiting=False),
+                status=PublishOutbox.PENDING_STATUS,
+                available_time__lte=now,
+            ).order_by('id')[:batch_size]
+        )
+        PublishOutbox.objects.filter(id__in=[operation.id for operation in operations]).update(
+            attempts=F('attempts') + 1, available_time=now + timedelta(seconds=settings.WP_OUTBOX_LEASE)
+        )
+    for operation in operations:
+        operation.attempts += 1
+    return operations
+
+
+def dispatch_outbox():
+    """
+    Running the outbox operations by batches of `WP_OUTBOX_BATCH_SIZE` until no operation is available, at most
+    `WP_PUBLISH_CONCURRENCY` dispatchers (and publish chunks) run at the same time.
+    :return: number of the run operations.
+    """
+    slot = acquire_slot('wordpress_publish', settings.WP_PUBLISH_CONCURRENCY, settings.WP_PUBLISH_SLOT_TIMEOUT)
+    if slot is None:
+        logger.debug('[outbox is dispatched by the other workers]')
+        return 0
+
+    count = 0
+    try:
+        dispatcher = OutboxDispatcher()
+        while True:
+            operations = claim_operations(settings.WP_OUTBOX_BATCH_SIZE)
+            if not operations:
+                break
+            dispatcher.run(operations)
+            count += len(operations)
+    finally:
+        release_slot('wordpress_publish', slot)
+    if count:
+        logger.info(f'[outbox dispatched]-[operations: {count}]')
+    return count
+
+
+class OutboxDispatcher:
+    """
+    Running a batch of outbox operations by a shared `WordPressClient`. A created post is found by the marker
+    of its object when its operation is retried, so an interrupted try doesn't create a duplicate post.
+    """
+    max_retry_delay = 60 * 60
+
+    def __init__(self):
+        self.client = WordPressClient()
+        self.handled = set()
+
+    def run(self, operations):
+        for operation_name in (
+                PublishOutbox.UPLOAD_MEDIA_OPERATION,
+                PublishOutbox.CREATE_POST_OPERATION,
+                PublishOutbox.UPDATE_ACF_OPERATION,
+        ):
+            for object_type in OBJECT_TYPES:
+                batch = [
+                    operation for operation in operations
+                    if operation.operation == operation_name and operation.object_type == object_type
+                ]
+                if not batch:
+                    continue
+                try:
+                    self.run_batch(operation_name, object_type, batch)
+                except Exception as e:
+                    # the claimed operations are retried after backoff instead of waiting for their lease
+                    logger.error(
+                        f'[outbox batch failed]-[operation: {operation_name}]-[type: {object_type}]-[error: {e}]'
+                    )
+                    for operation in batch:
+                        if operation.id not in self.handled:
+                            self.fail(operation, e)
+
+    def run_batch(self, operation_name, object_type, operations):
+        model, related, method_name = OBJECT_TYPES[object_type]
+        objects = model.objects.select_related(*related).in_bulk([operation.object_id for operation in operations])
+
+        found = []
+        for operation in operations:
+            if operation.object_id in objects:
+                found.append((operation, objects[operation.object_id]))
+            else:
+                self.fail(operation, 'object is deleted', permanent=True)
+
+        if operation_name == PublishOutbox.UPLOAD_MEDIA_OPERATION:
+            self.upload_media(found)
+        elif operation_name == PublishOutbox.CREATE_POST_OPERATION:
+            self.create_posts(found, method_name)
+        else:
+            self.update_acf_fields(found, method_name)
+
+    def prepare_post(self, obj, method_name):
+        """
+        :return: (url name, ACF url name, payload, ACF fields) of object, see `WordPressClient.create_post`.
+        """
+        return getattr(self.client.set_instance(obj), self.client.post_methods[method_name])()
+
+    def upload_media(self, operations):
+        for operation, obj in operations:
+            try:
+                if obj.file_thumbnail or not isinstance(obj, Artist):  # thumbnail of music and album is downloaded
+                    self.client.set_instance(obj).create_media()
+            except Exception as e:
+                self.fail(operation, e)
+            else:
+                self.done(operation)
+
+    def create_posts(self, operations, method_name):
+        errors = {}
+        new = []
+        for operation, obj in operations:
+            if get_wp_id(obj):  # created by an earlier try or by the other publishes
+                continue
+            try:
+                if operation.attempts == 1:
+                    new.append(obj)
+                else:
+                    self.create_post(obj, method_name)
+            except Exception as e:
+                errors[obj.id] = e
+
+        if settings.WP_PUBLISH_MODE == WordPressClient.BATCH_MODE:
+            self.client.create_batch(new, method_name)
+        else:
+            for obj in new:
+                try:
+                    self.client.set_instance(obj).create_post(*self.prepare_post(obj, method_name), update_acf=False)
+                except Exception as e:
+                    errors[obj.id] = e
+
+        for operation, obj in operations:
+            if get_wp_id(obj):
+                self.post_done(operation)
+            else:
+                self.fail(operation, errors.get(obj.id, 'post is not created'))
+
+    def create_post(self, obj, method_name):
+        """
+        Creating the post of a retried operation, the post that is created by the earlier try is used.
+        """
+        post = self.prepare_post(obj, method_name)
+        url_name, acf_url_name, payload_data, fields = post
+        wp_id = self.client.find_post(url_name, payload_data)
+        if wp_id:
+            logger.info(f'[post is found by marker]-[obj: {obj}]-[wordpress id: {wp_id}]')
+            self.client.save_wp_id(wp_id)
+        else:
+            self.client.create_post(*post, update_acf=False)
+
+    def post_done(self, operation):
+        """
+        The ACF fields are updated by the next operation in `separate` mode, the post and the queuing of next
+        operation are saved together.
+        """
+        if settings.WP_PUBLISH_MODE != WordPressClient.SEPARATE_MODE:
+            self.done(operation, published=True)
+            return
+
+        with transaction.atomic():
+            self.done(operation)
+            PublishOutbox.objects.bulk_create([PublishOutbox(
+                object_type=operation.object_type,
+                object_id=operation.object_id,
+                operation=PublishOutbox.UPDATE_ACF_OPERATION,
+                idempotency_key=PublishOutbox.get_idempotency_key(
+                    PublishOutbox.UPDATE_ACF_OPERATION, operation.object_type, operation.object_id
+                ),
+                batch_id=operation.batch_id,
+            )], ignore_conflicts=True)
+
+    def update_acf_fields(self, operations, method_name):
+        for operation, obj in operations:
+            wp_id = get_wp_id(obj)
+            if not wp_id:
+                self.fail(operation, 'post is not created', permanent=True)
+                continue
+            try:
+                url_name, acf_url_name, payload_data, fields = self.prepare_post(obj, method_name)
+                self.client.update_acf_fields(fields, f"{self.client.urls[acf_url_name]}{wp_id}/")
+            except Exception as e:
+                self.fail(operation, e)
+            else:
+                self.done(operation, published=True)
+
+    def done(self, operation, published=False):
+        """
+        :param published: True if it's the last operation of the object's publish.
+        """
+        operation.status = PublishOutbox.DONE_STATUS
+        operation.error = ''
+        operation.save(update_fields=['status', 'error', 'updated_time'])
+        self.handled.add(operation.id)
+        if published and operation.batch_id:
+            PublishProgress(operation.batch_id).add(1, 0)
+
+    def fail(self, operation, error, permanent=False):
+        """
+        The failed operation is retried after an exponential backoff, it fails permanently after
+        `WP_OUTBOX_MAX_ATTEMPTS` tries.
+        """
+        operation.error = str(error)
+        if permanent or operation.attempts >= settings.WP_OUTBOX_MAX_ATTEMPTS:
+            operation.status = PublishOutbox.FAILED_STATUS
+            logger.error(f'[outbox operation failed]-[operation: {operation}]-[error: {error}]')
+        else:
+            delay = min(settings.WP_OUTBOX_RETRY_DELAY * 2 ** (operation.attempts - 1), self.max_retry_delay)
+            operation.available_time = timezone.now() + timedelta(seconds=delay)
+            logger.warning(
+                f'[outbox operation will be retried]-[operation: {operation}]-[attempts: {operation.attempts}]'
+                f'-[delay: {delay}s]-[error: {error}]'
+            )
+        operation.save(update_fields=['status', 'error', 'available_time', 'updated_time'])
+        self.handled.add(operation.id)
+        if operation.status == PublishOutbox.FAILED_STATUS and operation.batch_id:
+            PublishProgress(operation.batch_id).add(0, 1)
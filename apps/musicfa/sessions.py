@@ -0,0 +1,257 @@
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+THROTTLE_STATUS_CODES = (429, 503)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class HostRateLimiter:
+    """
+    Token bucket of one host, its rate is adapted by AIMD: the rate is increased by `increase` after each
+    successful response and multiplied by `decrease` when the host is throttling us (429, 503).
+    """
+
+    def __init__(self, host, rate, min_rate, max_rate, burst, increase=0.1, decrease=0.5):
+        self.host = host
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocking until a request could be sent to the host.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, retry_after=None):
+        """
+        :param retry_after: seconds that the host asked us to wait (`Retry-After` header).
+        """
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            logger.warning(
+                f'[host is throttling]-[host: {self.host}]-[new rate: {self.rate:.2f} req/s]'
+                f'-[retry after: {retry_after}]'
+            )
+
+
+def get_crawler_rate_limits():
+    return dict(
+        rate=settings.CRAWLER_RATE_LIMIT,
+        min_rate=settings.CRAWLER_RATE_LIMIT_MIN,
+        max_rate=settings.CRAWLER_RATE_LIMIT_MAX,
+        burst=settings.CRAWLER_RATE_LIMIT_BURST,
+    )
+
+
+def get_rate_limiter(host, rate_limits=None):
+    """
+    :param host: host name, etc. dl.nicmusic.net
+    :param rate_limits: rate, min_rate, max_rate and burst of the limiter if it's created, the crawler limits
+     by default.
+    :return: the rate limiter of host that is shared between all the sessions.
+    """
+    with _rate_limiters_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = HostRateLimiter(host, **(rate_limits or get_crawler_rate_limits()))
+        return _rate_limiters[host]
+
+
+def parse_retry_after(value):
+    """
+    :param value: `Retry-After` header, seconds or an HTTP date.
+    :return: seconds to wait or None.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    `HTTPAdapter` that applies a default timeout to every request which is sent without one,
+    `requests.Session` has no session wide timeout by itself.
+    """
+    __attrs__ = HTTPAdapter.__attrs__ + ['timeout']
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class RateLimitedHTTPAdapter(TimeoutHTTPAdapter):
+    """
+    Each request waits for the rate limiter of its host. Throttled responses (429, 503), connection errors and
+    timeouts are retried after `Retry-After` or an exponential backoff. Only the idempotent methods are retried,
+    a retried POST could create the same object twice. A `Retry-After` longer than `retry_after_max` is not
+    waited for, the throttled response is returned.
+    """
+    __attrs__ = TimeoutHTTPAdapter.__attrs__ + [
+        'retries', 'backoff_factor', 'backoff_max', 'retry_after_max', 'rate_limits'
+    ]
+
+    def __init__(self, *args, retries=None, backoff_factor=None, backoff_max=None, retry_after_max=None,
+                 rate_limits=None, **kwargs):
+        self.rate_limits = rate_limits
+        self.retries = settings.CRAWLER_RETRIES if retries is None else retries
+        self.backoff_factor = settings.CRAWLER_BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+        self.backoff_max = settings.CRAWLER_BACKOFF_MAX if backoff_max is None else backoff_max
+        self.retry_after_max = settings.CRAWLER_RETRY_AFTER_MAX if retry_after_max is None else retry_after_max
+        super().__init__(*args, **kwargs)
+
+    def get_backoff(self, attempt):
+        # full jitter, so the workers that failed together do not retry together
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * 2 ** attempt))
+
+    def send(self, request, **kwargs):
+        limiter = get_rate_limiter(urlparse(request.url).netloc, self.rate_limits)
+        attempt = 0
+        while True:
+            limiter.acquire()
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retries or request.method not in IDEMPOTENT_METHODS:
+                    raise
+                delay = self.get_backoff(attempt)
+                logger.warning(f'[request failed, retrying]-[exc: {e}]-[delay: {delay:.1f}s]-[URL: {request.url}]')
+            else:
+                if response.status_code not in THROTTLE_STATUS_CODES:
+                    limiter.on_success()
+                    return response
+
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                # the host and the worker are not blocked longer than `retry_after_max`
+                limiter.on_throttle(min(retry_after, self.retry_after_max) if retry_after else retry_after)
+                if retry_after and retry_after > self.retry_after_max:
+                    logger.warning(
+                        f'[request throttled, not retrying]-[retry after: {retry_after:.0f}s]-[URL: {request.url}]'
+                    )
+                    return response
+                if attempt >= self.retries or request.method not in IDEMPOTENT_METHODS:
+                    return response
+                response.close()
+                delay = max(retry_after or 0, self.get_backoff(attempt))
+                logger.warning(
+                    f'[request throttled, retrying]-[status code: {response.status_code}]-[delay: {delay:.1f}s]'
+                    f'-[URL: {request.url}]'
+                )
+            attempt += 1
+            time.sleep(delay)
+
+
+def create_session(pool_connections=None, pool_maxsize=None, host_pool_sizes=None, timeout=None, retries=None,
+                   rate_limits=None):
+    """
+    Creating a keep-alive session that reuses the connections of each host, requests of each host are
+    rate limited and retried by `RateLimitedHTTPAdapter`.
+    :param pool_connections: number of hosts that their pools are kept.
+    :param pool_maxsize: number of connections that are kept open for each host.
+    :param host_pool_sizes: a dict of host and pool size to override `pool_maxsize` for that host.
+    :param timeout: default timeout of the requests, (connect timeout, read timeout).
+    :param retries: retries of the idempotent requests, `CRAWLER_RETRIES` by default.
+    :param rate_limits: limits of the hosts, see `get_rate_limiter`.
+    :return: `requests.Session` object.
+    """
+    pool_connections = pool_connections or settings.CRAWLER_POOL_CONNECTIONS
+    pool_maxsize = pool_maxsize or settings.CRAWLER_POOL_MAXSIZE
+    timeout = timeout or (settings.CRAWLER_CONNECT_TIMEOUT, settings.CRAWLER_READ_TIMEOUT)
+    adapter_kwargs = dict(timeout=timeout, retries=retries, rate_limits=rate_limits)
+
+    session = requests.Session()
+    adapter = RateLimitedHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, **adapter_kwargs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    for host, size in (host_pool_sizes or {}).items():
+        host_adapter = RateLimitedHTTPAdapter(pool_connections=1, pool_maxsize=size, **adapter_kwargs)
+        session.mount(f'http://{host}/', host_adapter)
+        session.mount(f'https://{host}/', host_adapter)
+    return session
+
+
+def get_session(name, **kwargs):
+    """
+    Getting the shared session of `name` (etc. website name of crawler), the session will be created at first call.
+    :param name: name of the session owner.
+    :param kwargs: arguments of `create_session`.
+    :return: `requests.Session` object.
+    """
+    with _sessions_lock:
+        if name not in _sessions:
+            logger.debug(f'[creating new http session]-[name: {name}]-[kwargs: {kwargs}]')
+            _sessions[name] = create_session(**kwargs)
+        return _sessions[name]
+
+
+def get_wordpress_session():
+    """
+    Session of WordPress client, it has its own pool, timeout and rate limits (`WP_*` settings) and doesn't
+    share the limits of the crawled hosts.
+    """
+    return get_session(
+        'wordpress',
+        pool_connections=1,
+        pool_maxsize=settings.WP_POOL_MAXSIZE,
+        timeout=(settings.WP_CONNECT_TIMEOUT, settings.WP_READ_TIMEOUT),
+        retries=settings.WP_RETRIES,
+        rate_limits=dict(
+            rate=settings.WP_RATE_LIMIT,
+            min_rate=settings.WP_RATE_LIMIT_MIN,
+            max_rate=settings.WP_RATE_LIMIT_MAX,
+            burst=settings.WP_RATE_LIMIT_BURST,
+        ),
+    )
@@ -1,40 +1,146 @@
+import hashlib
+import logging
 from importlib import import_module
 
-from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from celery import group, shared_task
 from celery.task import periodic_task
 from celery.schedules import crontab
 
-from .crawler import NicMusicCrawler, Ganja2MusicCrawler
-from .utils import stop_duplicate_task, WordPressClient, update_title_tag_field_ganja2
+from .crawler import Crawler, NicMusicCrawler, Ganja2MusicCrawler, get_crawler
+from .export_admin import export_queryset, delete_expired_exports
+from .outbox import enqueue_publish, dispatch_outbox
+from .utils import (
+    stop_duplicate_task, WordPressClient, update_title_tag_field_ganja2, acquire_slot, release_slot, PublishProgress
+)
 from .models import CMusic, Album, Artist
 
+logger = logging.getLogger(__name__)
 
-@shared_task
-def create_artist_wordpress_task(*object_ids):
-    for q in Artist.objects.filter(id__in=object_ids):
-        WordPressClient(q).create_artist()
 
+def publish_to_wordpress(task, name, object_ids, user_id=None):
+    """
+    Fanning out the publish of objects to chunk tasks (`create_*_task`), they run in parallel as much as
+    `WP_PUBLISH_CONCURRENCY` allows.
+    :param task: one of `create_artist_wordpress_task`, `create_single_music_post_task` or `create_album_post_task`.
+    :param name: name of the published objects for the progress, etc. music
+    :param object_ids: ids of the objects.
+    :param user_id: user who started the publish.
+    :return: `PublishProgress` of the publish.
+    """
+    if settings.WP_PUBLISH_OUTBOX:
+        return enqueue_publish(name, object_ids, user_id)
 
-@shared_task
-def create_single_music_post_task(*object_ids):
+    object_ids = list(object_ids)
+    size = settings.WP_PUBLISH_CHUNK_SIZE
+    chunks = [object_ids[i:i + size] for i in range(0, len(object_ids), size)]
+    progress = PublishProgress.start(name, len(object_ids), len(chunks), user_id)
+    group(task.signature(chunk, {'batch_id': progress.batch_id}) for chunk in chunks).apply_async()
+    return progress
+
+
+def publish_objects(task, queryset, object_ids, method_name, batch_id=None):
+    """
+    Publishing a chunk of objects by a shared `WordPressClient`, the task is retried later when the other chunks
+    are using all the publish slots.
+    :param task: the bound celery task.
+    :param queryset: objects of the chunk.
+    :param object_ids: ids of the chunk.
+    :param method_name: method of `WordPressClient` that publishes an object, etc. create_album
+    :param batch_id: id of `PublishProgress`.
+    """
+    slot = acquire_slot('wordpress_publish', settings.WP_PUBLISH_CONCURRENCY, settings.WP_PUBLISH_SLOT_TIMEOUT)
+    if slot is None:
+        raise task.retry(countdown=settings.WP_PUBLISH_RETRY_DELAY)
+
+    published = 0
+    try:
+        client = WordPressClient()
+        if settings.WP_PUBLISH_MODE == WordPressClient.BATCH_MODE:
+            published = client.create_batch(queryset, method_name)
+            return
+
+        for obj in queryset:
+            try:
+                getattr(client.set_instance(obj), method_name)()
+                published += 1
+            except Exception as e:
+                logger.error(f'[publishing failed]-[obj: {obj}]-[method: {method_name}]-[exc: {e}]')
+    finally:
+        release_slot('wordpress_publish', slot)
+        if batch_id:
+            PublishProgress(batch_id).add(published, len(object_ids) - published)
+
+
+@shared_task(bind=True, max_retries=None)
+def create_artist_wordpress_task(self, *object_ids, batch_id=None):
+    publish_objects(self, Artist.objects.filter(id__in=object_ids), object_ids, 'create_artist', batch_id)
+
+
+@shared_task(bind=True, max_retries=None)
+def create_single_music_post_task(self, *object_ids, batch_id=None):
     """
     Creating a post (single music) on Word press from CMusic object
     :param object_ids: tuple of CMusic's id object
+    :param batch_id: id of `PublishProgress` when the task is a chunk of `publish_to_wordpress`.
     :return: None
     """
-    for q in CMusic.objects.filter(id__in=object_ids):
-        WordPressClient(q).create_single_music()
+    publish_objects(
+        self, CMusic.objects.select_related('artist').filter(id__in=object_ids), object_ids, 'create_single_music',
+        batch_id
+    )
 
 
-@shared_task
-def create_album_post_task(*object_ids):
+@shared_task(bind=True, max_retries=None)
+def create_album_post_task(self, *object_ids, batch_id=None):
     """
     Creating a post (album) on Word press from Album and CMusic object
     :param object_ids: tuple of Album's id object
+    :param batch_id: id of `PublishProgress` when the task is a chunk of `publish_to_wordpress`.
+    :return: None
+    """
+    publish_objects(
+        self, Album.objects.select_related('artist').filter(id__in=object_ids), object_ids, 'create_album', batch_id
+    )
+
+
+@shared_task
+def dispatch_outbox_task():
+    """
+    Running the pending operations of publish outbox, see `outbox.dispatch_outbox`.
+    """
+    dispatch_outbox()
+
+
+@periodic_task(run_every=crontab(minute='*'))
+def periodic_dispatch_outbox():
+    """
+    Running the retried operations of publish outbox and the ones that their dispatch task is lost.
     :return: None
     """
-    for q in Album.objects.filter(id__in=object_ids):
-        WordPressClient(q).create_album()
+    dispatch_outbox()
+
+
+@shared_task
+def export_queryset_task(model_label, resource_path, format_path, user_id, object_ids=None, params=None):
+    """
+    Writing the export file of an admin export action, see `BackgroundExportActionMixin`.
+    """
+    export_queryset(model_label, resource_path, format_path, user_id, object_ids, params)
+
+
+@periodic_task(run_every=crontab(hour=4, minute=0))
+def delete_expired_exports_task():
+    delete_expired_exports()
+
+
+@periodic_task(run_every=crontab(hour=4, minute=30))
+def delete_expired_partials_task():
+    Crawler.delete_expired_partials()
 
 
 @shared_task
@@ -72,13 +178,125 @@ def update_title_tag_field_ganja2_task():
     update_title_tag_field_ganja2(200)
 
 
+def start_pipeline(crawler):
+    """
+    Starting the crawl pipeline of a website, the files of the objects that are saved before (etc. their download
+    failed) are downloaded by `collect_files_task` and the new posts are discovered.
+    :param crawler: crawler of a website.
+    :return: None
+    """
+    collect_files_task.delay(crawler.website_name, timezone.now().isoformat())
+    discover_posts(crawler)
+
+
+def get_in_flight_key(website_name, post_url):
+    return f'crawl_in_flight_{website_name}_{hashlib.sha1(post_url.encode()).hexdigest()}'
+
+
+def release_in_flight(website_name, post_urls):
+    """
+    The posts are parsed and saved (or failed), the next crawl could discover them again.
+    """
+    cache.delete_many([get_in_flight_key(website_name, post_url) for post_url in post_urls])
+
+
+def discover_posts(crawler):
+    """
+    Discovery stage of crawl pipeline, the links of new posts are sent to `parse_posts_task` by chunks of
+    `CRAWLER_PIPELINE_CHUNK_SIZE` as soon as they are found. The crawl lock is released after discovery, so the
+    posts that the tasks of previous crawl are still parsing or saving are marked in cache and not sent again.
+    :param crawler: crawler of a website.
+    :return: None
+    """
+    size = settings.CRAWLER_PIPELINE_CHUNK_SIZE
+    chunks = {}  # post type: links
+    for post_type, post_url in crawler.discover_posts():
+        in_flight_key = get_in_flight_key(crawler.website_name, post_url)
+        if not cache.add(in_flight_key, 1, settings.CRAWLER_IN_FLIGHT_TIMEOUT):
+            logger.info(f'[post is in flight]-[URL: {post_url}]-[website: {crawler.website_name}]')
+            continue
+        chunk = chunks.setdefault(post_type, [])
+        chunk.append(post_url)
+        if len(chunk) >= size:
+            parse_posts_task.delay(crawler.website_name, post_type, chunks.pop(post_type))
+    for post_type, chunk in chunks.items():
+        parse_posts_task.delay(crawler.website_name, post_type, chunk)
+
+
+@shared_task
+def parse_posts_task(website_name, post_type, post_urls):
+    """
+    Parse stage of crawl pipeline, fetching and parsing the detail of posts.
+    :param website_name: nicmusic or ganja2music.
+    :param post_type: `CMusic.SINGLE_TYPE` or `Crawler.ALBUM_POST`.
+    :param post_urls: links of the posts.
+    :return: None
+    """
+    posts = []
+    try:
+        posts = get_crawler(website_name).parse_posts(post_type, post_urls)
+    finally:
+        if not posts:
+            release_in_flight(website_name, post_urls)
+    logger.info(f'[posts parsed]-[website: {website_name}]-[posts: {len(posts)} of {len(post_urls)}]')
+    if posts:
+        persist_posts_task.delay(website_name, posts, post_urls)
+
+
+@shared_task
+def persist_posts_task(website_name, posts, post_urls=()):
+    """
+    Persistence stage of crawl pipeline, saving the parsed posts and their artists.
+    :param website_name: nicmusic or ganja2music.
+    :param posts: the parsed posts, see `Crawler.make_post`.
+    :param post_urls: links of the parsed chunk, they are not in flight anymore.
+    :return: None
+    """
+    try:
+        saved = get_crawler(website_name).persist_posts(posts)
+    finally:
+        release_in_flight(website_name, post_urls)
+    size = settings.CRAWLER_PIPELINE_CHUNK_SIZE
+    for model_name, object_ids in saved.items():
+        for i in range(0, len(object_ids), size):
+            download_files_task.delay(website_name, model_name, object_ids[i:i + size])
+
+
+@shared_task
+def download_files_task(website_name, model_name, object_ids):
+    """
+    Download stage of crawl pipeline.
+    :param website_name: nicmusic or ganja2music.
+    :param model_name: cmusic or album.
+    :param object_ids: ids of the objects that their files are downloaded.
+    :return: None
+    """
+    get_crawler(website_name).download_new_files(model_name, object_ids)
+
+
+@shared_task
+def collect_files_task(website_name, created_before):
+    """
+    Backlog stage of crawl pipeline, downloading the files of the objects that are saved before the crawl
+    started. The objects of current crawl are downloaded by `download_files_task`.
+    :param website_name: nicmusic or ganja2music.
+    :param created_before: start time of the crawl in ISO format.
+    :return: None
+    """
+    get_crawler(website_name).collect_files(parse_datetime(created_before))
+
+
 @stop_duplicate_task
 def collect_musics_nic():
     """
-    Collecting the single musics of nicmusic after that downloading the files of them.
+    Collecting the single musics of nicmusic after that downloading the files of them. By `CRAWLER_PIPELINE` the
+    new posts are just discovered here and the next stages run by their own tasks.
     :return: None
     """
     crawler = NicMusicCrawler()
+    if settings.CRAWLER_PIPELINE:
+        start_pipeline(crawler)
+        return
     crawler.collect_musics()
     crawler.collect_files()
 
@@ -86,9 +304,13 @@ def collect_musics_nic():
 @stop_duplicate_task
 def collect_musics_ganja():
     """
-    Collecting the albums and single musics of ganja2music after that downloading the files of them.
+    Collecting the albums and single musics of ganja2music after that downloading the files of them. By
+    `CRAWLER_PIPELINE` the new posts are just discovered here and the next stages run by their own tasks.
     :return: None
     """
     crawler = Ganja2MusicCrawler()
+    if settings.CRAWLER_PIPELINE:
+        start_pipeline(crawler)
+        return
     crawler.collect_musics()
     crawler.collect_files()
@@ -1,6 +1,741 @@
-from django.test import TestCase
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+from datetime import date
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from unittest import mock
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .crawler import ArtistResolver, BulkWriter, Crawler, NicMusicCrawler
+from .export_admin import export_queryset
+from .fake_wordpress import FakeWordPress
+from .models import Artist, Album, CMusic, AdminExport, PublishOutbox
+from .outbox import OutboxDispatcher
+from .tasks import discover_posts, persist_posts_task
+from .sessions import HostRateLimiter, RateLimitedHTTPAdapter, get_rate_limiter, parse_retry_after
+from .apps import check_shared_cache
+from .utils import (
+    WordPressClient, PublishProgress, advisory_lock, checking_task_status, get_advisory_lock_key, stop_duplicate_task
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def respond(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.stub.requests.append((self.command, self.path, dict(self.headers)))
+        status, headers, body = self.server.stub.respond(self)
+        if status is None:  # dropping the connection without a response
+            self.close_connection = True
+            return
+        self.send_response(status)
+        headers.setdefault('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if int(headers['Content-Length']) != len(body):  # a cut download
+            self.close_connection = True
+
+
+class StubServer:
+    """
+    Local HTTP server of the tests, `respond(handler)` returns (status, headers, body) of each request.
+    """
+
+    def __init__(self, respond=None):
+        self.respond = respond or (lambda handler: (200, {}, b''))
+        self.requests = []  # (method, path, headers)
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def host(self):
+        return '%s:%s' % self.server.server_address[:2]
+
+    def url(self, path='/'):
+        return f'http://{self.host}{path}'
+
+    def reply(self, *responses):
+        """
+        Answering the requests by `responses` in order, the last one is repeated.
+        """
+        responses = list(responses)
+        self.respond = lambda handler: responses.pop(0) if len(responses) > 1 else responses[0]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class HostRateLimiterTests(SimpleTestCase):
+
+    def test_rate_is_increased_additively_and_decreased_multiplicatively(self):
+        limiter = HostRateLimiter('host', rate=4, min_rate=1, max_rate=5, burst=1, increase=0.5, decrease=0.5)
+        limiter.on_success()
+        self.assertEqual(limiter.rate, 4.5)
+        limiter.on_throttle()
+        self.assertEqual(limiter.rate, 2.25)
+        for _ in range(5):
+            limiter.on_throttle()
+        self.assertEqual(limiter.rate, 1)
+        for _ in range(20):
+            limiter.on_success()
+        self.assertEqual(limiter.rate, 5)
+
+    def test_retry_after_blocks_the_host(self):
+        limiter = HostRateLimiter('host', rate=100, min_rate=1, max_rate=100, burst=10)
+        limiter.on_throttle(retry_after=0.3)
+        start = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after('3'), 3)
+        self.assertEqual(parse_retry_after('-1'), 0)
+        self.assertAlmostEqual(parse_retry_after(formatdate(time.time() + 60, usegmt=True)), 60, delta=2)
+        self.assertIsNone(parse_retry_after('soon'))
+        self.assertIsNone(parse_retry_after(None))
+
+
+class RateLimitedHTTPAdapterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.addCleanup(self.stub.stop)
+        self.session = requests.Session()
+        self.session.mount('http://', RateLimitedHTTPAdapter(retries=2, backoff_factor=0.01, backoff_max=0.05))
+
+    def test_throttled_get_is_retried_after_retry_after(self):
+        self.stub.reply((429, {'Retry-After': '0.3'}, b''), (200, {}, b'ok'))
+        rate = get_rate_limiter(self.stub.host).rate
+
+        start = time.monotonic()
+        response = self.session.get(self.stub.url())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+        self.assertLess(get_rate_limiter(self.stub.host).rate, rate)
+
+    def test_throttled_response_is_returned_after_the_retries(self):
+        self.stub.reply((503, {}, b''))
+        response = self.session.get(self.stub.url())
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_throttled_post_is_not_retried(self):
+        self.stub.reply((503, {}, b''), (201, {}, b''))
+        response = self.session.post(self.stub.url(), json={'title': 'post'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual([method for method, path, headers in self.stub.requests], ['POST'])
+
+    def test_post_is_not_retried_after_connection_error(self):
+        self.stub.reply((None, {}, b''), (201, {}, b''))
+        with self.assertRaises(requests.ConnectionError):
+            self.session.post(self.stub.url(), json={'title': 'post'})
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_long_retry_after_is_not_waited_for(self):
+        self.session.mount('http://', RateLimitedHTTPAdapter(retries=2, retry_after_max=1))
+        self.stub.reply((429, {'Retry-After': '86400'}, b''), (200, {}, b'ok'))
+
+        start = time.monotonic()
+        response = self.session.get(self.stub.url())
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertLess(time.monotonic() - start, 1)
+        # the other requests of host wait for the cap at most
+        self.assertLessEqual(get_rate_limiter(self.stub.host).blocked_until, time.monotonic() + 1)
+
+
+class WordPressSessionTests(SimpleTestCase):
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.addCleanup(self.stub.stop)
+        self.client = WordPressClient()
+        self.client.base_url = self.stub.url()
+
+    def test_throttled_post_is_sent_once(self):
+        self.stub.reply((503, {}, b'{}'), (201, {}, b'{"id": 1}'))
+        with self.assertRaises(requests.HTTPError):
+            self.client.post_request('wp/v2/music', json={'title': 'music'})
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_requests_are_not_limited_by_the_crawler_rate(self):
+        self.stub.reply((201, {}, b'{"id": 1}'))
+        start = time.monotonic()
+        for _ in range(40):
+            self.client.post_request('wp/v2/music', json={'title': 'music'})
+        self.assertLess(time.monotonic() - start, 40 / settings.CRAWLER_RATE_LIMIT / 2)
+
+
+class PublishProgressTests(TestCase):
+
+    def test_counters_are_created_if_missing(self):
+        # etc. started by a process that doesn't share the cache or expired
+        progress = PublishProgress('missing')
+        progress.add(2, 1)
+        self.assertEqual(progress.incr('published', 0), 2)
+        self.assertIsNone(progress.summary())
+
+    def test_progress_is_finished(self):
+        progress = PublishProgress.start('music', 3, 2)
+        progress.add(2, 0)
+        self.assertFalse(progress.summary()['finished'])
+        progress.add(0, 1)
+        self.assertEqual(progress.summary()['published'], 2)
+        self.assertTrue(progress.summary()['finished'])
+
+    def test_process_local_cache_is_rejected(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache'}}):
+            self.assertEqual(check_shared_cache(None), [])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['musicfa.W001'])
+
+    def test_missing_cache_table_does_not_break_admin(self):
+        cache_settings = {'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'missing_cache_table'
+        }}
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@localhost', 'password'))
+        with override_settings(CACHES=cache_settings):
+            PublishProgress.start('music', 1, 1, user_id=1).add(1, 0)
+            response = self.client.get(reverse('admin:musicfa_cmusic_changelist'))
+        self.assertEqual(response.status_code, 200)
+
+class ResumeContentTests(SimpleTestCase):
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.addCleanup(self.stub.stop)
+        partial_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, partial_root)
+        self.part_path = os.path.join(partial_root, 'mp3_320', 'song.mp3.part')
+
+        session = requests.Session()
+
+        class StubCrawler(Crawler):
+            download_chunk_size = 500
+
+            @classmethod
+            def get_session(cls):
+                return session
+
+        self.crawler = StubCrawler
+        self.content = os.urandom(5000)
+        self.etag = '"v1"'
+
+    def serve_file(self, cut_at=None):
+        """
+        Serving `content` by range requests like a download host, the response is cut after `cut_at` bytes.
+        """
+        def respond(handler):
+            body, status, headers = self.content, 200, {'ETag': self.etag}
+            range_header = handler.headers.get('Range')
+            if range_header and handler.headers.get('If-Range') == self.etag:
+                offset = int(range_header[len('bytes='):-1])
+                body, status = self.content[offset:], 206
+                headers['Content-Range'] = f'bytes {offset}-{len(self.content) - 1}/{len(self.content)}'
+            headers['Content-Length'] = str(len(body))
+            return status, headers, body if cut_at is None else body[:cut_at]
+
+        self.stub.respond = respond
+
+    def download(self):
+        self.crawler.resume_content(self.stub.url('/song.mp3'), self.part_path)
+
+    def read_part(self):
+        with open(self.part_path, 'rb') as f:
+            return f.read()
+
+    def test_interrupted_download_is_resumed_by_range(self):
+        self.serve_file(cut_at=2000)
+        with self.assertRaises(requests.RequestException):
+            self.download()
+        self.assertEqual(self.read_part(), self.content[:2000])
+
+        self.serve_file()
+        self.download()
+
+        headers = self.stub.requests[-1][2]
+        self.assertEqual(headers['Range'], 'bytes=2000-')
+        self.assertEqual(headers['If-Range'], self.etag)
+        self.assertEqual(self.read_part(), self.content)
+
+    def test_changed_file_is_downloaded_from_zero(self):
+        self.serve_file(cut_at=2000)
+        with self.assertRaises(requests.RequestException):
+            self.download()
+
+        self.content, self.etag = os.urandom(4000), '"v2"'
+        self.serve_file()
+        self.download()
+        self.assertEqual(self.read_part(), self.content)
+
+    def test_changed_length_drops_the_partial_file(self):
+        self.serve_file(cut_at=2000)
+        with self.assertRaises(requests.RequestException):
+            self.download()
+
+        self.content = self.content + b'more'  # same ETag but another length
+        self.serve_file()
+        with self.assertRaises(ValueError):
+            self.download()
+        self.assertFalse(os.path.exists(f'{self.part_path}.json'))
+
+
+class ExpiredPartialsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.partial_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.partial_root)
+        self.crawler_class = type('PartialCrawler', (Crawler,), {'partial_root': self.partial_root})
+
+    def create(self, path, age):
+        path = os.path.join(self.partial_root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write('x')
+        modified_time = time.time() - age
+        os.utime(path, (modified_time, modified_time))
+        return path
+
+    @override_settings(CRAWLER_PARTIAL_EXPIRE=3600)
+    def test_expired_partials_are_deleted(self):
+        self.create('old/a.mp3.part', 7200)
+        self.create('old/a.mp3.part.json', 7200)
+        self.create('old/orphan.mp3.part.json', 7200)
+        # the meta of a download that is still written is kept
+        active_meta = self.create('active/b.mp3.part.json', 7200)
+        active_part = self.create('active/b.mp3.part', 0)
+
+        self.assertEqual(self.crawler_class.delete_expired_partials(), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.partial_root, 'old')))
+        self.assertTrue(os.path.exists(active_meta))
+        self.assertTrue(os.path.exists(active_part))
+        self.assertTrue(os.path.exists(self.partial_root))
+
+
+class BulkWriterTests(TransactionTestCase):
+    """
+    The writer runs in autocommit like the crawl, a failed insert doesn't break the transaction of test.
+    """
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name_en='artist')
+
+    def music(self, **fields):
+        return {
+            'artist': self.artist, 'song_name_en': 'song', 'post_type': CMusic.SINGLE_TYPE,
+            'published_date': date(2020, 1, 1), 'wp_category_id': 1, **fields
+        }
+
+    def test_rows_are_inserted_by_batches(self):
+        writer = BulkWriter(batch_size=2)
+        writer.add_music('1', self.music())
+        self.assertEqual(CMusic.objects.count(), 0)
+        writer.add_music('2', self.music())
+        self.assertEqual(CMusic.objects.count(), 2)
+        writer.add_music('3', self.music())
+        writer.flush()
+        self.assertEqual(CMusic.objects.count(), 3)
+
+    def test_existing_site_ids_are_ignored(self):
+        CMusic.objects.create(site_id='1', **self.music(title='old'))
+        writer = BulkWriter()
+        writer.add_music('1', self.music(title='new'))
+        writer.add_music('2', self.music(title='new'))
+        writer.flush()
+        self.assertEqual(dict(CMusic.objects.values_list('site_id', 'title')), {'1': 'old', '2': 'new'})
+
+    def test_tracks_get_their_album_and_artist(self):
+        writer = BulkWriter()
+        tracks = [('t1', dict(song_name_en='t1', post_type=CMusic.ALBUM_MUSIC_TYPE, published_date=date(2020, 1, 1),
+                              wp_category_id=1))]
+        writer.add_album('a1', dict(artist=self.artist, published_date=date(2020, 1, 1), wp_category_id=1), tracks)
+        writer.flush()
+        track = CMusic.objects.get(site_id='t1')
+        self.assertEqual(track.album, Album.objects.get(site_id='a1'))
+        self.assertEqual(track.artist, self.artist)
+
+    def test_invalid_row_does_not_drop_its_batch(self):
+        writer = BulkWriter()
+        writer.add_music('1', self.music())
+        writer.add_music('2', self.music(published_date='not a date'))
+        writer.add_music('3', self.music())
+        writer.flush()
+        self.assertEqual(sorted(CMusic.objects.values_list('site_id', flat=True)), ['1', '3'])
+
+
+class DownloadObjectsTests(TransactionTestCase):
+
+    def test_thread_connections_are_reused_and_closed(self):
+        artist = Artist.objects.create(name_en='artist')
+        musics = [CMusic.objects.create(
+            site_id=str(i), artist=artist, song_name_en='song', post_type=CMusic.SINGLE_TYPE,
+            published_date=date(2020, 1, 1), wp_category_id=1
+        ) for i in range(6)]
+        opened = []
+
+        def store_file(obj, field_name):
+            Artist.objects.count()  # a query by the connection of thread
+            opened.append(connections[DEFAULT_DB_ALIAS].connection)
+            return True
+
+        crawler = NicMusicCrawler()
+        crawler.download_workers = 2
+        with mock.patch.object(crawler, 'store_file', side_effect=store_file):
+            crawler.download_objects(musics, lambda obj: ['mp3_320'])
+
+        self.assertEqual(CMusic.objects.filter(is_downloaded=True).count(), 6)
+        # one connection of each thread
+        self.assertLessEqual(len(set(opened)), 2)
+        self.assertTrue(all(pg_connection.closed for pg_connection in opened))
+
+
+class KnownPageUrlsTests(TransactionTestCase):
+
+    def test_website_name_is_host_of_post(self):
+        # etc. a music that its website field is not filled yet
+        self.assertEqual(CMusic(page_url='https://nicmusic.net/post/1/').website_name, 'nicmusic.net')
+        self.assertEqual(Album(page_url='https://www.ganja2music.com/a/', website='ganja2music').website_name,
+                         'www.ganja2music.com')
+
+    def test_known_urls_of_the_website(self):
+        artist = Artist.objects.create(name_en='artist')
+        fields = dict(
+            artist=artist, song_name_en='song', post_type=CMusic.SINGLE_TYPE, published_date=date(2020, 1, 1),
+            wp_category_id=1
+        )
+        CMusic.objects.create(site_id='1', page_url='https://a/1', website=CMusic.NICMUSIC_WEBSITE, **fields)
+        CMusic.objects.create(site_id='2', page_url='https://a/2', website=CMusic.GANJA2MUSIC_WEBSITE, **fields)
+
+        known = NicMusicCrawler().get_known_page_urls(['https://a/1', 'https://a/2', 'https://a/3'])
+        self.assertEqual(known, {'https://a/1'})
+
+
+class PublishOutboxAdminTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@localhost', 'password'))
+
+    def operation(self, status):
+        return PublishOutbox.objects.create(
+            object_type=PublishOutbox.ARTIST_OBJECT,
+            object_id=1,
+            operation=PublishOutbox.CREATE_POST_OPERATION,
+            idempotency_key=PublishOutbox.get_idempotency_key(
+                PublishOutbox.CREATE_POST_OPERATION, PublishOutbox.ARTIST_OBJECT, 1
+            ),
+            status=status,
+            attempts=5,
+        )
+
+    def retry(self, operations):
+        with mock.patch('apps.musicfa.admin.dispatch_outbox_task.delay'):
+            self.client.post(reverse('admin:musicfa_publishoutbox_changelist'), {
+                'action': 'retry_operations', 'index': '0', '_selected_action': [op.id for op in operations]
+            })
+
+    def test_latest_failed_row_of_operation_is_retried(self):
+        # the operation is retried once and failed again
+        operations = [self.operation(PublishOutbox.FAILED_STATUS), self.operation(PublishOutbox.FAILED_STATUS)]
+        self.retry(operations)
+        self.assertEqual(
+            list(PublishOutbox.objects.order_by('id').values_list('status', flat=True)),
+            [PublishOutbox.FAILED_STATUS, PublishOutbox.PENDING_STATUS]
+        )
+
+    def test_pending_operation_is_not_queued_again(self):
+        failed = self.operation(PublishOutbox.FAILED_STATUS)
+        self.operation(PublishOutbox.PENDING_STATUS)
+        self.retry([failed])
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, PublishOutbox.FAILED_STATUS)
+
+
+class ChangeListQueryTests(TestCase):
+    """
+    The queries of a changelist page don't grow by its rows, etc. the artist of each music isn't loaded by its
+    own query.
+    """
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'admin@localhost', 'password'))
+        self.number = 0
+
+    def create_rows(self, count):
+        for _ in range(count):
+            self.number += 1
+            artist = Artist.objects.create(name_en=f'artist {self.number}', correct_names=[f'artist {self.number}'])
+            fields = dict(artist=artist, published_date=date(2020, 1, 1), wp_category_id=1)
+            album = Album.objects.create(site_id=f'a{self.number}', album_name_en='album', **fields)
+            CMusic.objects.create(
+                site_id=f's{self.number}', song_name_en='song', post_type=CMusic.SINGLE_TYPE, **fields
+            )
+            CMusic.objects.create(
+                site_id=f't{self.number}', song_name_en='track', post_type=CMusic.ALBUM_MUSIC_TYPE, album=album,
+                **fields
+            )
+
+    def assertChangeListQueries(self, model_name, number):
+        url = reverse(f'admin:musicfa_{model_name}_changelist')
+        self.create_rows(2)
+        with self.assertNumQueries(number):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.create_rows(10)
+        with self.assertNumQueries(number):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_music_changelist(self):
+        self.assertChangeListQueries('cmusic', 16)
+
+    def test_album_changelist(self):
+        self.assertChangeListQueries('album', 16)
+
+    def test_artist_changelist(self):
+        self.assertChangeListQueries('artist', 14)
+
+
+class CrawlPipelineTests(TestCase):
+
+    def setUp(self):
+        self.artist = Artist.objects.create(name_en='Ali')
+
+    def test_artist_created_by_another_worker_is_reused(self):
+        # the artist is created by another worker after the index missed it
+        with mock.patch.object(ArtistResolver, 'get', return_value=None):
+            artist = NicMusicCrawler().create_artist(name_en='Ali', name_fa='علی')
+        self.assertEqual(artist, self.artist)
+        self.assertEqual(Artist.objects.count(), 1)
+
+    def test_posts_in_flight_are_not_discovered_again(self):
+        crawler = NicMusicCrawler()
+        post_urls = ['https://a/1', 'https://a/2']
+        discovered = lambda: ((CMusic.SINGLE_TYPE, post_url) for post_url in post_urls)
+        with mock.patch.object(NicMusicCrawler, 'discover_posts', side_effect=discovered), \
+                mock.patch('apps.musicfa.tasks.parse_posts_task.delay') as delay:
+            discover_posts(crawler)
+            # the next crawl runs before the chunk is saved
+            discover_posts(crawler)
+            self.assertEqual(delay.call_count, 1)
+
+            persist_posts_task(crawler.website_name, [], post_urls)
+            discover_posts(crawler)
+            self.assertEqual(delay.call_count, 2)
+        delay.assert_called_with(crawler.website_name, CMusic.SINGLE_TYPE, post_urls)
+
+    def test_backlog_excludes_objects_of_current_crawl(self):
+        fields = dict(
+            artist=self.artist, song_name_en='song', post_type=CMusic.SINGLE_TYPE, published_date=date(2020, 1, 1),
+            wp_category_id=1, website=CMusic.NICMUSIC_WEBSITE
+        )
+        old = CMusic.objects.create(site_id='1', **fields)
+        started = timezone.now()
+        CMusic.objects.create(site_id='2', **fields)
+
+        crawler = NicMusicCrawler()
+        self.assertEqual(list(crawler.get_crawled_musics(started)), [old])
+        self.assertEqual(len(list(crawler.get_crawled_musics())), 2)
+
+
+class AdvisoryLockTests(TransactionTestCase):
+
+    def in_other_worker(self, func):
+        """
+        Running func by another database session, like a worker on another machine.
+        """
+        result = []
+
+        def run():
+            try:
+                result.append(func())
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def try_lock(self, name):
+        with advisory_lock(name) as locked:
+            return locked
+
+    def test_lock_is_held_by_one_session(self):
+        self.assertFalse(checking_task_status('collect_musics_nic'))
+        with advisory_lock('collect_musics_nic') as locked:
+            self.assertTrue(locked)
+            self.assertTrue(checking_task_status('collect_musics_nic'))
+            self.assertFalse(self.in_other_worker(lambda: self.try_lock('collect_musics_nic')))
+            self.assertFalse(checking_task_status('collect_musics_ganja'))
+        self.assertFalse(checking_task_status('collect_musics_nic'))
+        self.assertTrue(self.in_other_worker(lambda: self.try_lock('collect_musics_nic')))
+
+    def test_duplicate_task_is_stopped(self):
+        calls = []
+
+        @stop_duplicate_task
+        def collect():
+            calls.append(self.in_other_worker(collect))
+            raise RuntimeError('crawl failed')
+
+        with self.assertRaises(RuntimeError):
+            collect()
+        self.assertEqual(calls, [False])
+        # the lock is released by the failed task
+        self.assertFalse(checking_task_status('collect'))
+
+    def test_lock_of_dead_worker_is_released(self):
+        def die():
+            # the lock is taken and the connection is closed without unlocking
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_lock(%s)', [get_advisory_lock_key('collect_musics_nic')])
+            return checking_task_status('collect_musics_nic')
+
+        self.assertTrue(self.in_other_worker(die))
+        self.assertFalse(checking_task_status('collect_musics_nic'))
+
+
+class BackgroundExportTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser('admin', 'admin@localhost', 'password')
+        self.client.force_login(self.user)
+        artist = Artist.objects.create(name_en='artist')
+        fields = dict(artist=artist, song_name_en='song', published_date=date(2020, 1, 1), wp_category_id=1)
+        self.singles = [
+            CMusic.objects.create(site_id=str(i), post_type=CMusic.SINGLE_TYPE, **fields) for i in range(3)
+        ]
+        CMusic.objects.create(site_id='track', post_type=CMusic.ALBUM_MUSIC_TYPE, **fields)
+
+        export_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_root)
+        settings_override = override_settings(EXPORT_ROOT=export_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def export(self, query_string='', **data):
+        """
+        Running the export action, its task runs in place of the worker.
+        """
+        url = reverse('admin:musicfa_cmusic_changelist') + query_string
+        with mock.patch('apps.musicfa.tasks.export_queryset_task.apply_async') as apply_async:
+            self.client.post(url, {'action': 'export_admin_action', 'file_format': '0', 'index': '0', **data})
+        args, kwargs = apply_async.call_args[1]['args'], apply_async.call_args[1]['kwargs']
+        return export_queryset(*args, **kwargs)
+
+    def read_ids(self, file_path):
+        with open(file_path) as f:
+            return sorted(line.split(',')[0] for line in f.read().splitlines()[1:])
+
+    def test_selected_objects_are_exported(self):
+        file_path = self.export(_selected_action=[self.singles[0].id, self.singles[2].id])
+        self.assertEqual(self.read_ids(file_path), sorted([str(self.singles[0].id), str(self.singles[2].id)]))
+
+    def test_all_filtered_objects_are_exported(self):
+        file_path = self.export(
+            f'?post_type__exact={CMusic.SINGLE_TYPE}', _selected_action=[self.singles[0].id], select_across='1'
+        )
+        self.assertEqual(self.read_ids(file_path), sorted(str(music.id) for music in self.singles))
+
+    def test_user_is_notified_once(self):
+        file_path = self.export(_selected_action=[self.singles[0].id])
+        file_name = os.path.basename(file_path)
+
+        response = self.client.get(reverse('admin:musicfa_cmusic_changelist'))
+        self.assertContains(response, file_name)
+        response = self.client.get(reverse('admin:musicfa_cmusic_changelist'))
+        self.assertNotContains(response, file_name)
+        self.assertTrue(AdminExport.objects.get(file_name=file_name).is_notified)
+
+        response = self.client.get(reverse('admin:musicfa_cmusic_download_export', args=(file_name,)))
+        self.assertEqual(response.status_code, 200)
+
+
+class OutboxDispatcherTests(TestCase):
+
+    def setUp(self):
+        self.wordpress = FakeWordPress().start()
+        self.addCleanup(self.wordpress.stop)
+        self.dispatcher = OutboxDispatcher()
+        self.dispatcher.client.base_url = self.wordpress.url
+        self.dispatcher.client.token_cache_key = 'wordpress_test_auth_token'
+        self.artist = Artist.objects.create(name_en='Ali', name_fa='علی')
+
+    def operation(self, operation=PublishOutbox.CREATE_POST_OPERATION, attempts=2):
+        return PublishOutbox.objects.create(
+            object_type=PublishOutbox.ARTIST_OBJECT,
+            object_id=self.artist.id,
+            operation=operation,
+            idempotency_key=PublishOutbox.get_idempotency_key(
+                operation, PublishOutbox.ARTIST_OBJECT, self.artist.id
+            ),
+            attempts=attempts,
+        )
+
+    def test_post_of_other_object_is_not_reused(self):
+        # an unrelated artist with the same name and slug
+        other = dict(name='علی', slug='علی', meta={'delnava_object': 'artist:0'})
+        self.wordpress.create('artist', json.dumps(other).encode())
+
+        operation = self.operation()
+        self.dispatcher.run([operation])
+
+        self.artist.refresh_from_db()
+        operation.refresh_from_db()
+        self.assertEqual(operation.status, PublishOutbox.DONE_STATUS)
+        self.assertEqual(len(self.wordpress.objects), 2)
+        self.assertEqual(self.wordpress.objects[int(self.artist.wp_id)][1]['meta'], {
+            'delnava_object': f'artist:{self.artist.id}'
+        })
+
+    def test_post_of_interrupted_try_is_reused(self):
+        # the slug is renamed by WordPress since it's duplicate
+        created = dict(name='علی', slug='علی-2', meta={'delnava_object': f'artist:{self.artist.id}'})
+        status, post = self.wordpress.create('artist', json.dumps(created).encode())
+
+        self.dispatcher.run([self.operation()])
+
+        self.artist.refresh_from_db()
+        self.assertEqual(self.artist.wp_id, str(post['id']))
+        self.assertEqual(len(self.wordpress.objects), 1)
+
+    def test_failed_batch_is_retried_after_backoff(self):
+        operation = self.operation(PublishOutbox.UPLOAD_MEDIA_OPERATION, attempts=1)
+        with mock.patch.object(OutboxDispatcher, 'upload_media', side_effect=RuntimeError('broken')):
+            self.dispatcher.run([operation])
+
+        operation.refresh_from_db()
+        self.assertEqual(operation.status, PublishOutbox.PENDING_STATUS)
+        self.assertEqual(operation.error, 'broken')
+        self.assertGreater(operation.available_time, timezone.now())
 
-# Create your tests here.
 
 # from apps.musicfa.models import Artist, CMusic, Album
 # from django.db.models.functions import Lower
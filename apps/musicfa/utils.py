@@ -1,13 +1,18 @@
+import hashlib
 import json
 import os
 import logging
+from contextlib import contextmanager
+from uuid import uuid4
 from urllib.parse import unquote
 
 from django.conf import settings
 from django.core.cache import cache
+from django.db import connection, transaction
 
 import requests
-from pid import PidFile
+
+from .sessions import get_wordpress_session
 
 logger = logging.getLogger(__file__)
 file_handle = None
@@ -59,6 +64,17 @@ class UploadTo:
         return 'apps.musicfa.utils.UploadTo', [self.field_name], {}
 
 
+def get_sha256(file):
+    """
+    :param file: django File, it's read by chunks.
+    :return: hex digest of the sha256 of file content.
+    """
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
 def url_join(base_url, path):
     return "/".join(filter(None, map(lambda x: str(x).rstrip('/'), (base_url, path))))
 
@@ -70,44 +86,190 @@ def per_num_to_eng(number):
     return number.translate(translation_table)
 
 
-def checking_task_status(func_name):
-    if os.path.exists('./locks'):
-        items = os.listdir('./locks')
-        return True if f'{func_name}.pid' in items else False
-    return False
+def get_advisory_lock_key(name):
+    """
+    :return: bigint key of the Postgres advisory lock of `name`.
+    """
+    return int(hashlib.sha256(name.encode()).hexdigest()[:15], 16)
 
 
-def check_running(function_name):
-    if not os.path.exists('./locks'):
-        os.mkdir('./locks')
-    file_lock = PidFile(str(function_name), piddir='./locks')
+@contextmanager
+def advisory_lock(name):
+    """
+    Postgres advisory lock of `name` that is held by one worker at a time on all the machines. The lock belongs
+    to the database session, so the lock of a dead worker is released with its connection.
+    :return: True if the lock is taken, False if it's held by another worker.
+    """
+    key = get_advisory_lock_key(name)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [key])
+        locked = cursor.fetchone()[0]
     try:
-        file_lock.create()
-        return file_lock
-    except:
-        return None
+        yield locked
+    finally:
+        if locked:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [key])
+
+
+def is_advisory_locked(name):
+    """
+    :return: True if the advisory lock of `name` is held by a worker.
+    """
+    key = get_advisory_lock_key(name)
+    with connection.cursor() as cursor:
+        # a bigint key is kept in classid (high 32 bits) and objid (low 32 bits) of the lock
+        cursor.execute(
+            "SELECT EXISTS(SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND granted "
+            "AND database = (SELECT oid FROM pg_database WHERE datname = current_database()) "
+            "AND classid = %s::bigint::oid AND objid = %s::bigint::oid AND objsubid = 1)",
+            [key >> 32, key & 0xffffffff]
+        )
+        return cursor.fetchone()[0]
+
+
+def checking_task_status(func_name):
+    return is_advisory_locked(func_name)
 
 
 def stop_duplicate_task(func):
     def inner_function():
-        file_lock = check_running(func.__name__)
-        if not file_lock:
-            logger.info(f">> [Another {func.__name__} is already running]")
-            return False
-        func()
-        if file_lock:
-            file_lock.close()
+        with advisory_lock(func.__name__) as locked:
+            if not locked:
+                logger.info(f">> [Another {func.__name__} is already running]")
+                return False
+            func()
         return True
 
     return inner_function
 
 
+def acquire_slot(name, slots, timeout):
+    """
+    Taking one of the `slots` of `name` that are shared by cache between the workers, a slot that is not released
+    is freed after `timeout` seconds.
+    :return: number of the taken slot or None if all of them are taken.
+    """
+    for slot in range(slots):
+        if cache.add(f'{name}_slot_{slot}', 1, timeout):
+            return slot
+    return None
+
+
+def release_slot(name, slot):
+    cache.delete(f'{name}_slot_{slot}')
+
+
+@contextmanager
+def ignoring_cache_errors(action):
+    """
+    The errors of cache (etc. the table of database cache is not created) are logged and ignored.
+    """
+    try:
+        with transaction.atomic():  # a failed query of database cache doesn't break the current transaction
+            yield
+    except Exception as e:
+        logger.error(f'[cache error]-[action: {action}]-[exc: {e}]')
+
+
+class PublishProgress:
+    """
+    Progress of a WordPress publish that is fanned out to chunk tasks, the counters are kept in cache. The
+    progress is just shown to the users, so an error of cache doesn't stop the publish or the admin pages.
+    """
+    cache_timeout = 24 * 60 * 60
+
+    def __init__(self, batch_id):
+        self.batch_id = batch_id
+
+    @staticmethod
+    def get_user_cache_key(user_id):
+        return f'wordpress_publish_batches_{user_id}'
+
+    def get_cache_key(self, name):
+        return f'wordpress_publish_{self.batch_id}_{name}'
+
+    @classmethod
+    def start(cls, name, total, chunks, user_id=None, batch_id=None):
+        """
+        :param name: name of the published objects, etc. music
+        :param total: number of the objects.
+        :param chunks: number of chunk tasks.
+        :param user_id: user who started the publish, the progress is shown in the admin of this user.
+        :param batch_id: id of the progress, a new one is created by default.
+        """
+        progress = cls(batch_id or uuid4().hex[:12])
+        with ignoring_cache_errors('starting publish progress'):
+            cache.set_many({
+                progress.get_cache_key('info'): dict(name=name, total=total, chunks=chunks),
+                progress.get_cache_key('published'): 0,
+                progress.get_cache_key('failed'): 0,
+            }, cls.cache_timeout)
+            if user_id is not None:
+                user_cache_key = cls.get_user_cache_key(user_id)
+                cache.set(user_cache_key, cache.get(user_cache_key, []) + [progress.batch_id], cls.cache_timeout)
+        logger.info(f'[publishing started]-[batch: {progress.batch_id}]-[{name}: {total}]-[chunks: {chunks}]')
+        return progress
+
+    def incr(self, name, delta):
+        key = self.get_cache_key(name)
+        try:
+            return cache.incr(key, delta)
+        except ValueError:  # the counter is expired or evicted
+            cache.add(key, 0, self.cache_timeout)
+            return cache.incr(key, delta)
+
+    def add(self, published, failed):
+        with ignoring_cache_errors('adding publish progress'):
+            published = self.incr('published', published)
+            failed = self.incr('failed', failed)
+            info = cache.get(self.get_cache_key('info'))
+            if info and published + failed >= info['total']:
+                logger.info(
+                    f'[publishing finished]-[batch: {self.batch_id}]-[{info["name"]}: {info["total"]}]'
+                    f'-[published: {published}]-[failed: {failed}]'
+                )
+
+    def summary(self):
+        """
+        :return: dict of name, total, chunks, published, failed and finished or None if the batch is expired.
+        """
+        values = cache.get_many([self.get_cache_key(name) for name in ('info', 'published', 'failed')])
+        info = values.get(self.get_cache_key('info'))
+        if info is None:
+            return None
+        published = values.get(self.get_cache_key('published'), 0)
+        failed = values.get(self.get_cache_key('failed'), 0)
+        return dict(
+            **info, published=published, failed=failed, finished=published + failed >= info['total']
+        )
+
+    @classmethod
+    def pop_user_summaries(cls, user_id):
+        """
+        Summaries of the publishes of user, the finished ones are removed from the user's list.
+        """
+        user_cache_key = cls.get_user_cache_key(user_id)
+        summaries = []
+        running = []
+        with ignoring_cache_errors('reading publish summaries'):
+            for batch_id in cache.get(user_cache_key, []):
+                summary = cls(batch_id).summary()
+                if summary is None:
+                    continue
+                summaries.append(summary)
+                if not summary['finished']:
+                    running.append(batch_id)
+            cache.set(user_cache_key, running, cls.cache_timeout)
+        return summaries
+
+
 class WordPressClient:
     base_url = settings.WP_BASE_URL
     token_cache_key = 'wordpress_auth_token'
+    marker_meta_key = 'delnava_object'
     urls = {
         'token': 'jwt-auth/v1/token',
-        'validate-token': 'jwt-auth/v1/token/validate',
         'artist': 'wp/v2/artist/',
         'media': 'wp/v2/media/',
         'album': 'wp/v2/album/',
@@ -115,32 +277,70 @@ class WordPressClient:
         'acf_fields_artist': 'acf/v3/artist/',
         'acf_fields_music': 'acf/v3/music/',
         'acf_fields_album': 'acf/v3/album/',
+        'batch': 'batch/v1',
+    }
+    # publish modes, `separate` updates the ACF fields by a request after creating the post, `inline` sends them
+    # with the post and `batch` sends them with the post and creates the posts by `batch/v1` requests
+    SEPARATE_MODE = 'separate'
+    INLINE_MODE = 'inline'
+    BATCH_MODE = 'batch'
+    # methods that prepare the post of `create_*` methods
+    post_methods = {
+        'create_artist': 'get_artist_post',
+        'create_single_music': 'get_single_music_post',
+        'create_album': 'get_album_post',
     }
+    batch_unsupported_cache_key = 'wordpress_batch_unsupported'
+    # responses of an invalid or expired JWT token
+    unauthorized_status_codes = (401, 403)
 
-    def __init__(self, instance):
+    def __init__(self, instance=None):
         """
         This class will be used to create post (single music and album) at word press and update ACF fields
-         (custom fields).
+         (custom fields). A client could be shared between the objects by `set_instance`, the requests are sent by
+         a pooled session and the token is validated only when WordPress rejects it.
         Args:
             instance: Instance is CMusic or Album or Artist object.
         """
-        logger.debug(f'[sending {type(instance)} to wordpress]-[WP_URL: {self.base_url}]')
+        self.session = get_wordpress_session()
+        self.token = None
+        # uploaded media that their existence is checked by this client
+        self.checked_media_ids = set()
         self.thumbnail_download_error = False
+        self.instance = None
+        if instance is not None:
+            self.set_instance(instance)
+
+    def set_instance(self, instance):
+        logger.debug(f'[sending {type(instance)} to wordpress]-[WP_URL: {self.base_url}]')
         self.instance = instance
-        self.token = cache.get(self.token_cache_key) or self.get_token()
-        self.validate_token()
+        self.thumbnail_download_error = False
+        return self
 
-    def post_request(self, url, method='post', json_content=None, auth=None, **kwargs):
+    def post_request(self, url, method='post', json_content=None, auth=None, expected_status_codes=(), **kwargs):
+        """
+        :param expected_status_codes: error status codes that are returned instead of raising, etc. 404 of a check.
+        """
         headers = {}
         if json_content:
             headers.update({'Content-Type': 'application/json'})
         if auth:
+            self.token = self.token or cache.get(self.token_cache_key) or self.get_token()
             headers.update({'Authorization': f"Bearer {self.token}"})
 
         kwargs.update({'headers': headers})
         url = f"{self.base_url + url}"
         try:
-            r = requests.request(method, url, **kwargs)
+            r = self.session.request(method, url, **kwargs)
+            if auth and r.status_code in self.unauthorized_status_codes:
+                logger.debug(f'[JWT Token of WP is not valid or expired]-[status code: {r.status_code}]')
+                self.token = self.get_token()
+                headers.update({'Authorization': f"Bearer {self.token}"})
+                for file in kwargs.get('files', {}).values():
+                    file[1].seek(0)
+                r = self.session.request(method, url, **kwargs)
+            if r.status_code in expected_status_codes:
+                return r
             r.raise_for_status()
         except requests.exceptions.HTTPError as e:
             logger.error(
@@ -165,65 +365,55 @@ class WordPressClient:
         else:
             logger.critical(f'[Getting token failed]-[]')
 
-    def validate_token(self):
-        logger.debug(f"[validating the JWT Token]-[URL: {self.urls['validate-token']}]")
-        req = self.post_request(
-            self.urls['validate-token'],
-            auth=True,
-        )
-        if req.ok:
-            logger.debug(f'[Token is valid]')
-        else:
-            logger.debug(f'[JWT Token of WP is not valid or expired]-[token: {self.token}]')
-            self.token = self.get_token()
-
     def create_artist(self):
+        """
+        Create the artist (taxonomy term) of Artist object in Wordpress.
+        Returns: None
+        """
+        self.create_post(*self.get_artist_post())
+
+    def create_single_music(self):
+        """
+        Create a new Music to Wordpress from CMusic and Album object.
+        Returns: None
+        """
+        self.create_post(*self.get_single_music_post())
+
+    def create_album(self):
+        """
+        :return: None
+        """
+        self.create_post(*self.get_album_post())
+
+    def get_artist_post(self):
+        """
+        :return: (url name, ACF url name, payload, ACF fields) of the artist, see `create_post`.
+        """
         payload_data = dict(
             description=self.instance.description,
             name=self.instance.name_fa,
             slug=self.instance.name_fa,
+            meta={self.marker_meta_key: self.get_post_marker()},
         )
+        logger.info(f'[creating artist]-[payload: {payload_data}]-[instance id: {self.instance.id}]')
 
-        req = self.post_request(
-            self.urls['artist'],
-            json_content=True,
-            auth=True,
-            json=payload_data,
-        )
-
-        if req.ok:
-            logger.info(f'[creating artist]-[payload: {payload_data}]-[instance id: {self.instance.id}]')
-
-            wp_id = req.json()['id']
-            logger.debug(f'[music posted successfully]-[wordpress id: {wp_id}]')
-            self.instance.wp_id = wp_id
-            self.instance.save()
-            media_id = ''
-
-            if self.instance.file_thumbnail:
-                media_id = self.create_media()
+        media_id = ''
+        if self.instance.file_thumbnail:
+            media_id = self.create_media()
 
-            fields = dict(
-                acf_fields=dict(
-                    artist_image=media_id,
-                    about_the_artist=self.instance.description,
-                )
+        fields = dict(
+            acf_fields=dict(
+                artist_image=media_id,
+                about_the_artist=self.instance.description,
             )
-            logger.info(f'[updating artist acf fields]-[payload: {fields}]')
-
-            self.update_acf_fields(fields, f"{self.urls['acf_fields_artist']}{wp_id}/")
-
-        else:
-            logger.error(f'[creating artist failed]-[obj id: {self.instance.id}]-[status code: {req.status_code}]')
-        return req
+        )
+        return 'artist', 'acf_fields_artist', payload_data, fields
 
-    def create_single_music(self):
+    def get_single_music_post(self):
         """
-        Create a new Music to Wordpress from CMusic and Album object.
-        Returns: None
+        The missing mp3 files of music are downloaded before the post is created.
+        :return: (url name, ACF url name, payload, ACF fields) of the single music, see `create_post`.
         """
-        from .models import CMusic
-
         media_id = self.create_media()  # Create media for this music
         payload_data = dict(
             title=f'دانلود آهنگ {self.instance.song_name_fa} از {self.instance.artist.name}',
@@ -235,73 +425,60 @@ class WordPressClient:
             categories=[self.instance.wp_category_id],
             artist=[self.instance.artist.wp_id],
             featured_media=media_id,
+            meta={self.marker_meta_key: self.get_post_marker()},
         )
-        if 'ganja' in self.instance.page_url:
+        if self.instance.website == self.instance.GANJA2MUSIC_WEBSITE:
             payload_data.update(
                 dict(slug=f"{self.instance.song_name_fa}-{self.instance.artist.name}")
             )
         else:
             payload_data.update(dict(slug=f"{self.instance.song_name_fa}"))
-        req = self.post_request(
-            self.urls['single_music'],
-            json_content=True,
-            auth=True,
-            json=payload_data,
-        )
         logger.info(f'[create single music]-[payload: {payload_data}]-[instance id: {self.instance.id}]')
 
-        if req.ok:
-            post_wp_id = req.json()['id']
-            logger.debug(f'[music posted successfully]-[wordpress id: {post_wp_id}]')
-            self.update_instance(
-                post_wp_id,
-                CMusic.APPROVED_STATUS
-            )
-            # ACF fields of single music
-            fields = dict(
-                acf_fields=dict(
-                    artist_name_persian=self.instance.artist.name_fa,
-                    artist_name_english=self.instance.artist.name_en,
-                    music_name_persian=self.instance.song_name_fa,
-                    music_name_english=self.instance.song_name_en,
-                ))
-            # 128 link
-            if self.instance.file_mp3_128:
-                fields['acf_fields']['link_128'] = self.instance.get_absolute_wp_url_128()
-            else:
-                logger.debug(f'[file_mp3_128 field is empty]-[obj: {self.instance}]')
-                fields['acf_fields']['link_128'] = self.download_music_file(
-                    self.instance.link_mp3_128, 'file_mp3_128', self.instance
-                ).get_absolute_wp_url_128()
-
-            # 320 link
-            if self.instance.file_mp3_320:
-                fields['acf_fields']['link_320'] = self.instance.get_absolute_wp_url_320()
-            else:
-                logger.debug(f'[file_mp3_320 field is empty]-[obj: {self.instance}]')
-                fields['acf_fields']['link_320'] = self.download_music_file(
-                    self.instance.link_mp3_128, 'file_mp3_320', self.instance
-                ).get_absolute_wp_url_320()
-
-            logger.info(f'[updating acf fields]-[payload: {fields}]-[instance id: {self.instance.id}]')
-            self.update_acf_fields(fields, f"{self.urls['acf_fields_music']}{self.instance.wp_post_id}/")
+        # ACF fields of single music
+        fields = dict(
+            acf_fields=dict(
+                artist_name_persian=self.instance.artist.name_fa,
+                artist_name_english=self.instance.artist.name_en,
+                music_name_persian=self.instance.song_name_fa,
+                music_name_english=self.instance.song_name_en,
+            ))
+        # 128 link
+        if self.instance.file_mp3_128:
+            fields['acf_fields']['link_128'] = self.instance.get_absolute_wp_url_128()
         else:
-            logger.error(
-                f'[creating single music post failed]-[obj id: {self.instance.id}]-[status code: {req.status_code}]')
+            logger.debug(f'[file_mp3_128 field is empty]-[obj: {self.instance}]')
+            fields['acf_fields']['link_128'] = self.download_music_file(
+                self.instance.link_mp3_128, 'file_mp3_128', self.instance
+            ).get_absolute_wp_url_128()
+
+        # 320 link
+        if self.instance.file_mp3_320:
+            fields['acf_fields']['link_320'] = self.instance.get_absolute_wp_url_320()
+        else:
+            logger.debug(f'[file_mp3_320 field is empty]-[obj: {self.instance}]')
+            fields['acf_fields']['link_320'] = self.download_music_file(
+                self.instance.link_mp3_128, 'file_mp3_320', self.instance
+            ).get_absolute_wp_url_320()
 
-    def create_album(self):
+        return 'single_music', 'acf_fields_music', payload_data, fields
+
+    def get_album_post(self):
         """
-        :return: None
+        The missing files of album tracks are downloaded before the post is created.
+        :return: (url name, ACF url name, payload, ACF fields) of the album, see `create_post`.
         """
-        from .models import Album, CMusic
+        from .models import CMusic
+
+        tracks = list(CMusic.objects.filter(album=self.instance).order_by('id'))
+        self.download_album_tracks(tracks)
 
         # Create media for this album
         media_id = self.create_media()
 
         musics_link = "".join([
-            f"<a href={music.get_absolute_wp_url_320() if music.get_absolute_wp_url_320() else self.download_music_file(music.link_mp3_320, 'file_mp3_320', music).get_absolute_wp_url_320()}>"
-            f"{music.song_name_fa or music.song_name_en}</a></br>"
-            for music in CMusic.objects.filter(album=self.instance)
+            f"<a href={music.get_absolute_wp_url_320()}>{music.song_name_fa or music.song_name_en}</a></br>"
+            for music in tracks
         ])  # track's link
 
         # updating the track's status of this album
@@ -316,44 +493,152 @@ class WordPressClient:
             format='standard',
             artist=[self.instance.artist.wp_id],
             categories=[self.instance.wp_category_id],
-            featured_media=media_id
+            featured_media=media_id,
+            meta={self.marker_meta_key: self.get_post_marker()},
         )
-        if 'ganja' in self.instance.page_url:
+        if self.instance.website == self.instance.GANJA2MUSIC_WEBSITE:
             payload_data.update(
                 dict(slug=f"{self.instance.album_name_fa}-{self.instance.artist.name}")
             )
         else:
             payload_data.update(dict(slug=f"{self.instance.album_name_fa}"))
+        logger.info(f'[create album music]-[payload: {payload_data}]-[instance id: {self.instance.id}]')
 
+        # ACF fields of album
+        fields = dict(
+            acf_fields=dict(
+                artist_name_persian=self.instance.artist.name_fa,
+                artist_name_english=self.instance.artist.name_en,
+                music_name_persian=self.instance.album_name_fa,
+                music_name_english=self.instance.album_name_en,
+                album_link=musics_link
+            ))
+        return 'album', 'acf_fields_album', payload_data, fields
+
+    def create_post(self, url_name, acf_url_name, payload_data, fields, update_acf=True):
+        """
+        Creating the post of instance, in `separate` mode the ACF fields are updated by another request after
+        creating the post and in the other modes they are sent with the post.
+        :param url_name: name of the post url in `urls`, etc. album
+        :param acf_url_name: name of the ACF url in `urls`, etc. acf_fields_album
+        :param payload_data: payload of the post.
+        :param fields: ACF fields of the post, etc. {'acf_fields': {...}}
+        :param update_acf: False to not update the ACF fields in `separate` mode, etc. they are updated later.
+        :return: None
+        """
+        inline = settings.WP_PUBLISH_MODE != self.SEPARATE_MODE
         req = self.post_request(
-            self.urls['album'],
+            self.urls[url_name],
             json_content=True,
             auth=True,
-            json=payload_data,
+            json={**payload_data, **fields} if inline else payload_data,
         )
-        logger.info(f'[create album music]-[payload: {payload_data}]-[instance id: {self.instance.id}]')
 
         if req.ok:
-            self.update_instance(
-                req.json()['id'],
-                Album.APPROVED_STATUS
-            )
+            wp_id = req.json()['id']
+            logger.debug(f'[{url_name} posted successfully]-[wordpress id: {wp_id}]')
+            self.save_wp_id(wp_id)
+            if not inline and update_acf:
+                logger.info(f'[updating acf fields]-[payload: {fields}]-[instance id: {self.instance.id}]')
+                self.update_acf_fields(fields, f"{self.urls[acf_url_name]}{wp_id}/")
+        else:
+            logger.error(
+                f'[creating {url_name} post failed]-[obj id: {self.instance.id}]-[status code: {req.status_code}]')
 
-            # ACF fields of album
-            fields = dict(
-                acf_fields=dict(
-                    artist_name_persian=self.instance.artist.name_fa,
-                    artist_name_english=self.instance.artist.name_en,
-                    music_name_persian=self.instance.album_name_fa,
-                    music_name_english=self.instance.album_name_en,
-                    album_link=musics_link
-                ))
-            logger.info(f'[updating acf fields]-[payload: {fields}]-[instance id: {self.instance.id}]')
+    def create_batch(self, objects, method_name):
+        """
+        Creating the posts of objects by the `batch/v1` endpoint of WordPress, each request creates
+        `WP_PUBLISH_BATCH_SIZE` posts with their ACF fields. The objects are created one by one by `method_name`
+        when WordPress doesn't support the batch requests (older than 5.6) or rejects a batch.
+        :param objects: Artist, CMusic or Album objects.
+        :param method_name: method that creates an object, etc. create_album
+        :return: number of created posts.
+        """
+        prepared = []
+        for obj in objects:
+            try:
+                prepared.append((obj, getattr(self.set_instance(obj), self.post_methods[method_name])()))
+            except Exception as e:
+                logger.error(f'[preparing post failed]-[obj: {obj}]-[method: {method_name}]-[exc: {e}]')
 
-            self.update_acf_fields(fields, f"{self.urls['acf_fields_album']}{self.instance.wp_post_id}/")
+        created = 0
+        size = settings.WP_PUBLISH_BATCH_SIZE
+        for i in range(0, len(prepared), size):
+            batch = prepared[i:i + size]
+            if not cache.get(self.batch_unsupported_cache_key):
+                try:
+                    responses = self.send_batch([post for obj, post in batch])
+                except Exception as e:
+                    logger.error(f'[batch request failed]-[exc: {e}]-[objects: {[obj.id for obj, post in batch]}]')
+                    continue
+                if responses is not None:
+                    created += self.save_batch_responses(batch, responses)
+                    continue
+
+            for obj, post in batch:
+                try:
+                    self.set_instance(obj).create_post(*post)
+                    created += 1
+                except Exception as e:
+                    logger.error(f'[publishing failed]-[obj: {obj}]-[method: {method_name}]-[exc: {e}]')
+        return created
+
+    def send_batch(self, posts):
+        """
+        :param posts: list of (url name, ACF url name, payload, ACF fields).
+        :return: responses of the posts by their order or None if the batch is not accepted.
+        """
+        req = self.post_request(
+            self.urls['batch'],
+            json_content=True,
+            auth=True,
+            json=dict(
+                validation='require-all-validate',
+                requests=[
+                    dict(method='POST', path=f"/{self.urls[url_name].strip('/')}", body={**payload_data, **fields})
+                    for url_name, acf_url_name, payload_data, fields in posts
+                ]
+            ),
+            expected_status_codes=(404,),
+        )
+        if req.status_code == 404:
+            logger.warning(f'[batch requests are not supported by wordpress]-[URL: {self.urls["batch"]}]')
+            cache.set(self.batch_unsupported_cache_key, True, 86400)
+            return None
+
+        content = req.json()
+        if content.get('failed'):
+            errors = [r['body'].get('code') for r in content['responses'] if r and r.get('status', 200) >= 400]
+            logger.warning(f'[batch request is rejected]-[failed: {content["failed"]}]-[errors: {errors}]')
+            if 'rest_batch_not_allowed' in errors:
+                cache.set(self.batch_unsupported_cache_key, True, 86400)
+            return None
+        return content['responses']
+
+    def save_batch_responses(self, batch, responses):
+        """
+        :param batch: list of (object, post) that are sent by a batch request.
+        :param responses: responses of the batch request by the order of its requests.
+        :return: number of created posts.
+        """
+        created = 0
+        for (obj, (url_name, *_)), response in zip(batch, responses):
+            self.set_instance(obj)
+            if response['status'] >= 400:
+                logger.error(
+                    f'[creating {url_name} post failed]-[obj id: {obj.id}]-[status code: {response["status"]}]'
+                    f'-[response: {response["body"]}]'
+                )
+                continue
+            wp_id = response['body']['id']
+            logger.debug(f'[{url_name} posted successfully]-[wordpress id: {wp_id}]')
+            self.save_wp_id(wp_id)
+            created += 1
+        return created
 
     def create_media(self):
         from .crawler import Crawler
+        from .models import WordPressMedia
 
         """
         Create a new Media object in Wordpress site to assign it to Wordpress Post as a `featured_media`.
@@ -362,21 +647,29 @@ class WordPressClient:
         Returns: media's id of uploaded image to wordpress site
         """
         if self.instance.file_thumbnail:
+            sha256 = self.get_thumbnail_sha256()
+            media_id = self.get_uploaded_media(sha256)
+            if media_id:
+                return media_id
+
             file_name = self.instance.file_thumbnail.name.split('/')[-1]
             payload_data = dict(status='draft')
-            req = self.post_request(
-                self.urls['media'],
-                auth=True,
-                data={'file': file_name, 'data': json.dumps(payload_data)},
-                files={'file': (
-                    file_name,
-                    open(self.instance.file_thumbnail.path, 'rb'),
-                    f'image/{file_name.split(".")[-1]}',
-                    {'Expires': '0'}
-                )},
-            )
+            with open(self.instance.file_thumbnail.path, 'rb') as file:
+                req = self.post_request(
+                    self.urls['media'],
+                    auth=True,
+                    data={'file': file_name, 'data': json.dumps(payload_data)},
+                    files={'file': (
+                        file_name,
+                        file,
+                        f'image/{file_name.split(".")[-1]}',
+                        {'Expires': '0'}
+                    )},
+                )
             media_id = req.json()['id']
             logger.debug(f'[media uploaded]-[instance id: {self.instance.id}]-[media id: {media_id}]')
+            WordPressMedia.objects.update_or_create(sha256=sha256, defaults=dict(media_id=media_id))
+            self.checked_media_ids.add(media_id)
             return media_id
         else:
             logger.debug(
@@ -386,7 +679,7 @@ class WordPressClient:
             logger.debug(f'[downloading thumbnail file...]-[obj: {self.instance}]')
 
             # downloading the thumbnail
-            self.instance.file_thumbnail = Crawler.download_content(self.instance.link_thumbnail)
+            Crawler().store_file(self.instance, 'thumbnail')
             try:
                 self.instance.save()
             except Exception as e:
@@ -396,6 +689,70 @@ class WordPressClient:
                     self.thumbnail_download_error = True  # adding this to break the possible loop
                     return self.create_media()
 
+    def get_thumbnail_sha256(self):
+        """
+        :return: sha256 of the thumbnail content, the hash of the stored files is read from `MediaBlob`.
+        """
+        from .models import MediaBlob
+
+        sha256 = MediaBlob.objects.filter(
+            file=self.instance.file_thumbnail.name
+        ).values_list('sha256', flat=True).first()
+        if not sha256:
+            with self.instance.file_thumbnail.open('rb') as file:
+                sha256 = get_sha256(file)
+        return sha256
+
+    def get_uploaded_media(self, sha256):
+        """
+        The media that the same image is uploaded as it, the media that is deleted from WordPress is forgotten.
+        :param sha256: sha256 of the image content.
+        :return: media id or None if the image is not uploaded yet.
+        """
+        from .models import WordPressMedia
+
+        media = WordPressMedia.objects.filter(sha256=sha256).first()
+        if not media:
+            return None
+        if media.media_id in self.checked_media_ids:
+            return media.media_id
+
+        req = self.post_request(
+            f"{self.urls['media']}{media.media_id}/",
+            method='get',
+            auth=True,
+            params={'_fields': 'id', 'context': 'edit'},
+            expected_status_codes=(404, 410),
+        )
+        if req.status_code in (404, 410):
+            logger.debug(f'[uploaded media is missing]-[media id: {media.media_id}]-[sha256: {sha256}]')
+            media.delete()
+            return None
+
+        self.checked_media_ids.add(media.media_id)
+        logger.debug(f'[media found by content]-[instance id: {self.instance.id}]-[media id: {media.media_id}]')
+        return media.media_id
+
+    def download_album_tracks(self, tracks):
+        """
+        Downloading the missing 320 files of the album tracks at the same time before rendering the album post,
+        the tracks are updated in place.
+        :param tracks: CMusic objects of the album.
+        :return: None, raises ValueError if a file is not downloaded.
+        """
+        from .crawler import Crawler
+
+        missing = [music for music in tracks if not music.file_mp3_320]
+        if not missing:
+            return
+
+        logger.debug(f'[downloading album tracks]-[obj: {self.instance}]-[tracks: {len(missing)}]')
+        Crawler().download_objects(missing, lambda music: ['mp3_320'])
+
+        failed = [music.id for music in missing if not music.file_mp3_320]
+        if failed:
+            raise ValueError(f'files of album tracks are not downloaded (ids: {failed})')
+
     def download_music_file(self, url, field_name, instance):
         from .crawler import Crawler
 
@@ -408,6 +765,50 @@ class WordPressClient:
         except Exception:
             logger.error(f'[downloading music file failed]-[obj: {instance}]-[URL: {url}]')
 
+    def get_post_marker(self):
+        """
+        The marker of instance is kept in the meta of its post, so its post is told apart from the other posts
+        with the same title or slug.
+        :return: marker of the instance, etc. cmusic:12
+        """
+        return f'{self.instance._meta.model_name}:{self.instance.id}'
+
+    def find_post(self, url_name, payload_data):
+        """
+        Finding a post (or artist) that is created before for the instance, etc. the post of a publish that is
+        interrupted before saving its id. The posts are searched by title (or name) and only the post with the
+        marker of instance is returned, the slug isn't used since it is shared by the unrelated posts and
+        WordPress renames the duplicate slugs.
+        :param url_name: name of the post url in `urls`, etc. album
+        :param payload_data: payload of the post, see `create_post`.
+        :return: id of the post or None.
+        """
+        marker = payload_data['meta'][self.marker_meta_key]
+        req = self.post_request(
+            self.urls[url_name],
+            method='get',
+            auth=True,
+            params={
+                'search': payload_data.get('title') or payload_data['name'],
+                '_fields': 'id,meta',
+                'per_page': 100,
+            },
+        )
+        for post in req.json():
+            if (post.get('meta') or {}).get(self.marker_meta_key) == marker:
+                return post['id']
+        return None
+
+    def save_wp_id(self, wp_id):
+        """
+        Saving the id of created post (or artist) in the instance, the post of music or album is approved.
+        """
+        if hasattr(self.instance, 'wp_post_id'):
+            self.update_instance(wp_id, self.instance.APPROVED_STATUS)
+        else:
+            self.instance.wp_id = wp_id
+            self.instance.save()
+
     def update_instance(self, wp_id, status, **kwargs):
         self.instance.wp_post_id = wp_id
         self.instance.status = status
@@ -428,6 +829,23 @@ class WordPressClient:
                 f'[updating the ACF fields failed]-[instance id: {self.instance.id}]-[status code: {req.status_code}]')
 
 
+def fill_website_field():
+    """
+    Setting the `website` field of the CMusic and Album objects that were crawled before the field is added.
+    :return: number of updated musics and albums.
+    """
+    from .models import CMusic, Album
+
+    result = []
+    for model in (CMusic, Album):
+        updated = 0
+        for website, _name in model.WEBSITE_CHOICES:
+            updated += model.objects.filter(website='', page_url__contains=website).update(website=website)
+        logger.info(f'[website field filled]-[model: {model.__name__}]-[updated: {updated}]')
+        result.append(updated)
+    return result
+
+
 def delete_empty_albums():
     from .models import Album
 
@@ -438,7 +856,7 @@ def fix_link_128():
     from .models import CMusic
 
     for c in CMusic.objects.filter(
-            page_url__icontains='ganja'
+            website=CMusic.GANJA2MUSIC_WEBSITE
     ).exclude(
         link_mp3_128__icontains='ganja'
     ):
@@ -542,19 +960,21 @@ def update_artists_by_wordpress():
 
 
 def update_title_tag_field_ganja2(limit):
-    import requests
     from apps.musicfa.models import CMusic, Album
+    from apps.musicfa.crawler import Ganja2MusicCrawler
     from bs4 import BeautifulSoup
 
+    session = Ganja2MusicCrawler.get_session()
+
     # updating musics
     musics = CMusic.objects.filter(
-        page_url__contains='ganja2',
+        website=CMusic.GANJA2MUSIC_WEBSITE,
         post_type=CMusic.SINGLE_TYPE,
         title_tag=''
     )[:limit]
 
     for m in musics:
-        req = requests.get(m.page_url)
+        req = session.get(m.page_url)
         soup = BeautifulSoup(req.text, "html.parser")
         title_tag = soup.find('title').get_text()
         m.title_tag = title_tag
@@ -567,11 +987,11 @@ def update_title_tag_field_ganja2(limit):
 
     # updating albums
     albums = Album.objects.filter(
-        page_url__contains='ganja2',
+        website=Album.GANJA2MUSIC_WEBSITE,
         title_tag=''
     )[:limit]
     for a in albums:
-        req = requests.get(a.page_url)
+        req = session.get(a.page_url)
         soup = BeautifulSoup(req.text, "html.parser")
         title_tag = soup.find('title').get_text()
         a.title_tag = title_tag
@@ -1,31 +1,77 @@
+import csv
+
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseRedirect
-from django.shortcuts import render
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.urls import reverse_lazy
 
 from .models import CMusic
 from .tasks import run_crawl
 
 
+class Echo:
+    """
+    File like object that returns the written value instead of keeping it, so `csv.writer` rows could be streamed.
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(header, rows, bom=False, **writer_kwargs):
+    """
+    :param header: first row of csv.
+    :param rows: iterable of rows.
+    :param bom: writing the UTF-8 BOM at first, excel needs it to detect the encoding.
+    :param writer_kwargs: arguments of `csv.writer`.
+    :return: generator of the csv lines.
+    """
+    writer = csv.writer(Echo(), **writer_kwargs)
+    if bom:
+        yield '\ufeff'
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+EXPORT_FIELDS = (
+    'title', 'song_name_fa', 'song_name_en', 'lyrics', 'page_url', 'post_type', 'artist__name_fa', 'artist__name_en',
+    'link_mp3_128', 'link_mp3_320', 'link_thumbnail', 'published_date'
+)
+
+
+def get_export_rows():
+    """
+    Rows of `EXPORT_FIELDS` of all CMusic, they are read by chunks and the artist columns are joined in the query.
+    """
+    return CMusic.objects.order_by('id').values_list(*EXPORT_FIELDS).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+
 @login_required
 def export_musicfa_songs(request):
-    musics = CMusic.objects.all()
-    response = render(request,
-                      'export_songs.html',
-                      {'musics': musics},
-                      content_type='text/csv; charset=utf-8')
+    header = [
+        'title', 'song_name_fa', 'song_name_en', 'lyrics', 'post_name_url', 'post_type', 'category_fa', 'category_en',
+        'artist_name_fa', 'artist_name_en', 'link_mp3_128', 'link_mp3_320', 'link_mp3_demo', 'thumbnail_photo',
+        'published_date'
+    ]
+    # empty categories and demo link
+    rows = ((*row[:6], '', '', *row[6:10], '', *row[10:]) for row in get_export_rows())
+    response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv; charset=utf-8')
     response['Content-Disposition'] = 'attachment; filename="musicfa_songs.csv"'
     return response
 
 
 @login_required
 def export_nicmusic_songs(request):
-    musics = CMusic.objects.all()
-    response = render(request,
-                      'export_nimusic.html',
-                      {'musics': musics},
-                      content_type='text/csv; charset=utf-8-sig')
+    header = [
+        'title', 'song_name_fa', 'song_name_en', 'lyrics', 'post_name_url', 'post_type', 'category_fa', 'category_en',
+        'artist_name_fa', 'artist_name_en', 'link_mp3_128', 'link_mp3_320', 'thumbnail_photo', 'published_date'
+    ]
+    rows = ((*row[:6], 'پاپ', 'Pop', *row[6:]) for row in get_export_rows())
+    response = StreamingHttpResponse(
+        stream_csv(header, rows, bom=True, quoting=csv.QUOTE_ALL), content_type='text/csv; charset=utf-8'
+    )
     response['Content-Disposition'] = 'attachment; filename="nicmusic_songs.csv"'
     return response
 
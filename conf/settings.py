@@ -36,6 +36,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # apps
     'apps.musicfa',
@@ -144,11 +145,12 @@ CKEDITOR_CONFIGS = {
     },
 }
 
-# Cache
+# Cache, it's shared by the web and worker processes. The default database cache needs
+# `python manage.py createcachetable`, memcached is better for many workers since its increments are atomic
 CACHES = {
     'default': {
-        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache', cast=str),
-        'LOCATION': config('CACHE_HOST', default='', cast=str),
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.db.DatabaseCache', cast=str),
+        'LOCATION': config('CACHE_HOST', default='musicfa_cache', cast=str),
         'KEY_PREFIX': config('CACHE_PREFIX', default='GENERIC_MUSIC', cast=str),
     },
 }
@@ -160,6 +162,100 @@ WP_BASE_URL = config('WP_BASE_URL', cast=str)
 
 FTP_MEDIA_URL = config('FTP_MEDIA_URL')
 
+# Wordpress HTTP, the requests of WordPress have their own pool, timeouts (seconds) and rate limit (requests per
+# second). Only the idempotent requests (GET) are retried, a retried POST could create a duplicate post or media
+WP_POOL_MAXSIZE = config('WP_POOL_MAXSIZE', default=10, cast=int)
+WP_CONNECT_TIMEOUT = config('WP_CONNECT_TIMEOUT', default=10, cast=int)
+WP_READ_TIMEOUT = config('WP_READ_TIMEOUT', default=120, cast=int)
+WP_RATE_LIMIT = config('WP_RATE_LIMIT', default=50, cast=float)
+WP_RATE_LIMIT_MIN = config('WP_RATE_LIMIT_MIN', default=5, cast=float)
+WP_RATE_LIMIT_MAX = config('WP_RATE_LIMIT_MAX', default=200, cast=float)
+WP_RATE_LIMIT_BURST = config('WP_RATE_LIMIT_BURST', default=20, cast=int)
+WP_RETRIES = config('WP_RETRIES', default=3, cast=int)
+
+# Wordpress publish, objects are published by chunk tasks and at most `WP_PUBLISH_CONCURRENCY` chunks run together,
+# the other chunks are retried after `WP_PUBLISH_RETRY_DELAY` seconds
+WP_PUBLISH_CHUNK_SIZE = config('WP_PUBLISH_CHUNK_SIZE', default=20, cast=int)
+WP_PUBLISH_CONCURRENCY = config('WP_PUBLISH_CONCURRENCY', default=4, cast=int)
+WP_PUBLISH_RETRY_DELAY = config('WP_PUBLISH_RETRY_DELAY', default=15, cast=int)
+WP_PUBLISH_SLOT_TIMEOUT = config('WP_PUBLISH_SLOT_TIMEOUT', default=30 * 60, cast=int)
+
+# Wordpress publish mode, `separate` updates the ACF fields by another request, `inline` sends them with the post
+# and `batch` creates `WP_PUBLISH_BATCH_SIZE` posts by each `batch/v1` request (at most 25 by default in WordPress)
+WP_PUBLISH_MODE = config('WP_PUBLISH_MODE', default='separate', cast=str)
+WP_PUBLISH_BATCH_SIZE = config('WP_PUBLISH_BATCH_SIZE', default=25, cast=int)
+
+# Wordpress publish outbox, when `WP_PUBLISH_OUTBOX` is True the publishes are queued in `PublishOutbox` and run by
+# batches of `WP_OUTBOX_BATCH_SIZE` operations, a failed operation is retried `WP_OUTBOX_MAX_ATTEMPTS` times with an
+# exponential backoff from `WP_OUTBOX_RETRY_DELAY` seconds and a running one is retried after `WP_OUTBOX_LEASE`
+WP_PUBLISH_OUTBOX = config('WP_PUBLISH_OUTBOX', default=False, cast=bool)
+WP_OUTBOX_BATCH_SIZE = config('WP_OUTBOX_BATCH_SIZE', default=50, cast=int)
+WP_OUTBOX_MAX_ATTEMPTS = config('WP_OUTBOX_MAX_ATTEMPTS', default=5, cast=int)
+WP_OUTBOX_RETRY_DELAY = config('WP_OUTBOX_RETRY_DELAY', default=30, cast=int)
+WP_OUTBOX_LEASE = config('WP_OUTBOX_LEASE', default=10 * 60, cast=int)
+
+# Crawler HTTP
+CRAWLER_POOL_CONNECTIONS = config('CRAWLER_POOL_CONNECTIONS', default=10, cast=int)
+CRAWLER_POOL_MAXSIZE = config('CRAWLER_POOL_MAXSIZE', default=10, cast=int)
+# etc. "dl.nicmusic.net:20,dl.ganja2music.com:20"
+CRAWLER_HOST_POOL_SIZES = {
+    host: int(size) for host, size in (
+        item.split(':') for item in config('CRAWLER_HOST_POOL_SIZES', default='', cast=Csv())
+    )
+}
+CRAWLER_CONNECT_TIMEOUT = config('CRAWLER_CONNECT_TIMEOUT', default=10, cast=int)
+CRAWLER_READ_TIMEOUT = config('CRAWLER_READ_TIMEOUT', default=60, cast=int)
+# requests per second of each host, the rate is adapted between min and max by the responses of host
+CRAWLER_RATE_LIMIT = config('CRAWLER_RATE_LIMIT', default=5, cast=float)
+CRAWLER_RATE_LIMIT_MIN = config('CRAWLER_RATE_LIMIT_MIN', default=0.5, cast=float)
+CRAWLER_RATE_LIMIT_MAX = config('CRAWLER_RATE_LIMIT_MAX', default=20, cast=float)
+CRAWLER_RATE_LIMIT_BURST = config('CRAWLER_RATE_LIMIT_BURST', default=5, cast=int)
+# throttled and failed requests are retried by exponential backoff (seconds)
+CRAWLER_RETRIES = config('CRAWLER_RETRIES', default=3, cast=int)
+CRAWLER_BACKOFF_FACTOR = config('CRAWLER_BACKOFF_FACTOR', default=1, cast=float)
+CRAWLER_BACKOFF_MAX = config('CRAWLER_BACKOFF_MAX', default=60, cast=float)
+# a longer `Retry-After` (seconds) of a throttled request is not waited for, the request fails
+CRAWLER_RETRY_AFTER_MAX = config('CRAWLER_RETRY_AFTER_MAX', default=300, cast=float)
+# listing pages that are downloading at the same time and requested ahead of the parsing page
+CRAWLER_DISCOVERY_CONCURRENCY = config('CRAWLER_DISCOVERY_CONCURRENCY', default=4, cast=int)
+CRAWLER_DISCOVERY_LOOKAHEAD = config('CRAWLER_DISCOVERY_LOOKAHEAD', default=8, cast=int)
+# downloaded files are written to disk in chunks, bigger files than max size are dropped (bytes)
+CRAWLER_DOWNLOAD_CHUNK_SIZE = config('CRAWLER_DOWNLOAD_CHUNK_SIZE', default=64 * 1024, cast=int)
+CRAWLER_DOWNLOAD_MAX_SIZE = config('CRAWLER_DOWNLOAD_MAX_SIZE', default=300 * 1024 * 1024, cast=int)
+# interrupted downloads are kept here to resume them at the next try
+CRAWLER_PARTIAL_ROOT = config('CRAWLER_PARTIAL_ROOT', default=str(MEDIA_ROOT / 'partial'))
+# a partial file that is not changed for this time (seconds) is deleted, etc. its download is not tried again
+CRAWLER_PARTIAL_EXPIRE = config('CRAWLER_PARTIAL_EXPIRE', default=7 * 24 * 60 * 60, cast=int)
+# files are downloaded by a pool of workers, the downloads of each host are limited separately
+CRAWLER_DOWNLOAD_WORKERS = config('CRAWLER_DOWNLOAD_WORKERS', default=8, cast=int)
+CRAWLER_DOWNLOAD_HOST_WORKERS = config('CRAWLER_DOWNLOAD_HOST_WORKERS', default=4, cast=int)
+CRAWLER_DOWNLOAD_BATCH_SIZE = config('CRAWLER_DOWNLOAD_BATCH_SIZE', default=50, cast=int)
+# crawled posts are inserted in batches
+CRAWLER_WRITE_BATCH_SIZE = config('CRAWLER_WRITE_BATCH_SIZE', default=100, cast=int)
+# crawl runs as a pipeline of discovery, parse, persist and download tasks, each stage on its own queue
+CRAWLER_PIPELINE = config('CRAWLER_PIPELINE', default=False, cast=bool)
+CRAWLER_PIPELINE_CHUNK_SIZE = config('CRAWLER_PIPELINE_CHUNK_SIZE', default=20, cast=int)
+# the discovered posts are not discovered again until they are saved or this timeout (seconds) is passed
+CRAWLER_IN_FLIGHT_TIMEOUT = config('CRAWLER_IN_FLIGHT_TIMEOUT', default=6 * 60 * 60, cast=int)
+CELERY_TASK_ROUTES = {
+    'apps.musicfa.tasks.parse_posts_task': {'queue': 'crawl_parse'},
+    'apps.musicfa.tasks.persist_posts_task': {'queue': 'crawl_persist'},
+    'apps.musicfa.tasks.download_files_task': {'queue': 'crawl_download'},
+    'apps.musicfa.tasks.collect_files_task': {'queue': 'crawl_download'},
+}
+if CRAWLER_PIPELINE:
+    CELERY_TASK_ROUTES.update({
+        f'apps.musicfa.tasks.{name}': {'queue': 'crawl_discovery'}
+        for name in ('run_crawl', 'periodic_crawler_nic', 'periodic_crawler_ganja')
+    })
+
+# rows of the csv exports are read from database in chunks
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int)
+# files of the admin export actions, they are deleted after expire time (seconds). The web and worker
+# processes should share this directory (etc. a shared volume) to serve the files that the workers write.
+EXPORT_ROOT = config('EXPORT_ROOT', default=str(BASE_DIR / 'exports'))
+EXPORT_EXPIRE = config('EXPORT_EXPIRE', default=24 * 60 * 60, cast=int)
+
 # Logger Configuration
 LOG_DIR = BASE_DIR / 'logs'
 